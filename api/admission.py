@@ -0,0 +1,246 @@
+# admission.py
+#
+# Upstream admission control. Every model call first asks for room in two
+# token buckets, one for requests per minute and one for (estimated) tokens
+# per minute, sized below the upstream rate limits. Work that cannot run yet
+# waits in a priority queue, interactive /keyword-search turns ahead of
+# /itinerary plans and bulk batches; work that would wait longer than its
+# class allows is refused at once with a retry hint, which the endpoints
+# turn into 429 + Retry-After instead of piling up until gateway timeouts.
+# A session may only have a few calls queued or running at a time, so one
+# client hammering the API cannot take the whole budget.
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from api.timing import phase
+
+# Config
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_RPM = float(os.getenv("ADMISSION_RPM", "450"))  # keep below the upstream limit
+ADMISSION_TPM = float(os.getenv("ADMISSION_TPM", "250000"))
+ADMISSION_BURST_SECONDS = float(os.getenv("ADMISSION_BURST_SECONDS", "10"))  # budget usable at once
+ADMISSION_SESSION_LIMIT = int(os.getenv("ADMISSION_SESSION_LIMIT", "3"))  # queued + running per session
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "1000"))
+ADMISSION_MAX_WAIT_KEYWORD = float(os.getenv("ADMISSION_MAX_WAIT_KEYWORD", "5"))  # seconds
+ADMISSION_MAX_WAIT_ITINERARY = float(os.getenv("ADMISSION_MAX_WAIT_ITINERARY", "15"))
+ADMISSION_MAX_WAIT_BATCH = float(os.getenv("ADMISSION_MAX_WAIT_BATCH", "120"))
+
+# Lower runs first.
+PRIORITIES = {"keyword": 0, "itinerary": 1, "batch": 2}
+MAX_WAITS = {
+    "keyword": ADMISSION_MAX_WAIT_KEYWORD,
+    "itinerary": ADMISSION_MAX_WAIT_ITINERARY,
+    "batch": ADMISSION_MAX_WAIT_BATCH,
+}
+
+
+class AdmissionRejected(Exception):
+    """The call was not admitted; retry after ``retry_after`` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Upstream budget exhausted ({reason}); retry in {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Refills at ``per_minute / 60`` per second, holding at most ``burst_seconds`` of it.
+
+    Upstream per-minute limits are enforced over shorter windows, so a full
+    minute's budget spent in one burst would still be rejected.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = ADMISSION_BURST_SECONDS, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` is available (amounts above capacity count as full)."""
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def backlog_time(self, amount: float) -> float:
+        """Seconds until ``amount`` in total has been refilled, for work queued back to back."""
+        self._refill()
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class Ticket:
+    __slots__ = ("kind", "priority", "requests", "tokens", "session", "future", "queued_at", "released")
+
+    def __init__(self, kind: str, requests: int, tokens: int, session: Optional[str], future):
+        self.kind = kind
+        self.priority = PRIORITIES[kind]
+        self.requests = requests
+        self.tokens = tokens
+        self.session = session
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.released = False
+
+
+class AdmissionController:
+    """Admit upstream calls against RPM/TPM budgets, by priority, with per-session limits."""
+
+    def __init__(
+        self,
+        rpm: float = ADMISSION_RPM,
+        tpm: float = ADMISSION_TPM,
+        burst_seconds: float = ADMISSION_BURST_SECONDS,
+        session_limit: int = ADMISSION_SESSION_LIMIT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        max_waits: Optional[Dict[str, float]] = None,
+        enabled: bool = ADMISSION_ENABLED,
+        clock=time.monotonic,
+    ):
+        self.enabled = enabled
+        self.requests = TokenBucket(rpm, burst_seconds, clock)
+        self.tokens = TokenBucket(tpm, burst_seconds, clock)
+        self.session_limit = session_limit
+        self.max_queue = max_queue
+        self.max_waits = {**MAX_WAITS, **(max_waits or {})}
+        self._queue: List[tuple] = []  # (priority, seq, Ticket)
+        self._seq = itertools.count()
+        self._sessions: Dict[str, int] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {
+            kind: {"admitted": 0, "queued": 0, "rejected": 0, "wait_ms": 0.0, "max_wait_ms": 0.0}
+            for kind in PRIORITIES
+        }
+
+    def queued(self) -> int:
+        return sum(1 for _, _, ticket in self._queue if not ticket.future.done())
+
+    def predicted_wait(self, kind: str, requests: int, tokens: int) -> float:
+        """Seconds a new call would wait behind everything queued at its priority or above."""
+        priority = PRIORITIES[kind]
+        ahead = [t for _, _, t in self._queue if t.priority <= priority and not t.future.done()]
+        return max(
+            self.requests.backlog_time(sum(t.requests for t in ahead) + requests),
+            self.tokens.backlog_time(sum(t.tokens for t in ahead) + tokens),
+        )
+
+    def _reject(self, kind: str, reason: str, retry_after: float):
+        self.stats[kind]["rejected"] += 1
+        raise AdmissionRejected(reason, retry_after)
+
+    def _admit(self, ticket: Ticket):
+        self.requests.take(ticket.requests)
+        self.tokens.take(ticket.tokens)
+        waited = (time.monotonic() - ticket.queued_at) * 1000
+        stats = self.stats[ticket.kind]
+        stats["admitted"] += 1
+        stats["wait_ms"] += waited
+        stats["max_wait_ms"] = max(stats["max_wait_ms"], waited)
+
+    def _pump(self):
+        """Admit queued calls in priority order while the budgets allow."""
+        self._timer = None
+        while self._queue:
+            ticket = self._queue[0][2]
+            if ticket.future.done():  # gave up waiting
+                heapq.heappop(self._queue)
+                continue
+            wait = max(self.requests.wait_time(ticket.requests), self.tokens.wait_time(ticket.tokens))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._pump)
+                return
+            heapq.heappop(self._queue)
+            self._admit(ticket)
+            ticket.future.set_result(True)
+
+    async def acquire(
+        self, kind: str, tokens: int, session: Optional[str] = None, requests: int = 1
+    ) -> Optional[Ticket]:
+        """Wait for room for ``requests`` calls using about ``tokens`` tokens, or raise AdmissionRejected."""
+        if not self.enabled:
+            return None
+        if session is not None and self._sessions.get(session, 0) >= self.session_limit:
+            self._reject(kind, "session", 1.0)
+        wait = self.predicted_wait(kind, requests, tokens)
+        if wait > self.max_waits[kind]:
+            self._reject(kind, "budget", wait)
+        if len(self._queue) >= self.max_queue:
+            self._reject(kind, "queue", wait)
+
+        ticket = Ticket(kind, requests, tokens, session, asyncio.get_running_loop().create_future())
+        if session is not None:
+            self._sessions[session] = self._sessions.get(session, 0) + 1
+        heapq.heappush(self._queue, (ticket.priority, next(self._seq), ticket))
+        if self._timer is not None:
+            self._timer.cancel()
+        self._pump()
+        if ticket.future.done():
+            return ticket
+
+        self.stats[kind]["queued"] += 1
+        try:
+            await asyncio.wait({ticket.future}, timeout=self.max_waits[kind])
+        except asyncio.CancelledError:
+            if not ticket.future.done():
+                ticket.future.cancel()
+            self.release(ticket)
+            raise
+        if not ticket.future.done():
+            # Overtaken by higher-priority work; give up rather than wait on.
+            ticket.future.cancel()
+            self.release(ticket)
+            self._reject(kind, "deadline", self.predicted_wait(kind, requests, tokens))
+        return ticket
+
+    def release(self, ticket: Optional[Ticket]):
+        """End a call's session share; safe to call more than once."""
+        if ticket is None or ticket.released:
+            return
+        ticket.released = True
+        if ticket.session is not None:
+            remaining = self._sessions.get(ticket.session, 0) - 1
+            if remaining > 0:
+                self._sessions[ticket.session] = remaining
+            else:
+                self._sessions.pop(ticket.session, None)
+
+    @asynccontextmanager
+    async def admit(self, kind: str, tokens: int, session: Optional[str] = None, requests: int = 1):
+        with phase("queue"):
+            ticket = await self.acquire(kind, tokens, session, requests)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def snapshot(self) -> dict:
+        report = {"queued": self.queued(), "sessions": len(self._sessions)}
+        for kind, stats in self.stats.items():
+            admitted = stats["admitted"] or 1
+            report[kind] = {
+                "admitted": stats["admitted"],
+                "queued": stats["queued"],
+                "rejected": stats["rejected"],
+                "mean_wait_ms": round(stats["wait_ms"] / admitted, 1),
+                "max_wait_ms": round(stats["max_wait_ms"], 1),
+            }
+        return report
@@ -0,0 +1,143 @@
+# batch.py
+#
+# Bulk itinerary generation, used by /itinerary/batch and by the CLI below
+# for pre-generating campaign landing pages. Items run through the same
+# pipeline as /itinerary with a bounded number in flight; identical items
+# are planned once, and one NDJSON record is produced per item as soon as
+# it finishes, followed by a summary record.
+#
+#   python -m api.batch trips.jsonl > itineraries.ndjson
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import sys
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from fastapi import HTTPException
+
+# Config
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+batch_stats = {"batches": 0, "items": 0, "deduplicated": 0, "errors": 0}
+
+
+def ndjson(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+async def run_batch(
+    items: List,
+    key: Callable[[object], str],
+    plan: Callable[[object], Awaitable[tuple]],
+    concurrency: int = BATCH_CONCURRENCY,
+) -> AsyncIterator[dict]:
+    """Plan every item and yield one record per item in completion order.
+
+    ``key(item)`` is the item's canonical key, computed once per item off
+    the event loop and passed on as ``plan(item, request_key=key)``, which
+    returns ``(itinerary, served)`` like main.plan_trip and raises
+    HTTPException on failure. Records carry the item's index, status ("ok"
+    or "error"), timing and either the itinerary or the error.
+    """
+    started = time.perf_counter()
+    batch_stats["batches"] += 1
+    batch_stats["items"] += len(items)
+
+    # Identical items (same canonical key) are planned once.
+    keys = await asyncio.to_thread(lambda: [key(item) for item in items])
+    groups = {}
+    for index, item_key in enumerate(keys):
+        groups.setdefault(item_key, []).append(index)
+    batch_stats["deduplicated"] += len(items) - len(groups)
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(item_key, indices):
+        async with semaphore:
+            item_started = time.perf_counter()
+            try:
+                itinerary, served = await plan(items[indices[0]], request_key=item_key)
+                outcome = {"status": "ok", **served, "itinerary": itinerary}
+            except HTTPException as http_err:
+                outcome = {"status": "error", "code": http_err.status_code, "detail": http_err.detail}
+            except Exception as err:
+                logging.error("Batch item failed: %s", err)
+                outcome = {"status": "error", "code": 500, "detail": f"An unexpected error occurred: {err}"}
+            outcome["elapsed_ms"] = round((time.perf_counter() - item_started) * 1000, 1)
+            return indices, outcome
+
+    tasks = [asyncio.ensure_future(run(item_key, indices)) for item_key, indices in groups.items()]
+    counts = {"ok": 0, "error": 0}
+    try:
+        for finished in asyncio.as_completed(tasks):
+            indices, outcome = await finished
+            for position, index in enumerate(indices):
+                record = {"index": index, **outcome}
+                if position:
+                    record["duplicate_of"] = indices[0]
+                counts[outcome["status"]] += 1
+                yield record
+    finally:
+        # The client went away mid-batch: stop the remaining work.
+        for task in tasks:
+            task.cancel()
+    batch_stats["errors"] += counts["error"]
+    yield {
+        "summary": {
+            "items": len(items),
+            "unique": len(groups),
+            "ok": counts["ok"],
+            "errors": counts["error"],
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+    }
+
+
+def read_items(stream) -> List[dict]:
+    """Trips from a JSON array, an {"items": [...]} object or JSON Lines."""
+    text = stream.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = data.get("items", [data])
+    return data
+
+
+async def _main(args) -> int:
+    from api import llm
+    from api.main import OPENAI_API_KEY, TripRequest, itinerary_cache_key, plan_trip
+
+    with (open(args.input, "r", encoding="utf-8") if args.input != "-" else sys.stdin) as stream:
+        items = [TripRequest(**item) for item in read_items(stream)]
+    await llm.startup(OPENAI_API_KEY, args.base_url)
+    failed = 0
+    try:
+        plan = functools.partial(plan_trip, kind="batch")
+        async for record in run_batch(items, itinerary_cache_key, plan, args.concurrency):
+            failed += record.get("status") == "error"
+            sys.stdout.write(ndjson(record))
+            sys.stdout.flush()
+    finally:
+        await llm.shutdown()
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Pre-generate itineraries; writes NDJSON to stdout.")
+    parser.add_argument("input", help="JSON array or JSON Lines of TripRequest objects ('-' for stdin)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible upstream (defaults to LLM_BASE_URL)")
+    args = parser.parse_args(argv)
+    sys.exit(asyncio.run(_main(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# cache.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Config
+ITINERARY_CACHE_ENABLED = os.getenv("ITINERARY_CACHE_ENABLED", "true").lower() == "true"
+ITINERARY_CACHE_TTL = float(os.getenv("ITINERARY_CACHE_TTL", "86400"))  # seconds
+ITINERARY_CACHE_MAX_ENTRIES = int(os.getenv("ITINERARY_CACHE_MAX_ENTRIES", "512"))
+ITINERARY_CACHE_DIR = os.getenv("ITINERARY_CACHE_DIR", "/tmp/pocket-travel-cache")
+ITINERARY_CACHE_MAX_BYTES = int(os.getenv("ITINERARY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Bump when prompts or the response schema change so stale plans are not served.
+CACHE_VERSION = "5"
+
+
+# Free text typed by users; everything else (ids, URLs, choice data) stays byte-exact.
+FOLDED_FIELDS = frozenset({"input", "city", "country", "preferences", "language", "end_location"})
+
+
+def _normalize(value, fold: bool = False):
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold() if fold else value
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def canonical_key(payload: dict, *scope) -> str:
+    """Hash a request payload so equivalent requests share one cache entry.
+
+    Top-level free-text fields (FOLDED_FIELDS) are whitespace- and
+    case-normalized; identifiers, URLs and choice data are kept exact. Empty
+    fields are dropped and the order of ``choices`` does not matter. ``scope`` (model name, prompt
+    tier, ...) is mixed in so different generation settings never collide.
+    Thousands of choices take tens of milliseconds; call it off the event loop.
+    """
+    normalized = {
+        str(k): _normalize(v, fold=k in FOLDED_FIELDS) for k, v in payload.items() if v is not None
+    }
+    choices = normalized.pop("choices", None) if isinstance(normalized.get("choices"), list) else None
+    digest = hashlib.sha256()
+    digest.update(_dumps([CACHE_VERSION, *scope, normalized]).encode("utf-8"))
+    if choices is not None:
+        # Each choice is serialized and hashed once; sorting the hashes ignores their order.
+        digest.update(b"choices")
+        for choice_digest in sorted(hashlib.sha256(_dumps(c).encode("utf-8")).digest() for c in choices):
+            digest.update(choice_digest)
+    return digest.hexdigest()
+
+
+class ItineraryCache:
+    """Two-tier cache of successful itinerary responses.
+
+    An in-process LRU answers repeat requests without I/O; a directory of JSON
+    files survives restarts and is shared between workers on the same host.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = ITINERARY_CACHE_DIR,
+        ttl: float = ITINERARY_CACHE_TTL,
+        max_entries: int = ITINERARY_CACHE_MAX_ENTRIES,
+        max_bytes: int = ITINERARY_CACHE_MAX_BYTES,
+        clock=time.time,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires, value)
+        self._disk_bytes = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get_memory(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if entry[0] < self._clock():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return entry[1]
+
+    def put_memory(self, key: str, value: dict, expires: float):
+        with self._lock:
+            self._memory[key] = (expires, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get_disk(self, key: str):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires", 0) < self._clock():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry["expires"], entry["value"]
+
+    def put_disk(self, key: str, value: dict, expires: float):
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(_dumps({"expires": expires, "value": value}))
+            os.replace(tmp_path, path)  # atomic, so other workers never read half a file
+            self._trim_disk(os.path.getsize(path))
+        except OSError as os_err:
+            logging.error("Itinerary cache write failed: %s", os_err)
+
+    def _trim_disk(self, added: int):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for _, _, size in self._scan_disk())
+        else:
+            self._disk_bytes += added
+        if self._disk_bytes <= self.max_bytes:
+            return
+        # Drop the oldest files until we are back under 90% of the limit.
+        entries = sorted(self._scan_disk())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.stats["evictions"] += 1
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def _scan_disk(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield stat.st_mtime, path, stat.st_size
+
+    async def get(self, key: str) -> Tuple[Optional[dict], str]:
+        """Return ``(value, status)`` where status is HIT-MEMORY, HIT-DISK or MISS."""
+        value = self.get_memory(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value, "HIT-MEMORY"
+        entry = await asyncio.to_thread(self.get_disk, key)
+        if entry is not None:
+            expires, value = entry
+            self.put_memory(key, value, expires)
+            self.stats["disk_hits"] += 1
+            return value, "HIT-DISK"
+        self.stats["misses"] += 1
+        return None, "MISS"
+
+    async def set(self, key: str, value: dict):
+        expires = self._clock() + self.ttl
+        self.put_memory(key, value, expires)
+        self.stats["stores"] += 1
+        await asyncio.to_thread(self.put_disk, key, value, expires)
@@ -0,0 +1,267 @@
+# capture.py
+#
+# Opt-in capture of production traffic for replay (bench/replay.py). For
+# each /keyword-search and /itinerary request we keep the request body, the
+# prompt size and output of every model call it made, the status and the
+# phase timings, as one JSON line. The handler only hands raw bytes to a
+# bounded queue and never waits: decoding, redaction and writing happen on
+# a background thread in batches, and when the queue is full the record is
+# dropped and counted rather than slowing the request down. Each worker
+# process writes its own file, named after its pid (requests.<pid>.jsonl),
+# so gunicorn workers never append to or rotate each other's file; each
+# file is rotated by size (requests.<pid>.jsonl.1, ...).
+#
+# Redaction runs on the writer thread. By default e-mail addresses and
+# phone numbers in free text are masked and session IDs are replaced by a
+# keyed hash, so multi-turn sessions can still be replayed as one session;
+# add_redactor() registers further hooks.
+
+import contextvars
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from typing import Callable, List, Optional
+
+from api.timing import current_timer
+
+# Config
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() == "true"
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "captures/requests.jsonl")  # the worker's pid is inserted before the extension
+CAPTURE_ROUTES = tuple(filter(None, os.getenv("CAPTURE_ROUTES", "/keyword-search,/itinerary").split(",")))
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(64 * 1024 * 1024)))  # per file before rotating
+CAPTURE_BACKUPS = int(os.getenv("CAPTURE_BACKUPS", "5"))  # rotated files kept
+CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", "10000"))
+CAPTURE_BATCH = int(os.getenv("CAPTURE_BATCH", "256"))  # records per write
+CAPTURE_FLUSH_SECONDS = float(os.getenv("CAPTURE_FLUSH_SECONDS", "1"))
+CAPTURE_REDACT = os.getenv("CAPTURE_REDACT", "true").lower() == "true"
+CAPTURE_HASH_KEY = os.getenv("CAPTURE_HASH_KEY", "")  # set to keep session hashes stable across restarts
+
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+PHONE_PATTERN = re.compile(r"(?<!\w)\+?\d[\d\s().-]{7,}\d(?!\w)")
+SESSION_COOKIE = re.compile(r"(?:^|;\s*)session_id=([^;]+)")
+
+capture_stats = {"captured": 0, "dropped": 0, "written": 0, "rotations": 0, "errors": 0}
+
+_calls = contextvars.ContextVar("capture_calls", default=None)
+_hash_key = CAPTURE_HASH_KEY.encode() or os.urandom(16)
+
+
+def record_completion(model: str, messages: List[dict], response, elapsed_ms: float):
+    """Note one model call against the request being captured, if any."""
+    calls = _calls.get()
+    if calls is None:
+        return
+    usage = getattr(response, "usage", None)
+    choices = getattr(response, "choices", None) or []
+    calls.append({
+        "model": model,
+        "prompt_chars": sum(len(message.get("content") or "") for message in messages),
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "output": choices[0].message.content if choices else None,
+        "ms": round(elapsed_ms, 1),
+    })
+
+
+def hash_session(session_id: Optional[str]) -> Optional[str]:
+    if not session_id:
+        return None
+    return hmac.new(_hash_key, session_id.encode(), hashlib.sha256).hexdigest()[:24]
+
+
+def mask_text(text: str) -> str:
+    return PHONE_PATTERN.sub("<phone>", EMAIL_PATTERN.sub("<email>", text))
+
+
+def redact_free_text(record: dict) -> dict:
+    """Mask contact details in what users type and in model replies, and hash session IDs."""
+    body = record.get("request")
+    if isinstance(body, dict):
+        for field in ("input", "preferences", "end_location"):
+            if isinstance(body.get(field), str):
+                body[field] = mask_text(body[field])
+        if body.get("session_id"):
+            body["session_id"] = hash_session(body["session_id"])
+    for call in record.get("completions") or []:
+        if isinstance(call.get("output"), str):
+            call["output"] = mask_text(call["output"])
+    record["session"] = hash_session(record.get("session"))
+    return record
+
+
+_redactors: List[Callable[[dict], Optional[dict]]] = [redact_free_text] if CAPTURE_REDACT else []
+
+
+def add_redactor(redactor: Callable[[dict], Optional[dict]]):
+    """Run ``redactor(record)`` on every record before it is written; returning None drops it."""
+    _redactors.append(redactor)
+
+
+def worker_path(path: str) -> str:
+    """``captures/requests.jsonl`` -> ``captures/requests.<pid>.jsonl`` for this process."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{ext}"
+
+
+class CaptureWriter:
+    """Append records to a size-rotated JSONL file from a background thread."""
+
+    def __init__(
+        self,
+        path: str = CAPTURE_PATH,
+        max_bytes: int = CAPTURE_MAX_BYTES,
+        backups: int = CAPTURE_BACKUPS,
+        queue_size: int = CAPTURE_QUEUE_SIZE,
+        batch: int = CAPTURE_BATCH,
+        flush_seconds: float = CAPTURE_FLUSH_SECONDS,
+    ):
+        self.path = worker_path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch = batch
+        self.flush_seconds = flush_seconds
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._closed = threading.Event()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._writer = threading.Thread(target=self._write_loop, name="capture-writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, item: dict) -> bool:
+        """Queue a raw record without blocking; False if it was dropped."""
+        if self._closed.is_set():
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            capture_stats["dropped"] += 1
+            return False
+        capture_stats["captured"] += 1
+        return True
+
+    def _build(self, item: dict) -> Optional[bytes]:
+        body = item.pop("body", b"")
+        try:
+            item["request"] = json.loads(body) if body else None
+        except ValueError:
+            item["request"] = body.decode("utf-8", "replace")
+        for redactor in _redactors:
+            item = redactor(item)
+            if item is None:
+                return None
+        return (json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+    def _write_loop(self):
+        while not (self._closed.is_set() and self._queue.empty()):
+            try:
+                items = [self._queue.get(timeout=self.flush_seconds)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                lines = [line for line in map(self._build, items) if line is not None]
+                self._write(b"".join(lines))
+                capture_stats["written"] += len(lines)
+            except Exception as err:  # a bad record or full disk must not kill the thread
+                capture_stats["errors"] += 1
+                logging.error("Capture write failed: %s", err)
+
+    def _write(self, data: bytes):
+        if not data:
+            return
+        if self._file.tell() and self._file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "ab")
+        capture_stats["rotations"] += 1
+
+    def close(self):
+        """Write out what is queued and stop the thread."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._writer.join()
+        self._file.close()
+
+
+class CaptureMiddleware:
+    """ASGI middleware handing captured requests to a CaptureWriter.
+
+    Must sit inside TimingMiddleware so the request's phase timings and ID
+    are available when the response ends.
+    """
+
+    def __init__(self, app, writer: Optional[CaptureWriter] = None, routes=CAPTURE_ROUTES):
+        self.app = app
+        self.writer = writer
+        self.routes = set(routes)
+
+    async def __call__(self, scope, receive, send):
+        writer = self.writer
+        if writer is None or scope["type"] != "http" or scope.get("path") not in self.routes:
+            await self.app(scope, receive, send)
+            return
+        chunks = []
+        response = {"status": 500, "bytes": 0}
+        session = {"id": None}  # the cookie a new session was given
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for name, value in message.get("headers") or []:
+                    if name.lower() == b"set-cookie" and session["id"] is None:
+                        found = SESSION_COOKIE.match(value.decode("latin-1"))
+                        session["id"] = found.group(1) if found else None
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        cookie = SESSION_COOKIE.search(dict(scope.get("headers") or []).get(b"cookie", b"").decode("latin-1"))
+        calls = []
+        token = _calls.set(calls)
+        started = time.time()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            _calls.reset(token)
+            timer = current_timer()
+            writer.submit({
+                "ts": round(started, 3),
+                "request_id": timer.request_id if timer else None,
+                "route": scope["path"],
+                "method": scope.get("method"),
+                "session": cookie.group(1) if cookie else session["id"],
+                "status": response["status"],
+                "response_bytes": response["bytes"],
+                "completions": calls,
+                "timing": timer.report() if timer else None,
+                "body": b"".join(chunks),
+            })
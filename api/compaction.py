@@ -0,0 +1,132 @@
+# compaction.py
+
+import json
+import logging
+import os
+from typing import List, Tuple
+
+from api.extract import extract_json
+from api.sessions import estimate_tokens
+
+# Config
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "6"))  # raw messages kept verbatim
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+HISTORY_SNIPPET_CHARS = int(os.getenv("HISTORY_SNIPPET_CHARS", "200"))
+
+FACT_KEYS = (
+    "city",
+    "country",
+    "countryCode",
+    "days",
+    "start_time",
+    "end_time",
+    "end_location",
+    "preferences",
+    "language",
+)
+FACTS_PREFIX = "Facts extracted so far from earlier in this conversation: "
+
+compaction_stats = {
+    "requests": 0,
+    "compacted": 0,
+    "tokens_before": 0,
+    "tokens_after": 0,
+}
+
+
+def count_tokens(messages: List[dict]) -> int:
+    return sum(estimate_tokens(m.get("content") or "") for m in messages)
+
+
+def _is_facts_message(message: dict) -> bool:
+    return message.get("role") == "system" and (message.get("content") or "").startswith(
+        FACTS_PREFIX
+    )
+
+
+def _read_facts(message: dict) -> dict:
+    try:
+        return json.loads(message["content"][len(FACTS_PREFIX):])
+    except (KeyError, ValueError):
+        return {}
+
+
+def _facts_message(facts: dict) -> dict:
+    return {
+        "role": "system",
+        "content": FACTS_PREFIX + json.dumps(facts, ensure_ascii=False, separators=(",", ":")),
+    }
+
+
+def facts_from_reply(content: str) -> dict:
+    """Pull the travel fields out of an assistant reply that carries a JSON block."""
+    try:
+        data = extract_json(content)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: data[k] for k in FACT_KEYS if data.get(k) not in (None, "")}
+
+
+def merge_facts(facts: dict, dropped: List[dict]) -> dict:
+    facts = dict(facts)
+    earlier = list(facts.pop("earlier_user_messages", []))
+    for message in dropped:
+        content = message.get("content") or ""
+        if message.get("role") == "assistant":
+            facts.update(facts_from_reply(content))
+        elif message.get("role") == "user":
+            earlier.append(content[:HISTORY_SNIPPET_CHARS])
+    if earlier:
+        facts["earlier_user_messages"] = earlier
+    return facts
+
+
+def compact_history(
+    history: List[dict],
+    keep_turns: int = HISTORY_KEEP_TURNS,
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+) -> Tuple[List[dict], int, int]:
+    """Fold older turns into a facts message and keep only the latest raw turns.
+
+    Returns the compacted message list together with the estimated prompt
+    tokens before and after compaction. The system prompt is always kept.
+    """
+    before = count_tokens(history)
+    system = [m for m in history if m.get("role") == "system" and not _is_facts_message(m)]
+    facts = {}
+    for message in history:
+        if _is_facts_message(message):
+            facts.update(_read_facts(message))
+    turns = [m for m in history if m.get("role") != "system"]
+
+    keep = max(1, keep_turns)
+    dropped, kept = turns[:-keep], turns[-keep:]
+    facts = merge_facts(facts, dropped)
+
+    def build():
+        return system + ([_facts_message(facts)] if facts else []) + kept
+
+    messages = build()
+    # Over budget: shed the oldest user snippets first, then the oldest raw turns.
+    while count_tokens(messages) > token_budget:
+        if facts.get("earlier_user_messages"):
+            facts["earlier_user_messages"].pop(0)
+            if not facts["earlier_user_messages"]:
+                del facts["earlier_user_messages"]
+        elif len(kept) > 1:
+            facts = merge_facts(facts, [kept.pop(0)])
+            facts.pop("earlier_user_messages", None)
+        else:
+            break
+        messages = build()
+
+    after = count_tokens(messages)
+    compaction_stats["requests"] += 1
+    compaction_stats["tokens_before"] += before
+    compaction_stats["tokens_after"] += after
+    if after < before:
+        compaction_stats["compacted"] += 1
+    logging.info("Keyword prompt tokens before=%s after=%s", before, after)
+    return messages, before, after
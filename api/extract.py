@@ -0,0 +1,251 @@
+# extract.py
+#
+# Single-pass, incremental extraction of the first JSON object in model
+# output. Works with or without ```json fences and repairs the defects we
+# see from the model: doubled braces copied from the prompt template
+# ("{{ ... }}"), trailing commas, Python literals (None/True/False), raw
+# newlines inside strings, // comments and replies cut off mid-object.
+
+import json
+import re
+from typing import Callable, List, Optional, Tuple
+
+# Outside strings we only care about structure, comments and bare words.
+_STRUCTURE = re.compile(r"[{}\[\]\",:]|//|(?<![0-9.])[A-Za-z_]+")
+# Inside strings we only care about the closing quote, escapes and raw control characters.
+_IN_STRING = re.compile(r"[\"\\\n\r\t]")
+_OBJECT_START = re.compile(r"\{\s*(?=[\"{}])")
+_WORDS = {"None": "null", "True": "true", "False": "false", "null": "null", "true": "true", "false": "false"}
+_CONTROL = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_DECODER = json.JSONDecoder()
+
+Parents = Tuple[Tuple[str, Optional[str]], ...]
+
+
+class JsonExtractor:
+    """Feed model output in chunks; get the first JSON object back, repaired.
+
+    The scanner copies the object into a normalized buffer as it goes, so
+    nothing is scanned twice. ``watch(parents)`` may select nested objects to
+    be returned from ``feed`` as soon as they close; ``parents`` describes the
+    enclosing containers as ``(bracket, key)`` pairs from the root down.
+    """
+
+    def __init__(self, watch: Optional[Callable[[Parents], bool]] = None):
+        self.watch = watch
+        self.text = ""
+        self.found = False
+        self.complete = False
+        self.repaired = False
+        self.truncated = False  # the input ended before the object closed
+        self.error: Optional[str] = None
+        self._pos = 0
+        self._out: List[str] = []
+        self._stack: List[Tuple[str, Optional[str], int]] = []  # (bracket, key, out index)
+        self._in_string = False
+        self._doubled = False
+        self._pending_comma = False
+        self._string_start = 0
+        self._last_string = (0, 0)  # out index range of the most recent string
+        self._after_colon = False
+        self._value = None
+
+    def _emit(self, piece: str):
+        self._out.append(piece)
+
+    def _flush_comma(self, closing: bool):
+        if self._pending_comma:
+            self._pending_comma = False
+            if closing:
+                self.repaired = True
+            else:
+                self._emit(",")
+
+    def feed(self, chunk: str, final: bool = False) -> List[Tuple[Parents, dict]]:
+        """Scan the next chunk; return watched objects that closed in it."""
+        self.text += chunk
+        closed = []
+        text = self.text
+        if not self.found:
+            match = _OBJECT_START.search(text, self._pos)
+            if match is None:
+                # Keep the tail, it may be the start of an object split across chunks.
+                self._pos = max(self._pos, len(text) - 64)
+                return closed
+            start = match.start()
+            if start + 1 >= len(text) and not final:
+                return closed
+            self.found = True
+            self._doubled = text.startswith("{{", start)
+            self._pos = start + (2 if self._doubled else 1)
+            self._stack.append(("{", None, 0))
+            self._emit("{")
+
+        while not self.complete:
+            pos = self._pos
+            if self._in_string:
+                match = _IN_STRING.search(text, pos)
+                if match is None:
+                    self._emit(text[pos:])
+                    self._pos = len(text)
+                    break
+                i = match.start()
+                ch = text[i]
+                if ch == "\\" and i + 1 >= len(text) and not final:
+                    self._emit(text[pos:i])
+                    self._pos = i
+                    break
+                self._emit(text[pos:i])
+                if ch == '"':
+                    self._emit('"')
+                    self._in_string = False
+                    self._last_string = (self._string_start, len(self._out))
+                    self._pos = i + 1
+                elif ch == "\\":
+                    self._emit(text[i:i + 2])
+                    self._pos = i + 2
+                else:
+                    self._emit(_CONTROL[ch])
+                    self.repaired = True
+                    self._pos = i + 1
+                continue
+
+            match = _STRUCTURE.search(text, pos)
+            if match is None:
+                # A lone "/" at the end may be the first half of a "//" comment split across chunks.
+                stop = len(text) - 1 if text.endswith("/") and not final else len(text)
+                self._emit_between(text[pos:stop])
+                self._pos = stop
+                break
+            i, token = match.start(), match.group(0)
+            needs_lookahead = (
+                token.isalpha() or token == "/" or (self._doubled and token in "{}")
+            )
+            if needs_lookahead and match.end() >= len(text) and not final:
+                self._emit_between(text[pos:i])
+                self._pos = i
+                break
+            self._emit_between(text[pos:i])
+            end = match.end()
+
+            if token == '"':
+                self._flush_comma(False)
+                self._string_start = len(self._out)
+                self._emit('"')
+                self._in_string = True
+            elif token == "//":
+                newline = text.find("\n", end)
+                if newline == -1 and not final:
+                    self._pos = i
+                    break
+                end = len(text) if newline == -1 else newline
+                self.repaired = True
+            elif token == ",":
+                self._pending_comma = True
+            elif token == ":":
+                self._emit(":")
+                self._after_colon = True
+                self._pos = end
+                continue
+            elif token in "{[":
+                if self._doubled and token == "{" and text.startswith("{{", i):
+                    end = i + 2
+                self._flush_comma(False)
+                key = None
+                if self._after_colon:
+                    start, stop = self._last_string
+                    key = "".join(self._out[start:stop])[1:-1]
+                self._stack.append((token, key, len(self._out)))
+                self._emit(token)
+            elif token in "}]":
+                if self._doubled and token == "}" and text.startswith("}}", i):
+                    end = i + 2
+                self._flush_comma(True)
+                if self._stack:
+                    _, _, start = self._stack.pop()
+                    self._emit(token)
+                    if not self._stack:
+                        self.complete = True
+                    elif token == "}" and self.watch is not None:
+                        parents = tuple((b, k) for b, k, _ in self._stack)
+                        if self.watch(parents):
+                            try:
+                                closed.append((parents, json.loads("".join(self._out[start:]))))
+                            except json.JSONDecodeError:
+                                pass
+            else:
+                self._flush_comma(False)
+                word = _WORDS.get(token)
+                if word is None:
+                    # Unquoted text where a value belongs: keep it as a string.
+                    word = json.dumps(token)
+                if word != token:
+                    self.repaired = True
+                self._emit(word)
+            self._after_colon = False
+            self._pos = end
+        return closed
+
+    def _emit_between(self, piece: str):
+        # Numbers and whitespace between structural tokens pass through as-is.
+        if piece.strip():
+            self._flush_comma(False)
+            self._after_colon = False
+        self._emit(piece)
+
+    def finish(self):
+        """Signal end of input; close a truncated object and return the result."""
+        if not self.complete:
+            self.feed("", final=True)
+        if self.found and not self.complete:
+            self.repaired = True
+            self.truncated = True
+            if self._in_string:
+                self._emit('"')
+                self._in_string = False
+            tail = "".join(self._out).rstrip()
+            if tail.endswith(":"):
+                self._emit("null")
+            self._pending_comma = False
+            while self._stack:
+                bracket, _, _ = self._stack.pop()
+                self._emit("}" if bracket == "{" else "]")
+            self.complete = True
+        return self.result()
+
+    def result(self):
+        if not self.complete:
+            return None
+        if self._value is None and self.error is None:
+            try:
+                self._value = json.loads("".join(self._out))
+            except json.JSONDecodeError as json_err:
+                self.error = str(json_err)
+        return self._value
+
+
+def extract_json(text: str, allow_truncated: bool = True):
+    """Return the first JSON object in ``text`` (repaired if needed), or None.
+
+    Raises ``json.JSONDecodeError`` when an object is present but cannot be
+    repaired, so callers can tell "no JSON" apart from "broken JSON". With
+    ``allow_truncated=False`` an object cut off before its closing brace is
+    broken too, instead of being closed and returned as if it were whole.
+    """
+    match = _OBJECT_START.search(text)
+    if match is None:
+        return None
+    try:
+        # Well-formed output is decoded at C speed without the repairing scanner.
+        value, _ = _DECODER.raw_decode(text, match.start())
+        return value
+    except json.JSONDecodeError:
+        pass
+    extractor = JsonExtractor()
+    extractor.feed(text)
+    value = extractor.finish()
+    if extractor.found and extractor.error is not None:
+        raise json.JSONDecodeError(extractor.error, "".join(extractor._out), 0)
+    if extractor.truncated and not allow_truncated:
+        raise json.JSONDecodeError("Reply was cut off before the JSON object closed", text, len(text))
+    return value
@@ -0,0 +1,254 @@
+# fastpath.py
+#
+# Deterministic parser for simple /keyword-search inputs such as
+# "3 days in Tokyo" or "京都 2日間 9時から". It only answers when every part of
+# the input is understood; anything left over (preferences, end locations,
+# ambiguous places or languages) returns None so the caller asks the model.
+
+import re
+from typing import Optional
+
+from api import gazetteer
+
+fastpath_stats = {"attempts": 0, "hits": 0}
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10,
+}
+_NUM = r"(\d{1,2}|a|an|one|two|three|four|five|six|seven|eight|nine|ten|[一二三四五六七八九十])"
+
+DAYS_PATTERNS = (
+    re.compile(_NUM + r"\s*-?\s*(?:days?|d)\b", re.IGNORECASE),
+    re.compile(r"\d泊\s*" + _NUM + r"\s*日(?:間)?"),
+    re.compile(_NUM + r"\s*(?:日間|日|天|일)"),
+)
+WEEK_PATTERN = re.compile(r"\b(?:a|one)\s+week\b", re.IGNORECASE)
+WEEKEND_PATTERN = re.compile(r"\b(?:a\s+|the\s+|this\s+|next\s+)?weekend\b|週末", re.IGNORECASE)
+
+_CLOCK = r"(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?"
+_CLOCK_JA = r"(午前|午後)?\s*(\d{1,2})\s*時\s*(?:(\d{1,2})\s*分|半)?"
+RANGE_PATTERN = re.compile(
+    r"(?:from\s+)?\b" + _CLOCK + r"\s*(?:-|–|~|to|until|till)\s*" + _CLOCK + r"(?![\w:])",
+    re.IGNORECASE,
+)
+START_PATTERN = re.compile(
+    r"\b(?:from|starting(?:\s+at)?|start(?:ing)?\s+at|after)\s+" + _CLOCK + r"(?![\w:])",
+    re.IGNORECASE,
+)
+END_PATTERN = re.compile(
+    r"\b(?:until|till|to|ending(?:\s+at)?|end(?:ing)?\s+at|before)\s+" + _CLOCK + r"(?![\w:])",
+    re.IGNORECASE,
+)
+START_PATTERN_JA = re.compile(_CLOCK_JA + r"\s*(?:から|開始|スタート)")
+END_PATTERN_JA = re.compile(_CLOCK_JA + r"\s*(?:まで|終了)")
+
+LATIN_WORD = re.compile(r"[^\W\d_]+(?:['.][^\W\d_]+)*\.?")
+STOPWORDS = {
+    "a", "an", "the", "in", "to", "for", "of", "at", "and", "on", "around",
+    "i", "me", "my", "we", "us", "our", "want", "wanna", "would", "like", "need",
+    "go", "going", "visit", "visiting", "trip", "travel", "traveling", "travelling",
+    "tour", "plan", "planning", "itinerary", "vacation", "holiday", "stay", "staying",
+    "spend", "spending", "explore", "exploring", "please", "make", "create", "give",
+    "day", "days", "weekend", "week", "in.", "trip.", "please.",
+}
+FILLER = re.compile(
+    r"[\s、。，,.!！?？・〜~\-–]|旅行|観光|旅程|日程|予定|プラン|行きたい|したい|"
+    r"ください|下さい|作って|お願いします|の|で|に|へ|を|は|間|旅游|游|去|想|여행|에서|일정"
+)
+
+# Script ranges used for language detection
+_KANA = re.compile(r"[぀-ヿ]")
+_HAN = re.compile(r"[一-鿿]")
+_HANGUL = re.compile(r"[가-힯]")
+_THAI = re.compile(r"[฀-๿]")
+_ARABIC = re.compile(r"[؀-ۿ]")
+_CYRILLIC = re.compile(r"[Ѐ-ӿ]")
+
+
+def detect_language(text: str) -> Optional[str]:
+    """Name the language from its script, or None when the script is shared."""
+    if _KANA.search(text):
+        return "Japanese"
+    if _HANGUL.search(text):
+        return "Korean"
+    if _THAI.search(text):
+        return "Thai"
+    if _ARABIC.search(text):
+        return "Arabic"
+    if _CYRILLIC.search(text):
+        return "Russian"
+    if _HAN.search(text):
+        # Kanji-only input could be Japanese or Chinese.
+        return None
+    words = [w.casefold() for w in LATIN_WORD.findall(text)]
+    if words and any(w in STOPWORDS for w in words):
+        return "English"
+    return None
+
+
+def format_time(hour: int, minute: int, meridiem: Optional[str]) -> Optional[str]:
+    if meridiem:
+        meridiem = meridiem.replace(".", "").lower()
+        if not 1 <= hour <= 12:
+            return None
+        if meridiem == "pm" and hour != 12:
+            hour += 12
+        elif meridiem == "am" and hour == 12:
+            hour = 0
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return None
+    suffix = "AM" if hour < 12 else "PM"
+    return f"{(hour % 12) or 12:02d}:{minute:02d} {suffix}"
+
+
+def _clock(groups) -> Optional[str]:
+    hour, minute, meridiem = groups
+    if meridiem is None and minute is None:
+        # A bare number ("from 9") is too ambiguous to trust.
+        return None
+    return format_time(int(hour), int(minute or 0), meridiem)
+
+
+def _clock_ja(match) -> Optional[str]:
+    half, hour, minute = match.group(1), int(match.group(2)), match.group(3)
+    minutes = 30 if match.group(0).rstrip().endswith("半") and minute is None else int(minute or 0)
+    meridiem = {"午前": "am", "午後": "pm"}.get(half)
+    if meridiem and hour > 12:
+        return None
+    return format_time(hour, minutes, meridiem)
+
+
+class _Text:
+    """Input text with consumed spans blanked out, so leftovers can be checked."""
+
+    def __init__(self, text: str):
+        self.original = text
+        self.rest = text
+
+    def take(self, match):
+        start, end = match.span()
+        self.rest = self.rest[:start] + " " * (end - start) + self.rest[end:]
+
+
+def _find_city(text: _Text):
+    found = {}
+    # Latin-script names: look up every 1..MAX_WORDS word window.
+    words = list(LATIN_WORD.finditer(text.rest))
+    for i in range(len(words)):
+        for n in range(gazetteer.MAX_WORDS, 0, -1):
+            window = words[i:i + n]
+            if len(window) < n:
+                continue
+            name = text.rest[window[0].start():window[-1].end()].rstrip(".")
+            entry = gazetteer.lookup(name)
+            if entry:
+                found.setdefault(entry, []).append((window[0].start(), window[-1].end()))
+                break
+    # Other scripts: look up every substring up to MAX_CHARS characters long.
+    rest = text.rest
+    for start in range(len(rest)):
+        if gazetteer.is_latin(rest[start]):
+            continue
+        for length in range(min(gazetteer.MAX_CHARS, len(rest) - start), 0, -1):
+            entry = gazetteer.CITY_INDEX.get(rest[start:start + length])
+            if entry:
+                found.setdefault(entry, []).append((start, start + length))
+                break
+    if len(found) != 1:
+        return None
+    entry, spans = next(iter(found.items()))
+    for start, end in spans:
+        text.rest = text.rest[:start] + " " * (end - start) + text.rest[end:]
+    return entry
+
+
+def _find_days(text: _Text):
+    for pattern in DAYS_PATTERNS:
+        matches = list(pattern.finditer(text.rest))
+        if len(matches) > 1:
+            return None
+        if matches:
+            text.take(matches[0])
+            value = matches[0].group(1).lower()
+            return NUMBER_WORDS.get(value) or int(value)
+    for pattern, days in ((WEEK_PATTERN, 7), (WEEKEND_PATTERN, 2)):
+        match = pattern.search(text.rest)
+        if match:
+            text.take(match)
+            return days
+    return 1
+
+
+def _find_times(text: _Text):
+    start_time = end_time = None
+    match = RANGE_PATTERN.search(text.rest)
+    if match:
+        start_time, end_time = _clock(match.groups()[:3]), _clock(match.groups()[3:])
+        if start_time is None or end_time is None:
+            return None
+        text.take(match)
+    for pattern, is_start, parse in (
+        (START_PATTERN, True, lambda m: _clock(m.groups())),
+        (END_PATTERN, False, lambda m: _clock(m.groups())),
+        (START_PATTERN_JA, True, _clock_ja),
+        (END_PATTERN_JA, False, _clock_ja),
+    ):
+        match = pattern.search(text.rest)
+        if not match:
+            continue
+        value = parse(match)
+        if value is None or (start_time if is_start else end_time):
+            return None
+        text.take(match)
+        if is_start:
+            start_time = value
+        else:
+            end_time = value
+    return start_time, end_time
+
+
+def _has_leftovers(rest: str) -> bool:
+    for word in LATIN_WORD.findall(rest):
+        if gazetteer.is_latin(word) and word.casefold() not in STOPWORDS:
+            return True
+    rest = LATIN_WORD.sub(lambda m: " " if gazetteer.is_latin(m.group(0)) else m.group(0), rest)
+    return bool(FILLER.sub("", rest))
+
+
+def fast_extract(user_input: str) -> Optional[dict]:
+    """Return the /keyword-search JSON for simple inputs, or None to use the model."""
+    fastpath_stats["attempts"] += 1
+    text = _Text(user_input)
+    language = detect_language(user_input)
+    if language is None:
+        return None
+    city = _find_city(text)
+    if city is None:
+        return None
+    times = _find_times(text)
+    if times is None:
+        return None
+    days = _find_days(text)
+    if not days or days > 30:
+        return None
+    if _has_leftovers(text.rest):
+        return None
+
+    name, country, code = city
+    extracted = {"city": name, "country": country, "countryCode": code, "days": days}
+    start_time, end_time = times
+    if start_time:
+        extracted["start_time"] = start_time
+    if end_time:
+        extracted["end_time"] = end_time
+    extracted["language"] = language
+    fastpath_stats["hits"] += 1
+    return extracted
+
+
+def hit_rate() -> float:
+    """Share of first turns answered without the model; exported as fastpath_hit_rate."""
+    attempts = fastpath_stats["attempts"]
+    return fastpath_stats["hits"] / attempts if attempts else 0.0
@@ -0,0 +1,187 @@
+# gazetteer.py
+#
+# Offline city -> country -> Google GL countryCode index used by the
+# keyword fast path. Each row is "gl|Country|City|alias|alias...". Names that
+# are shared by well-known places in different countries (Portland, Valencia,
+# Santiago, ...) are left out on purpose so they always go to the model.
+
+from typing import Dict, Optional, Tuple
+
+_TABLE = """
+jp|Japan|Tokyo|東京|とうきょう|トウキョウ|tokio
+jp|Japan|Kyoto|京都|きょうと
+jp|Japan|Osaka|大阪|おおさか
+jp|Japan|Nara|奈良
+jp|Japan|Kobe|神戸
+jp|Japan|Yokohama|横浜
+jp|Japan|Sapporo|札幌
+jp|Japan|Hakodate|函館
+jp|Japan|Otaru|小樽
+jp|Japan|Sendai|仙台
+jp|Japan|Nagoya|名古屋
+jp|Japan|Kanazawa|金沢
+jp|Japan|Takayama|高山
+jp|Japan|Nikko|日光
+jp|Japan|Kamakura|鎌倉
+jp|Japan|Hakone|箱根
+jp|Japan|Hiroshima|広島
+jp|Japan|Okayama|岡山
+jp|Japan|Himeji|姫路
+jp|Japan|Fukuoka|福岡
+jp|Japan|Nagasaki|長崎
+jp|Japan|Kumamoto|熊本
+jp|Japan|Kagoshima|鹿児島
+jp|Japan|Beppu|別府
+jp|Japan|Naha|那覇
+jp|Japan|Okinawa|沖縄
+jp|Japan|Matsumoto|松本
+jp|Japan|Nagano|長野
+jp|Japan|Niigata|新潟
+jp|Japan|Shizuoka|静岡
+jp|Japan|Atami|熱海
+jp|Japan|Ise|伊勢
+jp|Japan|Matsuyama|松山
+jp|Japan|Takamatsu|高松
+kr|South Korea|Seoul|서울|ソウル|首尔
+kr|South Korea|Busan|부산|釜山|プサン
+kr|South Korea|Jeju|제주|済州
+kr|South Korea|Incheon|인천
+tw|Taiwan|Taipei|台北|臺北
+tw|Taiwan|Kaohsiung|高雄
+tw|Taiwan|Tainan|台南
+tw|Taiwan|Taichung|台中
+hk|Hong Kong|Hong Kong|香港
+mo|Macau|Macau|macao|澳門|澳门
+cn|China|Beijing|北京|peking
+cn|China|Shanghai|上海
+cn|China|Guangzhou|广州|廣州
+cn|China|Shenzhen|深圳
+cn|China|Chengdu|成都
+cn|China|Xi'an|xian|西安
+cn|China|Hangzhou|杭州
+th|Thailand|Bangkok|กรุงเทพ|バンコク|曼谷
+th|Thailand|Chiang Mai|เชียงใหม่|チェンマイ|清迈
+th|Thailand|Phuket|ภูเก็ต|プーケット|普吉
+vn|Vietnam|Hanoi|ha noi|ハノイ|河内
+vn|Vietnam|Ho Chi Minh City|saigon|ho chi minh|ホーチミン
+vn|Vietnam|Da Nang|danang|ダナン
+vn|Vietnam|Hoi An|ホイアン
+sg|Singapore|Singapore|シンガポール|新加坡
+my|Malaysia|Kuala Lumpur|クアラルンプール|吉隆坡
+my|Malaysia|Penang|ペナン|槟城
+id|Indonesia|Bali|バリ|巴厘岛
+id|Indonesia|Jakarta|ジャカルタ|雅加达
+ph|Philippines|Manila|マニラ|马尼拉
+ph|Philippines|Cebu|セブ|宿务
+in|India|Delhi|new delhi|デリー
+in|India|Mumbai|bombay|ムンバイ
+in|India|Jaipur
+in|India|Agra
+ae|United Arab Emirates|Dubai|دبي|ドバイ|迪拜
+ae|United Arab Emirates|Abu Dhabi|أبو ظبي
+tr|Turkey|Istanbul|イスタンブール|伊斯坦布尔
+gb|United Kingdom|London|ロンドン|伦敦|倫敦
+gb|United Kingdom|Edinburgh|エディンバラ
+gb|United Kingdom|Manchester
+ie|Ireland|Dublin|ダブリン
+fr|France|Paris|パリ|巴黎
+fr|France|Lyon|リヨン
+fr|France|Marseille|マルセイユ
+it|Italy|Rome|roma|ローマ|罗马|羅馬
+it|Italy|Florence|firenze|フィレンツェ|佛罗伦萨
+it|Italy|Venice|venezia|ヴェネツィア|ベネチア|威尼斯
+it|Italy|Milan|milano|ミラノ|米兰
+it|Italy|Naples|napoli|ナポリ
+es|Spain|Madrid|マドリード|马德里
+es|Spain|Barcelona|バルセロナ|巴塞罗那
+es|Spain|Seville|sevilla|セビリア
+pt|Portugal|Lisbon|lisboa|リスボン|里斯本
+pt|Portugal|Porto|ポルト
+de|Germany|Berlin|ベルリン|柏林
+de|Germany|Munich|münchen|muenchen|ミュンヘン|慕尼黑
+de|Germany|Hamburg|ハンブルク
+de|Germany|Frankfurt|フランクフルト
+nl|Netherlands|Amsterdam|アムステルダム|阿姆斯特丹
+be|Belgium|Brussels|bruxelles|ブリュッセル
+ch|Switzerland|Zurich|zürich|チューリッヒ
+ch|Switzerland|Geneva|genève|ジュネーブ
+at|Austria|Vienna|wien|ウィーン|维也纳
+cz|Czech Republic|Prague|praha|プラハ|布拉格
+hu|Hungary|Budapest|ブダペスト
+gr|Greece|Athens|アテネ|雅典
+gr|Greece|Santorini|サントリーニ
+dk|Denmark|Copenhagen|コペンハーゲン
+se|Sweden|Stockholm|ストックホルム
+no|Norway|Oslo|オスロ
+fi|Finland|Helsinki|ヘルシンキ
+is|Iceland|Reykjavik|reykjavík|レイキャビク
+pl|Poland|Krakow|kraków|クラクフ
+hr|Croatia|Dubrovnik|ドゥブロヴニク
+us|United States|New York|new york city|nyc|ニューヨーク|纽约|紐約
+us|United States|Los Angeles|ロサンゼルス|洛杉矶
+us|United States|San Francisco|サンフランシスコ|旧金山
+us|United States|Las Vegas|vegas|ラスベガス
+us|United States|Chicago|シカゴ|芝加哥
+us|United States|Seattle|シアトル
+us|United States|Boston|ボストン
+us|United States|Washington DC|washington d.c.
+us|United States|Miami|マイアミ
+us|United States|Honolulu|ホノルル|檀香山
+us|United States|Hawaii|ハワイ|夏威夷
+us|United States|Orlando
+us|United States|New Orleans
+ca|Canada|Toronto|トロント|多伦多
+ca|Canada|Vancouver|バンクーバー|温哥华
+ca|Canada|Montreal|montréal|モントリオール
+mx|Mexico|Mexico City|cdmx|メキシコシティ
+mx|Mexico|Cancun|cancún|カンクン
+br|Brazil|Rio de Janeiro|rio|リオデジャネイロ
+br|Brazil|Sao Paulo|são paulo|サンパウロ
+ar|Argentina|Buenos Aires|ブエノスアイレス
+pe|Peru|Lima|リマ
+pe|Peru|Cusco|cuzco|クスコ
+au|Australia|Sydney|シドニー|悉尼
+au|Australia|Melbourne|メルボルン|墨尔本
+au|Australia|Brisbane|ブリスベン
+au|Australia|Cairns|ケアンズ
+nz|New Zealand|Auckland|オークランド
+nz|New Zealand|Queenstown|クイーンズタウン
+eg|Egypt|Cairo|カイロ|开罗
+ma|Morocco|Marrakech|marrakesh|マラケシュ
+za|South Africa|Cape Town|ケープタウン
+"""
+
+# normalized name -> (city, country, countryCode)
+CITY_INDEX: Dict[str, Tuple[str, str, str]] = {}
+# Longest name in words (Latin script) and characters (other scripts), to bound scans
+MAX_WORDS = 1
+MAX_CHARS = 1
+
+
+def normalize(name: str) -> str:
+    return " ".join(name.casefold().replace("-", " ").split())
+
+
+def is_latin(text: str) -> bool:
+    return all(ord(ch) < 0x250 for ch in text)
+
+
+def _load():
+    global MAX_WORDS, MAX_CHARS
+    for row in _TABLE.strip().splitlines():
+        code, country, city, *aliases = row.split("|")
+        entry = (city, country, code)
+        for name in (city, *aliases):
+            key = normalize(name)
+            CITY_INDEX[key] = entry
+            if is_latin(key):
+                MAX_WORDS = max(MAX_WORDS, len(key.split()))
+            else:
+                MAX_CHARS = max(MAX_CHARS, len(key))
+
+
+def lookup(name: str) -> Optional[Tuple[str, str, str]]:
+    return CITY_INDEX.get(normalize(name))
+
+
+_load()
@@ -0,0 +1,321 @@
+# geo.py
+#
+# Local geography for itinerary planning: coordinates for each choice, a
+# vectorized haversine distance matrix, clustering of choices into one
+# compact area per day, and a visiting order per day (nearest neighbour +
+# 2-opt) with lunch and dinner inserted where they cost the least detour.
+
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from api.prompting import FIELD_ALIASES, first_field
+from api.ranking import category_of
+
+# Config
+GEO_ENABLED = os.getenv("GEO_ENABLED", "true").lower() == "true"
+GEO_MIN_COVERAGE = float(os.getenv("GEO_MIN_COVERAGE", "0.5"))  # share of choices with coordinates
+GEO_KMEANS_ITERATIONS = int(os.getenv("GEO_KMEANS_ITERATIONS", "20"))
+GEO_TWO_OPT_PASSES = int(os.getenv("GEO_TWO_OPT_PASSES", "50"))
+
+EARTH_RADIUS_KM = 6371.0
+
+geo_stats = {"requests": 0, "planned": 0, "skipped": 0, "address_matches": 0, "unlocated": 0, "spare_meals": 0}
+
+LatLng = Tuple[float, float]
+
+
+def _pair(lat, lng) -> Optional[LatLng]:
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if -90 <= lat <= 90 and -180 <= lng <= 180:
+        return lat, lng
+    return None
+
+
+def _own_coordinates(choice: dict) -> Optional[LatLng]:
+    for key in ("gps_coordinates", "coordinates", "location", "geometry"):
+        value = choice.get(key)
+        if isinstance(value, dict):
+            value = value.get("location", value)
+            latlng = _pair(
+                value.get("latitude", value.get("lat")),
+                value.get("longitude", value.get("lng", value.get("lon"))),
+            )
+            if latlng:
+                return latlng
+    return _pair(
+        choice.get("latitude", choice.get("lat")),
+        choice.get("longitude", choice.get("lng", choice.get("lon"))),
+    )
+
+
+def _address_key(address) -> str:
+    return " ".join(str(address).casefold().split()) if address else ""
+
+
+def address_book(choices: List[dict]) -> Dict[str, LatLng]:
+    """Address -> (lat, lng) from the choices of one request that carry both.
+
+    A choice with only an address can borrow coordinates from another
+    choice in the same request. The book is never shared between requests:
+    coordinates come from the client, so a wrong pair must not reach anyone
+    else's trip.
+    """
+    book = {}
+    for choice in choices:
+        key = _address_key(choice.get("address"))
+        if key and key not in book:
+            latlng = _own_coordinates(choice)
+            if latlng:
+                book[key] = latlng
+    return book
+
+
+def coordinates(choice: dict, addresses: Optional[Dict[str, LatLng]] = None) -> Optional[LatLng]:
+    """Latitude/longitude of a choice from its own fields, else from ``addresses`` (see address_book)."""
+    latlng = _own_coordinates(choice)
+    if latlng is None and addresses:
+        latlng = addresses.get(_address_key(choice.get("address")))
+        if latlng:
+            geo_stats["address_matches"] += 1
+    return latlng
+
+
+def _unit_vectors(points: np.ndarray) -> np.ndarray:
+    lat, lng = np.radians(points[:, 0]), np.radians(points[:, 1])
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+
+def distance_matrix(points: np.ndarray, others: Optional[np.ndarray] = None) -> np.ndarray:
+    """Great-circle (haversine) distances in km between rows of (lat, lng) degree arrays.
+
+    Computed from the chord between unit vectors, which turns the pairwise
+    trigonometry into one matrix product.
+    """
+    a = _unit_vectors(np.asarray(points, dtype=float))
+    b = a if others is None else _unit_vectors(np.asarray(others, dtype=float))
+    chord_sq = np.maximum(2.0 - 2.0 * (a @ b.T), 0.0)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.sqrt(chord_sq) / 2, 1.0))
+
+
+def cluster(points: np.ndarray, k: int) -> np.ndarray:
+    """Split points into k compact groups of near-equal size; returns a label per point."""
+    n = len(points)
+    k = max(1, min(k, n))
+    if k == 1:
+        return np.zeros(n, dtype=int)
+    # Farthest-point seeding keeps the result deterministic.
+    centers = [points[0]]
+    nearest = distance_matrix(points, np.array(centers))[:, 0]
+    for _ in range(1, k):
+        centers.append(points[int(np.argmax(nearest))])
+        nearest = np.minimum(nearest, distance_matrix(points, np.array(centers[-1:]))[:, 0])
+    centers = np.array(centers)
+
+    capacity = math.ceil(n / k)
+    labels = np.zeros(n, dtype=int)
+    for _ in range(GEO_KMEANS_ITERATIONS):
+        dist = distance_matrix(points, centers)
+        # Capacitated assignment: most confident points pick first.
+        order = np.argsort(dist.min(axis=1) - dist.max(axis=1))
+        counts = np.zeros(k, dtype=int)
+        new_labels = np.empty(n, dtype=int)
+        preferences = np.argsort(dist, axis=1)
+        for i in order:
+            for c in preferences[i]:
+                if counts[c] < capacity:
+                    new_labels[i] = c
+                    counts[c] += 1
+                    break
+        new_centers = np.array([
+            points[new_labels == c].mean(axis=0) if counts[c] else centers[c] for c in range(k)
+        ])
+        if np.array_equal(new_labels, labels) and np.allclose(new_centers, centers):
+            break
+        labels, centers = new_labels, new_centers
+    return labels
+
+
+def route(dist: np.ndarray, start: int = 0, end: Optional[int] = None) -> List[int]:
+    """Open path through every node: nearest neighbour, then 2-opt improvement."""
+    n = len(dist)
+    if n <= 2:
+        order = list(range(n))
+        if n == 2 and order[0] != start:
+            order.reverse()
+        return order
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[start] = False
+    if end is not None:
+        unvisited[end] = False
+    path = [start]
+    while unvisited.any():
+        candidates = np.flatnonzero(unvisited)
+        nxt = int(candidates[np.argmin(dist[path[-1], candidates])])
+        path.append(nxt)
+        unvisited[nxt] = False
+    # A zero-cost sentinel closes an open path, so both cases share one loop;
+    # the first stop and the last one (sentinel or fixed end) never move.
+    padded = np.pad(dist, ((0, 1), (0, 1)))
+    path.append(end if end is not None and end != start else n)
+    path = np.array(path)
+    for _ in range(GEO_TWO_OPT_PASSES):
+        improved = False
+        for i in range(1, len(path) - 2):
+            a, b = path[i - 1], path[i]
+            c, d = path[i + 1:-1], path[i + 2:]
+            delta = padded[a, c] + padded[b, d] - padded[a, b] - padded[c, d]
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-9:
+                path[i:i + j + 2] = path[i:i + j + 2][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return [int(node) for node in path if node != n]
+
+
+def _insert(path: List[int], node: int, dist: np.ndarray, lo: int, hi: int) -> List[int]:
+    """Insert ``node`` at the cheapest position between indices lo..hi of ``path``."""
+    best, best_cost = hi, math.inf
+    for pos in range(max(0, lo), min(hi, len(path)) + 1):
+        prev = path[pos - 1] if pos > 0 else None
+        nxt = path[pos] if pos < len(path) else None
+        cost = (dist[prev, node] if prev is not None else 0.0) + (dist[node, nxt] if nxt is not None else 0.0)
+        if prev is not None and nxt is not None:
+            cost -= dist[prev, nxt]
+        if cost < best_cost:
+            best, best_cost = pos, cost
+    return path[:best] + [node] + path[best:]
+
+
+def _balance_meals(groups: List[List[int]], kinds: List[str], points: np.ndarray):
+    """Make sure every day has a lunch and a dinner when there are enough to go round."""
+    for meal in ("lunch", "dinner"):
+        for day in groups:
+            if any(kinds[i] == meal for i in day):
+                continue
+            donors = [g for g in groups if sum(kinds[i] == meal for i in g) > 1]
+            if not donors or not day:
+                continue
+            center = points[day].mean(axis=0, keepdims=True)
+            candidates = [i for g in donors for i in g if kinds[i] == meal]
+            dists = distance_matrix(points[candidates], center)[:, 0]
+            pick = candidates[int(np.argmin(dists))]
+            for g in donors:
+                if pick in g:
+                    g.remove(pick)
+            day.append(pick)
+
+
+def _find_end(choices: List[dict], end_location: Optional[str]) -> Optional[int]:
+    if not end_location:
+        return None
+    needle = end_location.casefold()
+    for index, choice in enumerate(choices):
+        for field in ("title", "address"):
+            value = str(first_field(choice, FIELD_ALIASES[field]) or "").casefold()
+            if value and (value in needle or needle in value):
+                return index
+    return None
+
+
+def plan_days(
+    choices: List[dict],
+    days: int,
+    end_location: Optional[str] = None,
+) -> Optional[List[List[dict]]]:
+    """Group choices into one compact area per day and order each day's visits.
+
+    Returns None when too few choices have coordinates for this to help,
+    otherwise exactly ``days`` lists (a day is empty only when there is
+    nothing left to give it). Lunch goes near the middle of each route and
+    dinner at the end; the area holding ``end_location`` becomes the last
+    day and finishes there. Choices without coordinates cannot be routed:
+    activities are added to the days with the fewest visits and meals to
+    days still missing one. Meals beyond one lunch and one dinner a day are
+    not visits and are counted in geo_stats["spare_meals"]; callers that want
+    them as alternatives (api.parallel.partition_choices) deal them out.
+    """
+    geo_stats["requests"] += 1
+    days = max(1, days)
+    addresses = address_book(choices)
+    located = [(i, coordinates(c, addresses)) for i, c in enumerate(choices)]
+    located = [(i, latlng) for i, latlng in located if latlng is not None]
+    if not choices or len(located) < max(1, GEO_MIN_COVERAGE * len(choices)):
+        geo_stats["skipped"] += 1
+        return None
+
+    subset = [choices[i] for i, _ in located]
+    points = np.array([latlng for _, latlng in located], dtype=float)
+    kinds = [category_of(c) for c in subset]
+    labels = cluster(points, days)
+    groups = [[i for i in range(len(subset)) if labels[i] == d] for d in range(days)]
+    _balance_meals(groups, kinds, points)
+    dist = distance_matrix(points)
+
+    # The trip ends at end_location, so the area around it is the last day.
+    end_index = _find_end(subset, end_location)
+    if end_index is not None:
+        groups.append(groups.pop(next(d for d, group in enumerate(groups) if end_index in group)))
+
+    planned = []
+    for group in groups:
+        if not group:
+            planned.append([])
+            continue
+        activities = [i for i in group if kinds[i] == "activity"]
+        meals = [i for i in group if kinds[i] != "activity"]
+        nodes = activities or meals[:1]
+        fixed_end = end_index if end_index in nodes else None
+        sub = dist[np.ix_(nodes, nodes)]
+        if fixed_end is not None:
+            local_end = nodes.index(fixed_end)
+            start = int(np.argmax(sub[local_end]))
+        else:
+            # Start from the edge of the area rather than its middle.
+            local_end = None
+            start = int(np.argmax(sub.sum(axis=1)))
+        order = [nodes[i] for i in route(sub, start, local_end)]
+
+        for meal in ("lunch", "dinner"):
+            for pick in [i for i in meals if kinds[i] == meal and i not in order][:1]:
+                if meal == "lunch":
+                    lo, hi = len(order) // 3, max(1, (2 * len(order)) // 3)
+                else:
+                    lo = hi = len(order) - (1 if fixed_end is not None else 0)
+                order = _insert(order, pick, dist, lo, hi)
+        geo_stats["spare_meals"] += len(group) - len(order)
+        planned.append([subset[i] for i in order])
+
+    ends_fixed = end_index is not None and bool(planned[-1]) and planned[-1][-1] is subset[end_index]
+    located_ids = {id(c) for c in subset}
+    for choice in choices:
+        if id(choice) not in located_ids:
+            geo_stats["unlocated"] += 1
+            _place_unlocated(planned, choice, ends_fixed)
+
+    geo_stats["planned"] += 1
+    return planned
+
+
+def _place_unlocated(planned: List[List[dict]], choice: dict, ends_fixed: bool):
+    """Add a choice without coordinates to a day: activities where there are fewest visits, meals where missing."""
+    kind = category_of(choice)
+    if kind == "activity":
+        targets = [min(range(len(planned)), key=lambda d: len(planned[d]))]
+    else:
+        targets = [d for d, plan in enumerate(planned) if not any(category_of(c) == kind for c in plan)]
+        if not targets:
+            geo_stats["spare_meals"] += 1
+            return
+    day = targets[0]
+    plan = planned[day]
+    # Never after the stop the trip must finish at
+    end = len(plan) - (1 if ends_fixed and day == len(planned) - 1 else 0)
+    plan.insert(end // 2 if kind == "lunch" else end, choice)
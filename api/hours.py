@@ -0,0 +1,112 @@
+# hours.py
+#
+# Parsing of clock times ("09:00 AM", "9am", "18:30") and Google-style
+# operating hours ({"monday": "9 AM–5 PM", "sunday": "Closed"}) into minutes
+# after midnight, shared by candidate ranking and the scheduler.
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+DAY_NAMES = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+FULL_DAY = (0, 24 * 60)
+
+Range = Tuple[int, int]
+
+_SPACES = re.compile("[\u00a0\u2009\u202f]")
+_CLOCK = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*([ap])?\.?\s*m?\.?\s*$", re.IGNORECASE)
+_RANGE = re.compile(
+    r"(\d{1,2})(?::(\d{2}))?\s*([ap])?\.?\s*m?\.?\s*(?:–|-|~|to)\s*"
+    r"(\d{1,2})(?::(\d{2}))?\s*([ap])?\.?\s*m?\.?",
+    re.IGNORECASE,
+)
+
+
+def _minutes(hour: int, minute: int, meridiem: Optional[str]) -> int:
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem.lower() == "p" else 0)
+    return hour * 60 + minute
+
+
+def parse_time(value) -> Optional[int]:
+    """Minutes after midnight for "09:00 AM", "9pm", "18:30"; None if unreadable."""
+    if value is None:
+        return None
+    match = _CLOCK.match(_SPACES.sub(" ", str(value)))
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if minute > 59 or hour > 24 or (meridiem and not 1 <= hour <= 12):
+        return None
+    return _minutes(hour, minute, meridiem)
+
+
+def format_time(minutes: int) -> str:
+    """Format minutes after midnight the way the itinerary does: "09:00 AM"."""
+    minutes = int(minutes) % (24 * 60)
+    hour, minute = divmod(minutes, 60)
+    suffix = "AM" if hour < 12 else "PM"
+    return f"{(hour % 12) or 12:02d}:{minute:02d} {suffix}"
+
+
+def parse_ranges(text) -> List[Range]:
+    """Open ranges in one day's hours string, e.g. "11:30 AM–2 PM, 5–10 PM"."""
+    return list(_parse_ranges(str(text)))
+
+
+@lru_cache(maxsize=4096)
+def _parse_ranges(text: str) -> Tuple[Range, ...]:
+    # The same few hours strings recur across days and places, and ranking
+    # and the scheduler read every candidate's hours.
+    text = _SPACES.sub(" ", text).strip().lower()
+    if not text or ("closed" in text and not _RANGE.search(text)):
+        return ()
+    if "24 hours" in text or "24時間" in text:
+        return (FULL_DAY,)
+    ranges = []
+    for match in _RANGE.finditer(text):
+        open_h, open_m, open_mer = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+        close_h, close_m, close_mer = int(match.group(4)), int(match.group(5) or 0), match.group(6)
+        close = _minutes(close_h, close_m, close_mer)
+        if open_mer is None and close_mer is not None:
+            # "5–10 PM" shares the meridiem; "11–2 PM" does not.
+            opening = _minutes(open_h, open_m, close_mer)
+            if opening > close:
+                opening = _minutes(open_h, open_m, "a")
+        else:
+            opening = _minutes(open_h, open_m, open_mer)
+        if close <= opening:
+            close += 24 * 60  # open past midnight
+        ranges.append((opening, close))
+    return tuple(ranges)
+
+
+def parse_hours(hours) -> Optional[Dict[str, List[Range]]]:
+    """Map weekday -> open ranges. None when the choice carries no usable hours."""
+    if hours is None or hours == "" or hours == {} or hours == []:
+        return None
+    if isinstance(hours, list):
+        merged = {}
+        for item in hours:
+            if isinstance(item, dict):
+                merged.update(item)
+        hours = merged or ", ".join(map(str, hours))
+    if isinstance(hours, dict):
+        parsed = {}
+        for day, value in hours.items():
+            day = str(day).lower()
+            if day in DAY_NAMES:
+                parsed[day] = parse_ranges(value)
+        return parsed or None
+    ranges = parse_ranges(hours)
+    if not ranges:
+        return None
+    return {day: ranges for day in DAY_NAMES}
+
+
+def overlap(ranges: List[Range], window: Range) -> int:
+    """Minutes of ``window`` covered by the open ranges."""
+    total = 0
+    for opening, close in ranges:
+        total += max(0, min(close, window[1]) - max(opening, window[0]))
+    return total
@@ -0,0 +1,122 @@
+# hydration.py
+#
+# "Minimal" itinerary output: the model only returns, per day, which choice
+# goes in which time slot plus an optional short note. Everything it used to
+# copy back (location, image, city, language, long descriptions) is filled
+# in here from the request's own choices, which keeps output tokens - the
+# slowest part of generation - to a minimum.
+#
+# Opt-in (ITINERARY_OUTPUT=minimal): descriptions then come from the
+# choices' own text and the model's short note instead of the ~50 words
+# the full output has the model write in the user's language.
+
+import os
+from typing import List, Optional
+
+from api.prompting import ChoiceTable, first_field, shorten, FIELD_ALIASES
+
+# Config
+ITINERARY_OUTPUT = os.getenv("ITINERARY_OUTPUT", "full")  # "minimal" or "full"
+HYDRATED_DESCRIPTION_CHARS = int(os.getenv("HYDRATED_DESCRIPTION_CHARS", "320"))
+
+minimal_system_message = {
+    "role": "system",
+    "content": """
+            Detect the language of the user's input and respond in the same language.
+
+            You will receive a table of candidate places. Each row has an id, category (e.g., activity, lunch, dinner),
+            title, rating, address, operating hours and description.
+
+            You will also receive the number of travel days, a specific start time, end time, end location, and any user preferences if provided.
+
+            Plan the itinerary within the specified timeframe and end at the specified location if provided.
+            If the user mentions a start time or end time, adjust activities to fit within this window.
+
+            Additional Instructions:
+            - Ensure that each day includes lunch and dinner activities.
+            - Consider the address and commute time between locations, avoiding scheduling locations that are far apart consecutively.
+            - Make sure to account for commute time in the starting and ending times.
+            - If suggested day plans are given, keep their grouping and visiting order; they are already optimized for travel distance.
+            - Each interval between activities should not exceed one hour.
+            - Only include activities that match the user's preferences (e.g., indoor activities).
+            - Refer to places only by their id. Do not repeat titles, addresses or descriptions.
+            - The note is optional: at most 12 words, in the detected language.
+
+            The output should be:
+            ```json
+            {"days": [{"day": 1, "date": "YYYY-MM-DD", "language": "the detected language name in English, e.g., 'English'",
+              "slots": [["id", "HH:MM AM/PM", "HH:MM AM/PM", "note"]]}]}
+            ```
+            """,
+}
+
+
+def _slot_fields(slot) -> Optional[tuple]:
+    # Accept both the requested [id, start, end, note] rows and small objects.
+    if isinstance(slot, (list, tuple)) and len(slot) >= 3:
+        return slot[0], slot[1], slot[2], slot[3] if len(slot) > 3 else None
+    if isinstance(slot, dict):
+        return (
+            slot.get("id") or slot.get("data_id"),
+            slot.get("start") or slot.get("startTime"),
+            slot.get("end") or slot.get("endTime"),
+            slot.get("note"),
+        )
+    return None
+
+
+def hydrate_day(
+    day: dict,
+    table: ChoiceTable,
+    city: str,
+    language: Optional[str] = None,
+    description_chars: Optional[int] = None,
+) -> dict:
+    """Expand one minimal day into the public itineraryItems day shape."""
+    language = language or day.get("language") or ""
+    slots: List[dict] = []
+    for raw in day.get("slots") or []:
+        fields = _slot_fields(raw)
+        if fields is None:
+            continue
+        local_id, start, end, note = fields
+        choice = table.lookup(local_id)
+        if choice is None:
+            continue
+        description = note or first_field(choice, FIELD_ALIASES["description"]) or ""
+        slots.append({
+            "data_id": choice.get("data_id", local_id),
+            "location": first_field(choice, FIELD_ALIASES["title"]) or "",
+            "time": {"startTime": start or "", "endTime": end or ""},
+            "description": shorten(description, description_chars or HYDRATED_DESCRIPTION_CHARS),
+            "language": language,
+        })
+    hydrated = {
+        "day": day.get("day"),
+        "dates": day.get("date") or day.get("dates") or "",
+        "city": city,
+        "image": "",
+        "slots": slots,
+    }
+    hydrated["image"] = table.day_image(hydrated) or ""
+    return hydrated
+
+
+def hydrate_itinerary(
+    plan: dict,
+    table: ChoiceTable,
+    city: str,
+    language: Optional[str] = None,
+    description_chars: Optional[int] = None,
+) -> dict:
+    days = plan.get("days")
+    if days is None:
+        # The model answered in the full schema anyway; just restore the ids.
+        return table.restore(plan)
+    return {
+        "itineraryItems": [
+            hydrate_day(day, table, city, language, description_chars)
+            for day in days
+            if isinstance(day, dict)
+        ]
+    }
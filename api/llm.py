@@ -0,0 +1,125 @@
+# llm.py
+
+import logging
+import os
+import time
+from typing import List, Optional
+
+import httpx
+import openai
+
+from api import capture, metrics
+from api.providers import Provider, default_providers
+from api.router import Router
+from api.timing import phase
+
+# Config
+LLM_BASE_URL = os.getenv("OPENAI_BASE_URL")  # Point at a local fake upstream when set
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "512"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "128"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+
+_client: Optional[openai.AsyncOpenAI] = None
+_router: Optional[Router] = None
+
+
+def create_client(api_key: str, base_url: Optional[str] = None) -> openai.AsyncOpenAI:
+    """Build an AsyncOpenAI client backed by a keep-alive connection pool."""
+    http_client = openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url or LLM_BASE_URL,
+        http_client=http_client,
+        max_retries=0,  # retries, backoff and breakers live in api/router.py
+    )
+
+
+async def startup(
+    api_key: str,
+    base_url: Optional[str] = None,
+    providers: Optional[List[Provider]] = None,
+    routes: Optional[dict] = None,
+):
+    """Start the shared client and the router over ``providers`` (OpenAI, plus Mistral when configured)."""
+    global _client, _router
+    if _router is None:
+        _client = create_client(api_key, base_url)
+        _router = Router(providers if providers is not None else default_providers(_client), routes)
+        logging.info(
+            "LLM client started (max_connections=%s, providers=%s)",
+            LLM_MAX_CONNECTIONS,
+            ",".join(_router.providers),
+        )
+
+
+async def shutdown():
+    global _client, _router
+    if _router is not None:
+        await _router.close()
+        if _client is not None and "openai" not in _router.providers:
+            await _client.close()
+        _client = None
+        _router = None
+        logging.info("LLM client closed")
+
+
+def get_client() -> openai.AsyncOpenAI:
+    if _client is None:
+        raise RuntimeError("LLM client is not started; call llm.startup() first")
+    return _client
+
+
+def get_router() -> Router:
+    if _router is None:
+        raise RuntimeError("LLM client is not started; call llm.startup() first")
+    return _router
+
+
+async def chat_completion(
+    model: str,
+    messages: List[dict],
+    timeout: Optional[float] = None,
+    **kwargs,
+):
+    """Await a chat completion from the best provider for ``model`` without blocking the event loop."""
+    started = time.perf_counter()
+    with phase("upstream"):
+        response = await get_router().complete(
+            model,
+            messages,
+            timeout if timeout is not None else LLM_TIMEOUT,
+            **kwargs,
+        )
+    metrics.record_usage(model, response)
+    capture.record_completion(model, messages, response, (time.perf_counter() - started) * 1000)
+    return response
+
+
+async def stream_completion(
+    model: str,
+    messages: List[dict],
+    timeout: Optional[float] = None,
+    **kwargs,
+):
+    """Yield the text deltas of a streamed chat completion as they arrive."""
+    async for text in get_router().stream(
+        model,
+        messages,
+        timeout if timeout is not None else LLM_TIMEOUT,
+        **kwargs,
+    ):
+        yield text
+
+
+def provider_stats() -> dict:
+    """Per provider:model latency percentiles, error rates and hedge counts."""
+    return _router.snapshot() if _router is not None else {}
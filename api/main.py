@@ -1,29 +1,67 @@
 # main.py
 
-from fastapi import FastAPI, Depends, Cookie, Response, HTTPException
+from fastapi import FastAPI, Depends, Cookie, Request, Response, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Literal, Tuple
+from contextlib import asynccontextmanager
+import asyncio
 import json
-import re
+import time
+import functools
+import math
 import openai
 import uuid
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import logging
 from dotenv import load_dotenv
+from api import llm, metrics
+from api.capture import CAPTURE_ENABLED, CaptureMiddleware, CaptureWriter, capture_stats
+from api.timing import TimingMiddleware, install_log_filter, phase, record_phase, timed
+from api.sessions import create_session_store, estimate_tokens
+from api.compaction import compact_history, compaction_stats, count_tokens
+from api.fastpath import fast_extract, fastpath_stats, hit_rate
+from api.cache import ItineraryCache, ITINERARY_CACHE_ENABLED, canonical_key
+from api.extract import extract_json
+from api.prompting import PROMPT_ENCODING, encode_choices, prompt_stats
+from api.ranking import RANK_ENABLED, ranking_stats, select_candidates
+from api.geo import GEO_ENABLED, geo_stats, plan_days
+from api.schedule import SCHEDULE_FALLBACK, SCHEDULE_REPAIR, Scheduler, schedule_stats
+from api.singleflight import SingleFlight
+from api.batch import BATCH_CONCURRENCY, BATCH_MAX_ITEMS, batch_stats, ndjson, run_batch
+from api.parallel import gather_days, merge_days, parallel_stats, partition_choices, use_parallel
+from api.tiers import get_tier, record_request, record_usage, tier_report
+from api.admission import AdmissionController, AdmissionRejected
+from api.resilience import CircuitOpenError, resilience_stats
+from api.hydration import ITINERARY_OUTPUT, hydrate_day, hydrate_itinerary, minimal_system_message
+from api.streaming import ItineraryStreamParser, sse, validate_itinerary
 # Config
 load_dotenv()  # Load environment variables from .env file
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is not set.")
-openai.api_key = OPENAI_API_KEY
 
 # Model configurations
 model = "gpt-4o"
 
+# The model returns only ids and times and the server fills in the rest ("minimal"
+# output); this needs the compact prompt encoding for the local ids.
+HYDRATE_OUTPUT = ITINERARY_OUTPUT == "minimal" and PROMPT_ENCODING == "compact"
+
+# Per-call upstream timeouts in seconds
+KEYWORD_TIMEOUT = float(os.getenv("KEYWORD_TIMEOUT", "30"))
+ITINERARY_TIMEOUT = float(os.getenv("ITINERARY_TIMEOUT", "90"))
+
+# Expected reply sizes, used to budget upstream tokens before a call
+KEYWORD_REPLY_TOKENS = int(os.getenv("KEYWORD_REPLY_TOKENS", "150"))
+ITINERARY_REPLY_TOKENS_PER_DAY = int(os.getenv("ITINERARY_REPLY_TOKENS_PER_DAY", "600"))
+
 # Set up logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(request_id)s:%(message)s")
+install_log_filter()  # every line carries the request ID it was logged under
 
 # Interfaces
 class KeywordParseRequest(BaseModel):
@@ -40,8 +78,24 @@ class TripRequest(BaseModel):
     end_location: Optional[str] = None  # New field for end location
     preferences: Optional[str] = None  # New field for user preferences
     language: Optional[str] = None  # New field for language
+    detail: Optional[Literal["full", "slim", "mini"]] = None  # Output size tier, see api/tiers.py
 
-app = FastAPI()
+class BatchRequest(BaseModel):
+    items: List[TripRequest]
+    concurrency: Optional[int] = None  # capped at BATCH_CONCURRENCY
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await llm.startup(OPENAI_API_KEY)
+    try:
+        yield
+    finally:
+        await llm.shutdown()
+        conversation_histories.close()
+        if capture_writer is not None:
+            capture_writer.close()
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "https://lostinmigration.com",
     "https://pocket-japan-fastapi-hackathon.vercel.app"
@@ -58,25 +112,98 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-conversation_histories = {}
+app.add_middleware(metrics.MetricsMiddleware)
+capture_writer = CaptureWriter() if CAPTURE_ENABLED else None
+app.add_middleware(CaptureMiddleware, writer=capture_writer)  # inside Timing, which it reads at the end
+app.add_middleware(TimingMiddleware)  # outermost: request IDs and Server-Timing for everything below
+
+conversation_histories = create_session_store()
+itinerary_cache = ItineraryCache() if ITINERARY_CACHE_ENABLED else None
+keyword_flights = SingleFlight("keyword")
+itinerary_flights = SingleFlight("itinerary")
+admission = AdmissionController()
+
+# Read only when /metrics is scraped
+metrics.register_stats("sessions", lambda: conversation_histories.stats())
+metrics.register_stats("itinerary_cache", lambda: itinerary_cache.stats if itinerary_cache else {})
+metrics.register_stats("singleflight", lambda: {
+    flights.name: {**flights.stats, "in_flight": len(flights)} for flights in (keyword_flights, itinerary_flights)
+}, label="flight")
+metrics.register_stats("admission", lambda: admission.snapshot(), label="kind")
+metrics.register_stats("llm_option", llm.provider_stats, label="option")
+metrics.register_stats("llm_resilience", lambda: resilience_stats)
+metrics.register_stats("itinerary_tier", tier_report, label="tier")
+metrics.register_stats("fastpath", lambda: {**fastpath_stats, "hit_rate": hit_rate()})
+for name, stats in {
+    "compaction": compaction_stats, "prompt": prompt_stats,
+    "ranking": ranking_stats, "geo": geo_stats, "schedule": schedule_stats,
+    "batch": batch_stats, "parallel": parallel_stats, "capture": capture_stats,
+}.items():
+    metrics.register_stats(name, functools.partial(dict, stats))
 
 async def get_session_id(session_id: Optional[str] = Cookie(default=None)):
     if session_id is None:
         session_id = str(uuid.uuid4())
     return session_id
 
+def client_key(request: Request, session_id: Optional[str] = None) -> Optional[str]:
+    """Who a call counts against for per-session fairness: the session, else the forwarded client.
+
+    The peer address is not used: behind the proxy it is shared by every user.
+    """
+    session_id = session_id or request.cookies.get("session_id")
+    if session_id:
+        return session_id
+    forwarded = request.headers.get("x-forwarded-for", "").split(",")[0].strip()
+    return forwarded or None
+
+def too_busy(rejected: AdmissionRejected) -> HTTPException:
+    logging.info("Admission rejected: %s", rejected)
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests, please retry shortly",
+        headers={"Retry-After": rejected.retry_after_header},
+    )
+
+def upstream_down(err: CircuitOpenError) -> HTTPException:
+    logging.error("Failing fast: %s", err)
+    return HTTPException(
+        status_code=503,
+        detail="The assistant is temporarily unavailable, please retry shortly",
+        headers={"Retry-After": str(max(1, math.ceil(err.retry_after)))},
+    )
+
+async def keyword_completion(messages: List[dict], session: Optional[str] = None) -> str:
+    async with admission.admit("keyword", count_tokens(messages) + KEYWORD_REPLY_TOKENS, session):
+        chat_response = await llm.chat_completion(
+            model=model,
+            messages=messages,
+            timeout=KEYWORD_TIMEOUT,
+        )
+
+    if not chat_response.choices:
+        logging.error("No response from OpenAI API")
+        raise HTTPException(
+            status_code=500, detail="Failed to get a response from the assistant"
+        )
+
+    return chat_response.choices[0].message.content.strip()
+
 @app.post("/keyword-search")
+@timed
 async def KeywordParse(
     data: KeywordParseRequest,
+    request: Request,
     response: Response,
     session_id: str = Depends(get_session_id),
 ):
+    fairness_key = client_key(request, data.session_id)
     session_id = data.session_id if data.session_id else session_id
     user_input = data.input
 
     # System prompt instructing the AI to detect the language automatically
-    conversation_history = conversation_histories.get(
+    lookup_started = time.perf_counter()
+    conversation_history = await conversation_histories.get_async(
         session_id,
         [
             {
@@ -122,41 +249,60 @@ async def KeywordParse(
             }
         ],
     )
-
+    record_phase("history", lookup_started)
+
+    # Simple first-turn inputs ("3 days in Tokyo") are parsed locally without the model
+    if len(conversation_history) == 1:
+        extracted_info = fast_extract(user_input)
+        if extracted_info:
+            logging.info("Keyword fast path hit")
+            conversation_history.append({"role": "user", "content": user_input})
+            conversation_history.append({
+                "role": "assistant",
+                "content": "```json\n" + json.dumps(extracted_info, ensure_ascii=False) + "\n```",
+            })
+            conversation_histories[session_id] = conversation_history
+            response.set_cookie(key="session_id", value=session_id)
+            return extracted_info
+
+    first_turn = len(conversation_history) == 1
     conversation_history.append({"role": "user", "content": user_input})
+    with phase("prompt"):
+        conversation_history, _, _ = compact_history(conversation_history)
 
     try:
         logging.info("Calling OpenAI API for keyword parsing")
-        chat_response = openai.chat.completions.create(
-            model=model,
-            messages=conversation_history,
-        )
-
-        if not chat_response.choices:
-            logging.error("No response from OpenAI API")
-            raise HTTPException(
-                status_code=500, detail="Failed to get a response from the assistant"
+        if first_turn:
+            # A first turn depends only on the input, so identical ones in flight share a call
+            response_content, _ = await keyword_flights.run(
+                canonical_key({"input": user_input}, model, "keyword"),
+                functools.partial(keyword_completion, conversation_history, fairness_key),
             )
-
-        response_content = chat_response.choices[0].message.content.strip()
+        else:
+            response_content = await keyword_completion(conversation_history, fairness_key)
         conversation_history.append({"role": "assistant", "content": response_content})
-        conversation_histories[session_id] = conversation_history
+        with phase("history"):
+            conversation_histories[session_id] = conversation_history
         response.set_cookie(key="session_id", value=session_id)
 
-        json_match = re.search(r"```json\n({.*?})\n```", response_content, re.DOTALL)
-
-        if json_match:
-            try:
-                json_string = json_match.group(1)
-                extracted_info = json.loads(json_string)
-                return extracted_info
-            except json.JSONDecodeError as json_err:
-                logging.error("JSON decode error: %s", json_err)
-                raise HTTPException(
-                    status_code=500, detail="Failed to parse JSON response from assistant",
-                )
+        try:
+            with phase("extract"):
+                extracted_info = extract_json(response_content)
+        except json.JSONDecodeError as json_err:
+            logging.error("JSON decode error: %s", json_err)
+            metrics.record_parse_failure()
+            raise HTTPException(
+                status_code=500, detail="Failed to parse JSON response from assistant",
+            )
+
+        if extracted_info is not None:
+            return extracted_info
         else:
             return {"response": response_content, "session_id": session_id}
+    except AdmissionRejected as rejected:
+        raise too_busy(rejected)
+    except CircuitOpenError as err:
+        raise upstream_down(err)
     except openai.APIError as api_err:
         logging.error("OpenAI API error: %s", api_err)
         raise HTTPException(
@@ -168,12 +314,9 @@ async def KeywordParse(
             status_code=500, detail=f"An unexpected error occurred: {e}"
         )
 
-# Adjusted itinerary endpoint without the start date
-@app.post("/itinerary")
-async def PlanItinerary(data: TripRequest, response: Response):
-    system_message = {
-        "role": "system",
-        "content": """
+itinerary_system_message = {
+    "role": "system",
+    "content": """
             Detect the language of the user's input and respond in the same language.
 
             You will receive a JSON file containing multiple items. Each item includes:
@@ -194,6 +337,7 @@ async def PlanItinerary(data: TripRequest, response: Response):
             - Ensure that each day includes lunch and dinner activities.
             - Consider the address and commute time between locations, avoiding scheduling locations that are far apart consecutively.
             - Make sure to account for commute time in the starting and ending times.
+            - If suggested day plans are given, keep their grouping and visiting order; they are already optimized for travel distance.
             - Each interval between activities should not exceed one hour.
             - Limit each title's description to around 50 words.
             - Only include activities that match the user's preferences (e.g., indoor activities).
@@ -233,57 +377,462 @@ async def PlanItinerary(data: TripRequest, response: Response):
                 ]            
             }}
             """
-    }
+}
+
+def ranked_choices(data: TripRequest) -> List[dict]:
+    if not RANK_ENABLED:
+        return data.choices
+    return select_candidates(
+        data.choices, data.days, data.start_time, data.end_time, data.preferences,
+        get_tier(data.detail).activities_per_day,
+    )
 
+def build_itinerary_messages(data: TripRequest, choices: Optional[List[dict]] = None, day: Optional[int] = None):
+    """Return the prompt messages and the ChoiceTable (None for the legacy repr encoding).
+
+    With ``day`` the prompt asks for just that day of the trip, planned from ``choices``.
+    """
+    if choices is None:
+        choices = ranked_choices(data)
+    days = 1 if day else data.days
+    end_location = data.end_location if day in (None, data.days) else None
+    choice_table = encode_choices(choices) if PROMPT_ENCODING == "compact" else None
+    if choice_table is not None:
+        choices_content = (
+            " The candidate places are listed below, one per line with the columns"
+            f" {choice_table.text.splitlines()[0]}. Use the id to refer to each place.\n"
+            + choice_table.text
+        )
+        day_plans = plan_days(choices, days, end_location) if GEO_ENABLED else None
+        if day_plans:
+            choices_content += (
+                "\n Suggested day plans (grouped by area, in visiting order):\n"
+                + "\n".join(
+                    f"Day {day}: " + ", ".join(choice_table.local_id(c) for c in plan)
+                    for day, plan in enumerate(day_plans, start=1)
+                )
+            )
+    else:
+        choices_content = f" The JSON file is {choices}."
+    if day:
+        trip_content = (
+            f"This is day {day} of a {data.days} day trip in {data.city}."
+            f" Plan only this day, as day {day}."
+        )
+    else:
+        trip_content = f"This is a {data.days} day trip in {data.city}."
     user_content_template = (
-        f"This is a {data.days} day trip in {data.city}."
+        trip_content
         + (f" The start time is {data.start_time}." if data.start_time else "")
         + (f" The end time is {data.end_time}." if data.end_time else "")
-        + (f" The itinerary should end at {data.end_location}." if data.end_location else "")
+        + (f" The itinerary should end at {end_location}." if end_location else "")
         + (f" The user preferences are: {data.preferences}." if data.preferences else "")
-        + f" The JSON file is {data.choices}."
+        + choices_content
     )
     logging.info("User content template: %s", user_content_template)
-    try:
-        logging.info("Calling OpenAI API for itinerary planning")
-        chat_response = openai.chat.completions.create(
-            model=model,
-            messages=[
-                system_message,
-                {"role": "user", "content": user_content_template},
-            ],
+    tier = get_tier(data.detail)
+    messages = [
+        tier.system_message(minimal_system_message if HYDRATE_OUTPUT else itinerary_system_message),
+        {"role": "user", "content": user_content_template},
+    ]
+    return messages, choice_table
+
+def restore_itinerary(extracted_info: dict, choice_table, data: TripRequest) -> dict:
+    """Map local ids back to data_ids, or build full days from a minimal plan."""
+    if choice_table is None:
+        return extracted_info
+    if HYDRATE_OUTPUT:
+        return hydrate_itinerary(
+            extracted_info, choice_table, data.city, data.language, get_tier(data.detail).description_chars
         )
+    return choice_table.restore(extracted_info)
+
+def repair_schedule(info: dict, data: TripRequest) -> dict:
+    if not validate_itinerary(info):
+        return info
+    tier = get_tier(data.detail)
+    tier.limit(info, data.choices)
+    if SCHEDULE_REPAIR:
+        scheduler = Scheduler(data.choices, data.start_time, data.end_time)
+        problems = scheduler.repair(info)
+        if problems:
+            logging.info("Itinerary schedule repaired: %s", [p["rule"] for p in problems])
+        # A meal added by the repair can take a day past the tier's slot limit
+        if tier.limit(info, data.choices):
+            scheduler.repair(info)
+    return info
+
+def finish_itinerary(extracted_info: dict, choice_table, data: TripRequest) -> dict:
+    return repair_schedule(restore_itinerary(extracted_info, choice_table, data), data)
+
+async def in_worker(name: str, func, *args):
+    """Run the CPU-bound ``func(*args)`` in a worker thread, timed as phase ``name``.
+
+    Ranking, geo day plans and schedule repair grow with the candidate list;
+    run on the event loop they stall every other request on the worker.
+    """
+    with phase(name):
+        return await asyncio.to_thread(func, *args)
+
+async def plan_itinerary_day(data: TripRequest, day: int, choices: List[dict]) -> dict:
+    """Plan one day of a multi-day trip; raises JSONDecodeError if the reply has no usable day."""
+    messages, choice_table = await in_worker("prompt", build_itinerary_messages, data, choices, day)
+    tier = get_tier(data.detail)
+    chat_response = await llm.chat_completion(
+        model=tier.model,
+        messages=messages,
+        timeout=ITINERARY_TIMEOUT,
+        **tier.completion_options(1),
+    )
+    record_usage(tier, chat_response)
+    if not chat_response.choices:
+        logging.error("No response from OpenAI API for day %s", day)
+        raise HTTPException(
+            status_code=500, detail="Failed to get a response from the assistant"
+        )
+    response_content = chat_response.choices[0].message.content.strip()
+    with phase("extract"):
+        # A day cut off at max_tokens is a failure, not a shorter day
+        extracted_info = extract_json(response_content, allow_truncated=False)
+    if extracted_info is not None:
+        extracted_info = await in_worker("postprocess", restore_itinerary, extracted_info, choice_table, data)
+    if not validate_itinerary(extracted_info) or not extracted_info["itineraryItems"]:
+        raise json.JSONDecodeError(f"No itinerary for day {day}", response_content, 0)
+    return extracted_info
+
+async def plan_itinerary_parallel(data: TripRequest, choices: List[dict]) -> dict:
+    """Plan each day of ``choices`` (already ranked) with its own concurrent upstream call and merge the days."""
+    groups = await in_worker("prompt", partition_choices, choices, data.days, data.end_location)
+    results = await gather_days([
+        functools.partial(plan_itinerary_day, data, day, group)
+        for day, group in enumerate(groups, start=1)
+    ])
+    return await in_worker("postprocess", repair_schedule, merge_days(results), data)
+
+def local_itinerary(data: TripRequest, choices: Optional[List[dict]] = None) -> dict:
+    """Schedule the trip without the model: geo day plans if possible, else choices in order."""
+    if choices is None:
+        choices = ranked_choices(data)
+    days = max(1, data.days)
+    day_plans = plan_days(choices, days, data.end_location) if GEO_ENABLED else None
+    if not day_plans:
+        day_plans = [choices[day::days] for day in range(days)]
+    scheduler = Scheduler(data.choices, data.start_time, data.end_time)
+    info = scheduler.build(day_plans, data.city, data.language or "")
+    if get_tier(data.detail).limit(info, data.choices):
+        scheduler.repair(info)
+    return info
+
+def itinerary_cache_key(data: TripRequest) -> str:
+    tier = get_tier(data.detail)
+    return canonical_key(
+        data.model_dump(exclude={"detail"}), tier.name, tier.model, PROMPT_ENCODING, ITINERARY_OUTPUT,
+        RANK_ENABLED, GEO_ENABLED, SCHEDULE_REPAIR, use_parallel(data.days),
+    )
 
-        if not chat_response.choices:
-            logging.error("No response from OpenAI API")
+async def request_cache_key(data: TripRequest) -> str:
+    """itinerary_cache_key() off the event loop; computed once per request and passed along."""
+    return await asyncio.to_thread(itinerary_cache_key, data)
+
+def itinerary_inputs(data: TripRequest, parallel: bool) -> Tuple[List[dict], int, int]:
+    """The ranked choices, then the upstream calls and tokens itinerary_budget() gives for them."""
+    choices = ranked_choices(data)
+    return (choices, *itinerary_budget(data, choices, parallel))
+
+def itinerary_budget(data: TripRequest, choices: List[dict], parallel: bool) -> Tuple[int, int]:
+    """Upstream calls and estimated tokens (prompt and reply) for planning the trip from ``choices``."""
+    calls = max(1, data.days) if parallel else 1
+    reply_tokens = get_tier(data.detail).max_tokens_per_day or ITINERARY_REPLY_TOKENS_PER_DAY
+    return calls, (
+        calls * count_tokens([itinerary_system_message])
+        + estimate_tokens(json.dumps(choices, ensure_ascii=False))
+        + reply_tokens * max(1, data.days)
+    )
+
+async def generate_itinerary(
+    data: TripRequest, cache_key: Optional[str], session: Optional[str] = None, kind: str = "itinerary"
+) -> dict:
+    """Plan the trip with the model once admitted; shared by every coalesced /itinerary request."""
+    # Ranked once here for the budget, the prompt and the per-day partition
+    choices, calls, tokens = await in_worker("rank", itinerary_inputs, data, use_parallel(data.days))
+    async with admission.admit(kind, tokens, session, calls):
+        return await model_itinerary(data, choices, cache_key)
+
+async def model_itinerary(data: TripRequest, choices: List[dict], cache_key: Optional[str]) -> dict:
+    if use_parallel(data.days):
+        logging.info("Calling OpenAI API for itinerary planning, one call per day")
+        try:
+            extracted_info = await plan_itinerary_parallel(data, choices)
+        except json.JSONDecodeError as json_err:
+            logging.error("JSON decode error: %s", json_err)
+            metrics.record_parse_failure()
             raise HTTPException(
-                status_code=500, detail="Failed to get a response from the assistant"
+                status_code=500, detail="Failed to parse JSON response from assistant",
             )
+        if cache_key:
+            await itinerary_cache.set(cache_key, extracted_info)
+        return extracted_info
+
+    logging.info("Calling OpenAI API for itinerary planning")
+    messages, choice_table = await in_worker("prompt", build_itinerary_messages, data, choices)
+    tier = get_tier(data.detail)
+    chat_response = await llm.chat_completion(
+        model=tier.model,
+        messages=messages,
+        timeout=ITINERARY_TIMEOUT,
+        **tier.completion_options(data.days),
+    )
+    record_usage(tier, chat_response)
 
-        response_content = chat_response.choices[0].message.content.strip()
-        json_match = re.search(r"```json\n({.*?})\n```", response_content, re.DOTALL)
-
-        if json_match:
-            try:
-                json_string = json_match.group(1)
-                extracted_info = json.loads(json_string)
-                return extracted_info
-            except json.JSONDecodeError as json_err:
-                logging.error("JSON decode error: %s", json_err)
-                raise HTTPException(
-                    status_code=500,
-                    detail="Failed to parse JSON response from assistant",
-                )
+    if not chat_response.choices:
+        logging.error("No response from OpenAI API")
+        raise HTTPException(
+            status_code=500, detail="Failed to get a response from the assistant"
+        )
+
+    response_content = chat_response.choices[0].message.content.strip()
+    try:
+        with phase("extract"):
+            # A plan cut off at max_tokens is a failure: never returned as a whole plan or cached
+            extracted_info = extract_json(response_content, allow_truncated=False)
+    except json.JSONDecodeError as json_err:
+        logging.error("JSON decode error: %s", json_err)
+        metrics.record_parse_failure()
+        raise HTTPException(
+            status_code=500, detail="Failed to parse JSON response from assistant",
+        )
+
+    if extracted_info is not None:
+        extracted_info = await in_worker("postprocess", finish_itinerary, extracted_info, choice_table, data)
+    # Raw text or JSON that is not a plan fails like a broken reply: never returned as a plan or cached
+    if not validate_itinerary(extracted_info):
+        logging.error("No itinerary in the reply: %s", response_content[:200])
+        metrics.record_parse_failure()
+        raise HTTPException(
+            status_code=500, detail="Failed to parse JSON response from assistant",
+        )
+    if cache_key:
+        await itinerary_cache.set(cache_key, extracted_info)
+    return extracted_info
+
+async def plan_trip(
+    data: TripRequest, session: Optional[str] = None, kind: str = "itinerary", request_key: Optional[str] = None
+) -> Tuple[dict, dict]:
+    """Run the /itinerary pipeline; returns the plan and how it was served.
+
+    The second value holds "cache" (BYPASS, HIT-MEMORY, HIT-DISK or MISS) and,
+    when they apply, "coalesced" and "schedule". ``session`` and ``kind``
+    ("itinerary" or "batch") set the call's admission share and priority.
+    Failures raise HTTPException, 429 when the upstream budget is exhausted.
+    ``request_key`` is the request's itinerary_cache_key() when the caller
+    already has it.
+    """
+    if request_key is None:
+        request_key = await request_cache_key(data)
+    cache_key = None
+    served = {"cache": "BYPASS"}
+    if itinerary_cache is not None:
+        cache_key = request_key
+        with phase("cache"):
+            cached_info, served["cache"] = await itinerary_cache.get(cache_key)
+        if cached_info is not None:
+            logging.info("Itinerary cache %s", served["cache"])
+            return cached_info, served
+
+    tier = get_tier(data.detail)
+    started = time.perf_counter()
+    try:
+        # Identical requests already in flight share that call instead of starting another
+        extracted_info, shared = await itinerary_flights.run(
+            request_key, functools.partial(generate_itinerary, data, cache_key, session, kind)
+        )
+        if shared:
+            served["coalesced"] = True
         else:
-            return {"response": response_content}
+            record_request(tier, (time.perf_counter() - started) * 1000)
+        return extracted_info, served
+    except AdmissionRejected as rejected:
+        raise too_busy(rejected)
     except openai.APIError as api_err:
         logging.error("OpenAI API error: %s", api_err)
+        record_request(tier, (time.perf_counter() - started) * 1000, ok=False)
+        if SCHEDULE_FALLBACK:
+            # Not cached: the next request should get a real plan again.
+            served["schedule"] = "LOCAL"
+            return await in_worker("postprocess", local_itinerary, data), served
+        if isinstance(api_err, CircuitOpenError):
+            raise upstream_down(api_err)
         raise HTTPException(
             status_code=500,
             detail="An error occurred with the OpenAI API",
         )
+    except HTTPException:
+        # Already client-facing, e.g. a reply with no plan in it
+        record_request(tier, (time.perf_counter() - started) * 1000, ok=False)
+        raise
     except Exception as e:
         logging.error("Unexpected error: %s", e)
+        record_request(tier, (time.perf_counter() - started) * 1000, ok=False)
         raise HTTPException(
             status_code=500, detail=f"An unexpected error occurred: {e}"
         )
+
+# Adjusted itinerary endpoint without the start date
+@app.post("/itinerary")
+@timed
+async def PlanItinerary(data: TripRequest, request: Request, response: Response):
+    extracted_info, served = await plan_trip(data, client_key(request))
+    response.headers["X-Cache"] = served["cache"]
+    if served.get("coalesced"):
+        response.headers["X-Coalesced"] = "true"
+    if served.get("schedule"):
+        response.headers["X-Schedule"] = served["schedule"]
+    return extracted_info
+
+async def stream_itinerary(
+    data: TripRequest,
+    include_slots: bool,
+    cache_key: Optional[str] = None,
+    cached: Optional[tuple] = None,
+    choices: Optional[List[dict]] = None,
+):
+    started = time.perf_counter()
+    first_day_ms = None
+
+    def timing():
+        return {
+            "first_day_ms": first_day_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    if itinerary_cache is None:
+        cache_key = None
+    if cache_key is not None:
+        cached_info, cache_status = cached or await itinerary_cache.get(cache_key)
+        if cached_info is not None:
+            logging.info("Itinerary cache %s", cache_status)
+            for day in cached_info["itineraryItems"]:
+                yield sse("day", day)
+            first_day_ms = timing()["total_ms"]
+            yield sse("done", {"itinerary": cached_info, "cache": cache_status, "timing": timing()})
+            return
+
+    parser = ItineraryStreamParser(
+        include_slots=include_slots and not HYDRATE_OUTPUT,
+        day_key="days" if HYDRATE_OUTPUT else "itineraryItems",
+    )
+    messages, choice_table = await in_worker("prompt", build_itinerary_messages, data, choices)
+    tier = get_tier(data.detail)
+    scheduler = None
+    if SCHEDULE_REPAIR:
+        scheduler = await in_worker("postprocess", Scheduler, data.choices, data.start_time, data.end_time)
+    try:
+        logging.info("Streaming OpenAI API for itinerary planning")
+        async for text in llm.stream_completion(
+            model=tier.model,
+            messages=messages,
+            timeout=ITINERARY_TIMEOUT,
+            **tier.completion_options(data.days),
+        ):
+            for event, payload in parser.feed(text):
+                if HYDRATE_OUTPUT:
+                    payload = hydrate_day(payload, choice_table, data.city, data.language, tier.description_chars)
+                elif choice_table is not None:
+                    if event == "day":
+                        choice_table.restore_day(payload)
+                    else:
+                        choice_table.restore_day({"slots": [payload["slot"]]})
+                if event == "day" and validate_itinerary({"itineraryItems": [payload]}):
+                    tier.limit({"itineraryItems": [payload]}, data.choices)
+                    if scheduler is not None:
+                        scheduler.repair_day(payload, parser.days)
+                        if tier.limit({"itineraryItems": [payload]}, data.choices):
+                            scheduler.repair_day(payload, parser.days)
+                if HYDRATE_OUTPUT and include_slots:
+                    for slot in payload["slots"]:
+                        yield sse("slot", {"day_index": parser.days, "slot": slot})
+                if event == "day" and first_day_ms is None:
+                    first_day_ms = timing()["total_ms"]
+                    logging.info("Itinerary time to first day: %.1f ms", first_day_ms)
+                yield sse(event, payload)
+    except openai.APIError as api_err:
+        logging.error("OpenAI API error: %s", api_err)
+        record_request(tier, timing()["total_ms"], ok=False)
+        yield sse("error", {"detail": "An error occurred with the OpenAI API"})
+        return
+
+    extracted_info = parser.result()
+    if parser.truncated:
+        logging.error("JSON decode error: itinerary stream was cut off before the plan closed")
+        extracted_info = None
+    if extracted_info is not None:
+        extracted_info = await in_worker("postprocess", finish_itinerary, extracted_info, choice_table, data)
+    if not validate_itinerary(extracted_info):
+        metrics.record_parse_failure()
+        yield sse("error", {
+            "detail": "Failed to parse JSON response from assistant",
+            "response": parser.text.strip(),
+        })
+        return
+    if cache_key:
+        await itinerary_cache.set(cache_key, extracted_info)
+    logging.info("Itinerary stream finished: %s", timing())
+    record_request(tier, timing()["total_ms"])
+    yield sse("done", {"itinerary": extracted_info, "timing": timing()})
+
+# Server-Sent Events variant of /itinerary: emits "day" (and optionally "slot")
+# events while the model is still generating, then a final "done" event.
+@app.post("/itinerary/stream")
+async def StreamItinerary(data: TripRequest, request: Request, slots: bool = False):
+    cache_key = cached = None
+    if itinerary_cache is not None:
+        cache_key = await request_cache_key(data)
+        cached = await itinerary_cache.get(cache_key)
+    ticket = None
+    choices = None
+    if cached is None or cached[0] is None:
+        # Admit before the first byte so an over-budget request still gets a real 429
+        choices, calls, tokens = await in_worker("rank", itinerary_inputs, data, False)
+        try:
+            ticket = await admission.acquire("itinerary", tokens, client_key(request), calls)
+        except AdmissionRejected as rejected:
+            raise too_busy(rejected)
+
+    async def events():
+        try:
+            async for event in stream_itinerary(
+                data, include_slots=slots, cache_key=cache_key, cached=cached, choices=choices
+            ):
+                yield event
+        finally:
+            admission.release(ticket)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(admission.release, ticket),
+    )
+
+# Bulk pre-generation: plans every item through the /itinerary pipeline and
+# streams one NDJSON record per item as it finishes, then a summary record.
+@app.post("/itinerary/batch")
+async def BatchItinerary(data: BatchRequest):
+    if len(data.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413, detail=f"A batch can hold at most {BATCH_MAX_ITEMS} items"
+        )
+    concurrency = min(data.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+
+    async def records():
+        plan = functools.partial(plan_trip, kind="batch")
+        async for record in run_batch(data.items, itinerary_cache_key, plan, concurrency):
+            yield ndjson(record)
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+# Prometheus text format: request and upstream latency histograms, token
+# usage, parse failures and the pipeline's own counters and gauges.
+@app.get("/metrics")
+async def Metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,248 @@
+# metrics.py
+#
+# In-process metrics in the Prometheus text format, served by /metrics, so
+# a slow request can be split into upstream time and our own work without
+# an external agent. Counters and histograms are plain dicts updated on the
+# request path (a dict lookup and a bisect per observation); the stats the
+# other modules already keep (cache, sessions, admission, breakers, tiers,
+# ...) are read only when /metrics is scraped. The current route is kept in
+# a context variable so deep call sites (token usage, parse failures) are
+# labelled by endpoint without threading it through every function.
+
+import bisect
+import contextvars
+import math
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Config
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Seconds; upstream calls run from ~0.3 s (keyword turns) to over a minute (long plans).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 90, 120)
+
+_route = contextvars.ContextVar("metrics_route", default="none")
+
+
+def current_route() -> str:
+    return _route.get()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, float] = {}
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.series: Dict[Tuple, list] = {}  # key -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+http_duration = Histogram(
+    "http_request_duration_seconds", "Time to handle a request, streamed bodies included.",
+    ("route", "method", "status"),
+)
+http_in_flight = Gauge("http_requests_in_flight", "Requests being handled.", ("route",))
+llm_duration = Histogram(
+    "llm_call_duration_seconds", "Upstream model call latency per attempt.", ("provider", "model", "status"),
+)
+llm_tokens = Counter("llm_tokens_total", "Tokens reported in completion usage.", ("route", "model", "kind"))
+parse_failures = Counter(
+    "json_parse_failures_total", "Model replies that could not be parsed as the expected JSON.", ("route",),
+)
+
+REGISTRY: List[Metric] = [http_duration, http_in_flight, llm_duration, llm_tokens, parse_failures]
+
+# name -> (label name for nested dicts, function returning a stats dict)
+_collectors: Dict[str, Tuple[Optional[str], Callable[[], dict]]] = {}
+
+
+def register_stats(name: str, collect: Callable[[], dict], label: Optional[str] = None):
+    """Export a module's stats dict as ``<name>_<key>`` gauges at scrape time.
+
+    With ``label``, ``collect()`` returns ``{label value: stats dict}`` instead
+    (per tier, per provider option, ...); plain values next to those dicts are
+    exported without the label, as totals. Numbers and booleans become
+    samples, strings become a ``<name>_<key>{<key>="value"} 1`` sample and
+    anything else is skipped.
+    """
+    _collectors[name] = (label, collect)
+
+
+def _sample_lines(metric: str, labels: str, key: str, value) -> List[str]:
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        return [f"{metric}{labels and '{' + labels + '}'} {_number(value)}"]
+    if isinstance(value, str):
+        pairs = ",".join(filter(None, (labels, f'{key}="{_escape(value)}"')))
+        return [f"{metric}{{{pairs}}} 1"]
+    return []
+
+
+def _render_stats(name: str, label: Optional[str], stats: dict) -> List[str]:
+    samples: Dict[str, List[str]] = {}
+    groups = stats.items() if label else [(None, stats)]
+    for group, values in groups:
+        if not isinstance(values, dict):
+            if label:
+                metric = f"{name}_{group}"
+                samples.setdefault(metric, []).extend(_sample_lines(metric, "", group, values))
+            continue
+        labels = f'{label}="{_escape(group)}"' if label else ""
+        for key, value in values.items():
+            metric = f"{name}_{key}"
+            samples.setdefault(metric, []).extend(_sample_lines(metric, labels, key, value))
+    lines = []
+    for metric, metric_lines in samples.items():
+        if metric_lines:
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(metric_lines)
+    return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, (label, collect) in _collectors.items():
+        lines.extend(_render_stats(name, label, collect()))
+    return "\n".join(lines) + "\n"
+
+
+def record_usage(model: str, response):
+    """Count a completion's prompt and completion tokens against the current route."""
+    usage = getattr(response, "usage", None)
+    if usage is None or not METRICS_ENABLED:
+        return
+    route = _route.get()
+    llm_tokens.inc(getattr(usage, "prompt_tokens", 0) or 0, route=route, model=model, kind="prompt")
+    llm_tokens.inc(getattr(usage, "completion_tokens", 0) or 0, route=route, model=model, kind="completion")
+
+
+def record_parse_failure():
+    if METRICS_ENABLED:
+        parse_failures.inc(route=_route.get())
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template, method and status.
+
+    Plain ASGI rather than BaseHTTPMiddleware, so streamed responses pass
+    through untouched and the timing covers the whole body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route_of(self, scope) -> str:
+        if self._routes is None:
+            self._routes = {route.path for route in getattr(scope.get("app"), "routes", [])}
+        path = scope.get("path", "")
+        return path if path in self._routes else "unmatched"  # keep label values bounded
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        route = self._route_of(scope)
+        token = _route.set(route)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        http_in_flight.inc(route=route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec(route=route)
+            http_duration.observe(
+                time.perf_counter() - started, route=route, method=scope.get("method", ""), status=status["code"]
+            )
+            _route.reset(token)
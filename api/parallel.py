@@ -0,0 +1,100 @@
+# parallel.py
+#
+# Per-day fan-out for multi-day itineraries. Generation time grows with the
+# length of the reply, so instead of one completion for the whole trip the
+# choices are split into one group per day and every day is planned by its
+# own, concurrent upstream call; the days are then merged back into the
+# usual itineraryItems shape.
+
+import asyncio
+import datetime
+import os
+from typing import Awaitable, Callable, List, Optional
+
+from api.geo import GEO_ENABLED, plan_days
+from api.ranking import category_of
+
+# Config
+ITINERARY_PARALLEL = os.getenv("ITINERARY_PARALLEL", "true").lower() == "true"
+ITINERARY_PARALLEL_MIN_DAYS = int(os.getenv("ITINERARY_PARALLEL_MIN_DAYS", "2"))
+ITINERARY_DAY_CONCURRENCY = int(os.getenv("ITINERARY_DAY_CONCURRENCY", "5"))  # trips are 1-5 days
+
+parallel_stats = {"requests": 0, "days": 0}
+
+
+def use_parallel(days: int) -> bool:
+    return ITINERARY_PARALLEL and days >= ITINERARY_PARALLEL_MIN_DAYS
+
+
+def partition_choices(choices: List[dict], days: int, end_location: Optional[str] = None) -> List[List[dict]]:
+    """Split the choices into ``days`` groups, each with its share of meals.
+
+    With coordinates the groups are api.geo's day plans (one area per day);
+    choices the plans leave out, or all of them without coordinates, are
+    dealt out round-robin per category so every day gets lunch and dinner
+    options when there are enough.
+    """
+    days = max(1, days)
+    groups: List[List[dict]] = [[] for _ in range(days)]
+    plans = plan_days(choices, days, end_location) if GEO_ENABLED else None
+    if plans:
+        for group, plan in zip(groups, plans):
+            group.extend(plan)
+    placed = {id(choice) for group in groups for choice in group}
+    turn = {"activity": 0, "lunch": 0, "dinner": 0}
+    for choice in choices:
+        if id(choice) in placed:
+            continue
+        category = category_of(choice)
+        # Fill the day with the fewest of this category first.
+        counts = [sum(category_of(c) == category for c in group) for group in groups]
+        target = min(range(days), key=lambda d: (counts[d], (d - turn[category]) % days))
+        groups[target].append(choice)
+        turn[category] = (target + 1) % days
+    return groups
+
+
+def _date(value) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(str(value or "")[:10])
+    except ValueError:
+        return None
+
+
+def merge_days(results: List[dict]) -> dict:
+    """Join per-day itineraries into one, numbering days 1..n with consecutive dates."""
+    items = []
+    for result in results:
+        for day in result.get("itineraryItems") or []:
+            if isinstance(day, dict):
+                items.append(day)
+                break  # each call plans exactly one day
+    first = next((_date(day.get("dates")) for day in items if _date(day.get("dates"))), None)
+    offset = next((i for i, day in enumerate(items) if _date(day.get("dates"))), 0)
+    for index, day in enumerate(items):
+        day["day"] = index + 1
+        if first is not None:
+            day["dates"] = (first + datetime.timedelta(days=index - offset)).isoformat()
+    return {"itineraryItems": items}
+
+
+async def gather_days(factories: List[Callable[[], Awaitable[dict]]], limit: int = ITINERARY_DAY_CONCURRENCY):
+    """Run one coroutine per day, at most ``limit`` at a time, keeping day order.
+
+    If any day fails the others are cancelled and the error propagates.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(factory):
+        async with semaphore:
+            return await factory()
+
+    parallel_stats["requests"] += 1
+    parallel_stats["days"] += len(factories)
+    tasks = [asyncio.ensure_future(run(factory)) for factory in factories]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
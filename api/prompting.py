@@ -0,0 +1,166 @@
+# prompting.py
+#
+# Compact encoding of TripRequest.choices for the itinerary prompt. Instead
+# of the Python repr of every field the client sent, each choice becomes one
+# "|"-separated row holding only what the planner needs, under a short local
+# id ("c1", "c2", ...) that is mapped back to the real data_id afterwards.
+
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+from api.sessions import estimate_tokens
+
+# Config
+PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "compact")  # "compact" or "repr"
+PROMPT_DESCRIPTION_CHARS = int(os.getenv("PROMPT_DESCRIPTION_CHARS", "160"))
+PROMPT_STATS_SAMPLE = int(os.getenv("PROMPT_STATS_SAMPLE", "64"))  # choices sampled to estimate the repr size
+
+COLUMNS = ("id", "category", "title", "rating", "address", "hours", "description")
+FIELD_ALIASES = {
+    "category": ("category", "type"),
+    "title": ("title", "name", "location"),
+    "rating": ("rating",),
+    "address": ("address",),
+    "hours": ("operating_hours", "operating hours", "hours", "open_hours"),
+    "description": ("description", "discription", "summary", "snippet"),
+}
+IMAGE_FIELDS = ("thumbnail", "image", "image_url", "photo")
+DAY_NAMES = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+prompt_stats = {"requests": 0, "tokens_before": 0, "tokens_after": 0}
+
+
+def first_field(choice: dict, names) -> Optional[object]:
+    for name in names:
+        value = choice.get(name)
+        if value not in (None, "", [], {}):
+            return value
+    return None
+
+
+def shorten(text: str, limit: int) -> str:
+    text = " ".join(str(text).split())
+    if len(text) <= limit:
+        return text
+    cut = text[:limit].rsplit(" ", 1)[0]
+    return cut.rstrip(",.;:") + "…"
+
+
+def compact_hours(hours) -> str:
+    """Collapse operating hours to e.g. "Mon-Sun 9AM-5PM" or "Mon-Fri 9AM-5PM; Sat Closed"."""
+    if isinstance(hours, list):
+        merged = {}
+        for item in hours:
+            if isinstance(item, dict):
+                merged.update(item)
+        hours = merged or ", ".join(map(str, hours))
+    if not isinstance(hours, dict):
+        return shorten(hours, 60)
+    by_day = {str(k).lower(): " ".join(str(v).replace(" ", "").split()) for k, v in hours.items()}
+    ordered = [(day, by_day[day]) for day in DAY_NAMES if day in by_day]
+    if not ordered:
+        return shorten("; ".join(f"{k} {v}" for k, v in by_day.items()), 60)
+    groups = []
+    for day, value in ordered:
+        if groups and groups[-1][2] == value:
+            groups[-1][1] = day
+        else:
+            groups.append([day, day, value])
+    return "; ".join(
+        (first[:3].title() if first == last else f"{first[:3].title()}-{last[:3].title()}") + f" {value}"
+        for first, last, value in groups
+    )
+
+
+def _cell(value) -> str:
+    return re.sub(r"[|\n]+", " ", str(value)).strip()
+
+
+class ChoiceTable:
+    """The encoded choices plus the mapping from local ids back to the originals."""
+
+    def __init__(self, choices: List[dict], description_chars: int = PROMPT_DESCRIPTION_CHARS):
+        self.choices: Dict[str, dict] = {}
+        self.by_data_id: Dict[str, dict] = {}
+        self._local_ids: Dict[int, str] = {}
+        rows = ["|".join(COLUMNS)]
+        for index, choice in enumerate(choices, start=1):
+            local_id = f"c{index}"
+            self.choices[local_id] = choice
+            self._local_ids[id(choice)] = local_id
+            if choice.get("data_id") is not None:
+                self.by_data_id[choice["data_id"]] = choice
+            fields = {
+                column: first_field(choice, aliases) for column, aliases in FIELD_ALIASES.items()
+            }
+            if fields["hours"] is not None:
+                fields["hours"] = compact_hours(fields["hours"])
+            if fields["description"] is not None:
+                fields["description"] = shorten(fields["description"], description_chars)
+            rows.append(
+                "|".join([local_id] + [_cell(fields[c]) if fields[c] is not None else "" for c in COLUMNS[1:]])
+            )
+        self.text = "\n".join(rows)
+
+    def lookup(self, local_id) -> Optional[dict]:
+        return self.choices.get(str(local_id).strip())
+
+    def local_id(self, choice: dict) -> Optional[str]:
+        return self._local_ids.get(id(choice))
+
+    def restore_day(self, day: dict) -> dict:
+        """Swap local ids in a generated day for real data_ids and fill in its image."""
+        if not isinstance(day, dict):
+            return day
+        for slot in day.get("slots") or []:
+            if not isinstance(slot, dict):
+                continue
+            choice = self.lookup(slot.get("data_id", ""))
+            if choice is not None and choice.get("data_id") is not None:
+                slot["data_id"] = choice["data_id"]
+        image = self.day_image(day)
+        if image:
+            day["image"] = image
+        elif not str(day.get("image") or "").startswith("http"):
+            day["image"] = ""
+        return day
+
+    def day_image(self, day: dict) -> Optional[str]:
+        for slot in day.get("slots") or []:
+            choice = self.by_data_id.get(slot.get("data_id")) if isinstance(slot, dict) else None
+            if choice is not None:
+                image = first_field(choice, IMAGE_FIELDS)
+                if image:
+                    return image
+        return None
+
+    def restore(self, itinerary: dict) -> dict:
+        for day in itinerary.get("itineraryItems") or []:
+            self.restore_day(day)
+        return itinerary
+
+
+def repr_tokens(choices: List[dict]) -> int:
+    """Estimate the tokens of the legacy repr encoding from an evenly spaced sample of choices.
+
+    Building ``str(choices)`` for thousands of candidates costs more than the
+    rest of the encoding, only to log a number.
+    """
+    if len(choices) <= PROMPT_STATS_SAMPLE:
+        return estimate_tokens(str(choices))
+    step = len(choices) / PROMPT_STATS_SAMPLE
+    sample = [choices[int(index * step)] for index in range(PROMPT_STATS_SAMPLE)]
+    return max(1, estimate_tokens(str(sample)) * len(choices) // PROMPT_STATS_SAMPLE)
+
+
+def encode_choices(choices: List[dict]) -> ChoiceTable:
+    table = ChoiceTable(choices)
+    before = repr_tokens(choices)
+    after = estimate_tokens(table.text)
+    prompt_stats["requests"] += 1
+    prompt_stats["tokens_before"] += before
+    prompt_stats["tokens_after"] += after
+    logging.info("Itinerary choices tokens before=%s after=%s", before, after)
+    return table
@@ -0,0 +1,118 @@
+# providers.py
+#
+# Chat-completion providers behind one small interface, so the router in
+# api/router.py can pick between OpenAI and Mistral models per call. Every
+# provider returns an object shaped like an OpenAI chat completion
+# (``.choices[0].message.content``) and streams plain text deltas, and
+# reports failures as openai.APIError so the endpoints handle them the same
+# way whichever provider served the call.
+
+import logging
+import os
+from typing import AsyncIterator, List, Optional
+
+import httpx
+import openai
+
+try:
+    from mistralai import Mistral
+except ImportError:  # optional: only needed when MISTRAL_API_KEY is set
+    Mistral = None
+
+# Config
+MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+MISTRAL_BASE_URL = os.getenv("MISTRAL_BASE_URL")  # Point at a local fake upstream when set
+
+
+class ProviderError(openai.APIError):
+    """A non-OpenAI provider failed; raised as an APIError so callers need one except clause."""
+
+    def __init__(self, provider: str, message: str, status_code: Optional[int] = None):
+        request = httpx.Request("POST", f"provider://{provider}/chat/completions")
+        super().__init__(message, request, body=None)
+        self.provider = provider
+        self.status_code = status_code  # None when the SDK gave no HTTP status
+
+
+class Provider:
+    """Interface: ``complete`` returns an OpenAI-shaped completion, ``stream`` yields text."""
+
+    name = "provider"
+
+    async def complete(self, model: str, messages: List[dict], timeout: float, **kwargs):
+        raise NotImplementedError
+
+    def stream(self, model: str, messages: List[dict], timeout: float, **kwargs) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+
+    def __init__(self, client: openai.AsyncOpenAI):
+        self.client = client
+
+    async def complete(self, model: str, messages: List[dict], timeout: float, **kwargs):
+        return await self.client.chat.completions.create(
+            model=model, messages=messages, timeout=timeout, **kwargs
+        )
+
+    async def stream(self, model: str, messages: List[dict], timeout: float, **kwargs):
+        stream = await self.client.chat.completions.create(
+            model=model, messages=messages, stream=True, timeout=timeout, **kwargs
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def close(self):
+        await self.client.close()
+
+
+class MistralProvider(Provider):
+    """Mistral's SDK (as used by the old main-old.py handlers), called through its async API."""
+
+    name = "mistral"
+
+    def __init__(self, api_key: str, server_url: Optional[str] = None):
+        if Mistral is None:
+            raise RuntimeError("mistralai is not installed")
+        self.client = Mistral(api_key=api_key, server_url=server_url) if server_url else Mistral(api_key=api_key)
+
+    async def complete(self, model: str, messages: List[dict], timeout: float, **kwargs):
+        try:
+            response = await self.client.chat.complete_async(
+                model=model, messages=messages, timeout_ms=int(timeout * 1000), **kwargs
+            )
+        except Exception as err:
+            raise ProviderError(self.name, f"Mistral API error: {err}", getattr(err, "status_code", None)) from err
+        if response is None:
+            raise ProviderError(self.name, "Mistral API returned no response")
+        return response
+
+    async def stream(self, model: str, messages: List[dict], timeout: float, **kwargs):
+        try:
+            events = await self.client.chat.stream_async(
+                model=model, messages=messages, timeout_ms=int(timeout * 1000), **kwargs
+            )
+            async for event in events:
+                choices = event.data.choices
+                if choices and choices[0].delta.content:
+                    yield choices[0].delta.content
+        except ProviderError:
+            raise
+        except Exception as err:
+            raise ProviderError(self.name, f"Mistral API error: {err}", getattr(err, "status_code", None)) from err
+
+
+def default_providers(openai_client: openai.AsyncOpenAI) -> List[Provider]:
+    providers: List[Provider] = [OpenAIProvider(openai_client)]
+    if MISTRAL_API_KEY:
+        try:
+            providers.append(MistralProvider(MISTRAL_API_KEY, MISTRAL_BASE_URL))
+        except RuntimeError as err:
+            logging.warning("Mistral provider disabled: %s", err)
+    return providers
@@ -0,0 +1,147 @@
+# ranking.py
+#
+# Local pre-selection of itinerary candidates. A 1-2 day trip only has room
+# for a handful of slots, so instead of sending every choice to the model we
+# score them (rating, popularity, opening hours against the trip window,
+# keyword match with the preferences) and keep the best few per category,
+# scaled by the number of days.
+
+import logging
+import math
+import os
+import re
+from typing import List, Optional
+
+from api.hours import overlap, parse_hours, parse_time
+from api.prompting import FIELD_ALIASES, first_field
+
+# Config
+RANK_ENABLED = os.getenv("RANK_ENABLED", "true").lower() == "true"
+RANK_ACTIVITIES_PER_DAY = int(os.getenv("RANK_ACTIVITIES_PER_DAY", "4"))
+RANK_MEALS_PER_DAY = int(os.getenv("RANK_MEALS_PER_DAY", "1"))
+RANK_OVERSAMPLE = float(os.getenv("RANK_OVERSAMPLE", "2.5"))  # candidates sent per slot
+
+DEFAULT_WINDOW = (9 * 60, 21 * 60)
+MEAL_WINDOWS = {"lunch": (11 * 60, 14 * 60 + 30), "dinner": (17 * 60 + 30, 21 * 60)}
+MEAL_WORDS = {
+    "lunch": ("lunch", "ランチ", "昼"),
+    "dinner": ("dinner", "ディナー", "夜", "izakaya", "居酒屋", "bar"),
+}
+PREFERENCE_STOPWORDS = {
+    "and", "the", "with", "for", "not", "but", "like", "love", "want", "some", "more",
+    "less", "very", "really", "prefer", "please", "only", "also", "lot", "lots",
+}
+_WORD = re.compile(r"[^\W_]{3,}|[^\x00-\x7f]{2,}")
+
+ranking_stats = {"requests": 0, "candidates": 0, "kept": 0, "dropped": 0}
+
+
+def category_of(choice: dict) -> str:
+    """Bucket a choice into activity, lunch or dinner."""
+    category = str(first_field(choice, FIELD_ALIASES["category"]) or "").lower()
+    for meal, words in MEAL_WORDS.items():
+        if any(word in category for word in words):
+            return meal
+    return "activity"
+
+
+def preference_terms(preferences: Optional[str]) -> List[str]:
+    if not preferences:
+        return []
+    terms = {w.casefold() for w in _WORD.findall(preferences)} - PREFERENCE_STOPWORDS
+    # Crude plural folding so "museums" still matches "Museum".
+    return sorted({t[:-1] if len(t) > 4 and t.endswith("s") else t for t in terms})
+
+
+def _float(value) -> Optional[float]:
+    try:
+        return float(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+
+
+def hours_fit(choice: dict, window) -> Optional[float]:
+    """Average share of ``window`` the place is open across the week; None if unknown."""
+    hours = parse_hours(first_field(choice, FIELD_ALIASES["hours"]))
+    if hours is None:
+        return None
+    length = max(1, window[1] - window[0])
+    return sum(min(1.0, overlap(ranges, window) / length) for ranges in hours.values()) / len(hours)
+
+
+def score_choice(choice: dict, category: str, window, terms: List[str]) -> float:
+    score = 0.0
+    rating = _float(choice.get("rating"))
+    score += (rating / 5.0) if rating is not None else 0.5
+    reviews = _float(choice.get("reviews"))
+    if reviews:
+        score += min(math.log10(reviews + 1) / 5.0, 1.0) * 0.3
+    fit = hours_fit(choice, MEAL_WINDOWS.get(category, window))
+    if fit is None:
+        score += 0.5
+    elif fit == 0:
+        score -= 2.0  # closed whenever we could visit
+    else:
+        score += fit
+    if terms:
+        text = " ".join(
+            str(first_field(choice, FIELD_ALIASES[field]) or "")
+            for field in ("title", "category", "description")
+        ).casefold()
+        score += 0.5 * min(3, sum(1 for term in terms if term in text))
+    return score
+
+
+def trip_window(start_time: Optional[str], end_time: Optional[str]):
+    start, end = parse_time(start_time), parse_time(end_time)
+    return (
+        DEFAULT_WINDOW[0] if start is None else start,
+        DEFAULT_WINDOW[1] if end is None else end,
+    )
+
+
+def select_candidates(
+    choices: List[dict],
+    days: int,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    preferences: Optional[str] = None,
+    activities_per_day: Optional[int] = None,
+) -> List[dict]:
+    """Keep the top-scoring choices per category; the original order is preserved."""
+    days = max(1, days)
+    activities_per_day = activities_per_day or RANK_ACTIVITIES_PER_DAY
+    quotas = {
+        "activity": math.ceil(activities_per_day * days * RANK_OVERSAMPLE),
+        "lunch": math.ceil(RANK_MEALS_PER_DAY * days * RANK_OVERSAMPLE),
+        "dinner": math.ceil(RANK_MEALS_PER_DAY * days * RANK_OVERSAMPLE),
+    }
+    ranking_stats["requests"] += 1
+    ranking_stats["candidates"] += len(choices)
+    if len(choices) <= sum(quotas.values()):
+        ranking_stats["kept"] += len(choices)
+        return choices
+
+    window = trip_window(start_time, end_time)
+    terms = preference_terms(preferences)
+    buckets = {"activity": [], "lunch": [], "dinner": []}
+    for index, choice in enumerate(choices):
+        category = category_of(choice)
+        buckets[category].append((score_choice(choice, category, window, terms), index))
+
+    keep = set()
+    spare = []
+    for category, scored in buckets.items():
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        keep.update(index for _, index in scored[:quotas[category]])
+        spare.extend(scored[quotas[category]:])
+    # Unused quota (e.g. no dinner places at all) goes to the best leftovers.
+    spare.sort(key=lambda item: (-item[0], item[1]))
+    for _, index in spare[:max(0, sum(quotas.values()) - len(keep))]:
+        keep.add(index)
+
+    selected = [choice for index, choice in enumerate(choices) if index in keep]
+    ranking_stats["kept"] += len(selected)
+    ranking_stats["dropped"] += len(choices) - len(selected)
+    logging.info("Itinerary candidates kept=%s dropped=%s", len(selected), len(choices) - len(selected))
+    return selected
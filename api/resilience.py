@@ -0,0 +1,178 @@
+# resilience.py
+#
+# Failure handling for upstream LLM calls, used by api/router.py. Errors are
+# classified so only transient ones (rate limits and 5xx) are retried, with
+# capped exponential backoff and full jitter. Timeouts and dropped
+# connections are not retried unless LLM_RETRY_TIMEOUTS is set: the request
+# may already have reached the upstream, and a completion is not idempotent,
+# so a retry can generate (and bill) the same completion twice.
+# A retry budget keeps retries to a fraction of recent traffic so they
+# cannot multiply load during an outage, and a per-option circuit breaker
+# stops sending calls to a provider that keeps failing and lets a single
+# probe through after a cool-down.
+
+import os
+import random
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+import openai
+
+# Config
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))  # extra attempts per call
+LLM_RETRY_TIMEOUTS = os.getenv("LLM_RETRY_TIMEOUTS", "false").lower() == "true"  # also retry timeouts, dropped connections
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))  # seconds
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))  # retries per call
+LLM_RETRY_BUDGET_MIN = int(os.getenv("LLM_RETRY_BUDGET_MIN", "5"))  # retries always allowed per window
+LLM_RETRY_BUDGET_WINDOW = float(os.getenv("LLM_RETRY_BUDGET_WINDOW", "10"))  # seconds
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))  # consecutive failures to open
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))  # seconds open before a probe
+
+# Failure classes that are retried; all transient classes still count toward the breaker.
+RETRYABLE = {"rate_limit", "server"} | ({"timeout", "connection"} if LLM_RETRY_TIMEOUTS else set())
+
+resilience_stats = {
+    "calls": 0,
+    "retries": 0,
+    "retries_denied": 0,
+    "gave_up": 0,
+    "fast_failures": 0,
+    "retried_rate_limit": 0,
+    "retried_server": 0,
+    "retried_timeout": 0,
+    "retried_connection": 0,
+}
+
+
+class CircuitOpenError(openai.APIError):
+    """Every option for a model has an open breaker; raised without calling upstream."""
+
+    def __init__(self, model: str, retry_after: float):
+        request = httpx.Request("POST", f"circuit://{model}/chat/completions")
+        super().__init__(f"All providers for {model} are unavailable", request, body=None)
+        self.retry_after = retry_after
+
+
+def classify(err: BaseException) -> Optional[str]:
+    """Return the transient failure class of a call, or None when it is not transient.
+
+    Only the classes in RETRYABLE are retried.
+    """
+    if isinstance(err, CircuitOpenError):
+        return None
+    if isinstance(err, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(err, openai.APIConnectionError):
+        return "connection"
+    status = getattr(err, "status_code", None)
+    if status == 429:
+        return "rate_limit"
+    if status is not None and status >= 500:
+        return "server"
+    if status is None and isinstance(err, openai.APIError) and getattr(err, "provider", None):
+        return "server"  # another provider's SDK failed without a status
+    return None
+
+
+def retry_after(err: BaseException) -> Optional[float]:
+    """The upstream's Retry-After hint in seconds, if it sent one."""
+    response = getattr(err, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff(attempt: int, hint: Optional[float] = None, rng=random) -> float:
+    """Full-jitter exponential backoff, never shorter than the upstream's hint."""
+    delay = rng.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    return max(delay, min(hint, LLM_BACKOFF_MAX)) if hint else delay
+
+
+class RetryBudget:
+    """Allow retries up to ``ratio`` of the calls in the last ``window`` seconds (plus ``minimum``)."""
+
+    def __init__(
+        self,
+        ratio: float = LLM_RETRY_BUDGET_RATIO,
+        minimum: int = LLM_RETRY_BUDGET_MIN,
+        window: float = LLM_RETRY_BUDGET_WINDOW,
+        clock=time.monotonic,
+    ):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._clock = clock
+        self._calls = deque()
+        self._retries = deque()
+
+    def _trim(self, now: float):
+        for events in (self._calls, self._retries):
+            while events and events[0] < now - self.window:
+                events.popleft()
+
+    def record_call(self):
+        self._calls.append(self._clock())
+
+    def try_retry(self) -> bool:
+        now = self._clock()
+        self._trim(now)
+        if len(self._retries) >= self.minimum + self.ratio * len(self._calls):
+            return False
+        self._retries.append(now)
+        return True
+
+
+class CircuitBreaker:
+    """closed -> open after ``failures`` consecutive failures -> half-open after ``reset`` seconds.
+
+    Half-open lets one probe call through: success closes the breaker,
+    failure opens it for another ``reset`` seconds.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, reset: float = LLM_BREAKER_RESET, clock=time.monotonic):
+        self.failures = failures
+        self.reset = reset
+        self._clock = clock
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+
+    def available(self) -> bool:
+        """Whether a call may be sent now (does not claim the half-open probe)."""
+        if self.state == "open" and self._clock() - self.opened_at >= self.reset:
+            self.state = "half_open"
+        return self.state == "closed" or (self.state == "half_open" and not self._probing)
+
+    def before_call(self):
+        if self.state == "half_open":
+            self._probing = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.consecutive += 1
+        self._probing = False
+        if self.state == "half_open" or self.consecutive >= self.failures:
+            if self.state != "open":
+                self.opens += 1
+            self.state = "open"
+            self.opened_at = self._clock()
+
+    def record_cancel(self):
+        self._probing = False
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker lets a probe through."""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.reset - (self._clock() - self.opened_at))
@@ -0,0 +1,332 @@
+# router.py
+#
+# Latency-aware routing of chat completions across providers. A logical
+# model name ("gpt-4o") maps to a list of interchangeable provider:model
+# options; every call goes to the fastest healthy option by recent median
+# latency, and, when hedging is on, a call that runs past that option's p95
+# starts a second request on the runner-up and takes whichever answers
+# first. Options whose circuit breaker is open are skipped, and transient
+# failures are retried (see api/resilience.py) within the call's timeout.
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from api import metrics
+from api.providers import Provider
+from api.resilience import (
+    LLM_RETRIES,
+    RETRYABLE,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryBudget,
+    backoff,
+    classify,
+    resilience_stats,
+    retry_after,
+)
+
+# Config
+LLM_ROUTES = os.getenv("LLM_ROUTES")  # JSON: {"gpt-4o": ["openai:gpt-4o", "mistral:mistral-large-latest"]}
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))  # seconds
+LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))  # calls kept per option
+LLM_MIN_SAMPLES = int(os.getenv("LLM_MIN_SAMPLES", "5"))  # before an option's latency is trusted
+LLM_MAX_ERROR_RATE = float(os.getenv("LLM_MAX_ERROR_RATE", "0.5"))
+LLM_EXPLORE = float(os.getenv("LLM_EXPLORE", "0.05"))  # share of calls sent to the runner-up
+
+DEFAULT_ROUTES = {
+    "gpt-4o": ["openai:gpt-4o", "mistral:mistral-large-latest"],
+    "gpt-4o-mini": ["openai:gpt-4o-mini", "mistral:open-mistral-nemo"],
+}
+
+Option = Tuple[str, str]  # (provider name, provider model)
+
+# Failures that say the provider itself is in trouble and count towards its breaker.
+BREAKER_FAILURES = ("server", "timeout", "connection")
+
+
+def parse_option(value) -> Option:
+    if isinstance(value, (tuple, list)):
+        return tuple(value)
+    provider, _, model = value.partition(":")
+    return (provider, model) if model else ("openai", provider)
+
+
+def load_routes(routes=None) -> Dict[str, List[Option]]:
+    """Routes from a dict, a JSON string or LLM_ROUTES, falling back to DEFAULT_ROUTES."""
+    routes = LLM_ROUTES if routes is None else routes
+    if isinstance(routes, str):
+        try:
+            routes = json.loads(routes)
+        except ValueError as err:
+            logging.error("Invalid LLM_ROUTES, using defaults: %s", err)
+            routes = None
+    return {name: [parse_option(option) for option in options] for name, options in (routes or DEFAULT_ROUTES).items()}
+
+
+class OptionStats:
+    """Recent latencies and outcomes of one provider:model option."""
+
+    def __init__(self, window: int = LLM_STATS_WINDOW):
+        self.latencies = deque(maxlen=window)  # seconds, successful calls only
+        self.outcomes = deque(maxlen=window)  # True for success
+        self.calls = 0
+        self.errors = 0
+        self.hedges = 0  # calls on this option that were hedged
+        self.hedge_wins = 0  # of those, the ones the backup answered first
+        self.in_flight = 0
+        self.breaker = CircuitBreaker()
+
+    def record(self, latency: float, ok: bool):
+        self.calls += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        return (len(self.outcomes) - sum(self.outcomes)) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return len(self.outcomes) < LLM_MIN_SAMPLES or self.error_rate <= LLM_MAX_ERROR_RATE
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 3),
+            "p50_ms": _ms(self.percentile(0.5)),
+            "p95_ms": _ms(self.percentile(0.95)),
+            "p99_ms": _ms(self.percentile(0.99)),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "in_flight": self.in_flight,
+            "healthy": self.healthy,
+            "breaker": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+            "consecutive_failures": self.breaker.consecutive,
+        }
+
+
+def status_of(error: Optional[BaseException]) -> str:
+    """Metrics label for a call's outcome: "ok", the HTTP status, or the failure class."""
+    if error is None:
+        return "ok"
+    status = getattr(error, "status_code", None)
+    return str(status) if status is not None else classify(error) or "error"
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class Router:
+    """Send each call to the best option for its logical model."""
+
+    def __init__(
+        self,
+        providers: List[Provider],
+        routes=None,
+        hedge: bool = LLM_HEDGE,
+        hedge_min_delay: float = LLM_HEDGE_MIN_DELAY,
+        rng: Optional[random.Random] = None,
+        clock=time.perf_counter,
+    ):
+        self.providers = {provider.name: provider for provider in providers}
+        self.routes = load_routes(routes)
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self._rng = rng or random.Random()
+        self._clock = clock
+        self.stats: Dict[Option, OptionStats] = {}
+        self.budget = RetryBudget()
+
+    def options(self, model: str) -> List[Option]:
+        """Options for a logical model that have a registered provider."""
+        candidates = self.routes.get(model) or [parse_option(model)]
+        available = [option for option in candidates if option[0] in self.providers]
+        if not available:
+            raise ValueError(f"No provider available for model {model!r}")
+        return available
+
+    def _stats(self, option: Option) -> OptionStats:
+        if option not in self.stats:
+            self.stats[option] = OptionStats()
+        return self.stats[option]
+
+    def rank(self, model: str) -> List[Option]:
+        """Healthy before unhealthy; untried options first, then by median latency.
+
+        Options with an open breaker are left out; raises CircuitOpenError if none remain.
+        """
+        configured = self.options(model)
+        options = [option for option in configured if self._stats(option).breaker.available()]
+        if not options:
+            resilience_stats["fast_failures"] += 1
+            raise CircuitOpenError(model, min(self._stats(option).breaker.retry_in() for option in configured))
+
+        def key(item):
+            index, option = item
+            stats = self._stats(option)
+            sampled = len(stats.latencies) >= LLM_MIN_SAMPLES
+            return (not stats.healthy, sampled, stats.percentile(0.5) if sampled else 0.0, index)
+
+        ranked = [option for _, option in sorted(enumerate(options), key=key)]
+        # Keep measuring the runner-up so a recovered provider can win again.
+        if len(ranked) > 1 and self._stats(ranked[1]).healthy and self._rng.random() < LLM_EXPLORE:
+            ranked[0], ranked[1] = ranked[1], ranked[0]
+        return ranked
+
+    def _settle(self, option: Option, started: float, error: Optional[BaseException] = None):
+        """Record a finished call in the option's latency window and circuit breaker."""
+        stats = self._stats(option)
+        elapsed = self._clock() - started
+        stats.record(elapsed, error is None)
+        if metrics.METRICS_ENABLED:
+            metrics.llm_duration.observe(elapsed, provider=option[0], model=option[1], status=status_of(error))
+        if error is not None and classify(error) in BREAKER_FAILURES:
+            stats.breaker.record_failure()
+        else:
+            stats.breaker.record_success()  # the provider answered, even if it refused
+
+    def _retry_delay(self, error: BaseException, attempt: int, deadline: float) -> Optional[float]:
+        """Seconds to wait before retrying ``error``, or None if it should be raised."""
+        kind = classify(error)
+        if kind not in RETRYABLE:
+            return None
+        delay = backoff(attempt, retry_after(error), self._rng)
+        if attempt >= LLM_RETRIES or self._clock() + delay >= deadline:
+            resilience_stats["gave_up"] += 1
+            return None
+        if not self.budget.try_retry():
+            resilience_stats["retries_denied"] += 1
+            return None
+        resilience_stats["retries"] += 1
+        resilience_stats[f"retried_{kind}"] += 1
+        logging.info("Retrying LLM call after %s error in %.2fs: %s", kind, delay, error)
+        return delay
+
+    async def _call(self, option: Option, messages: List[dict], timeout: float, **kwargs):
+        stats = self._stats(option)
+        stats.in_flight += 1
+        stats.breaker.before_call()
+        started = self._clock()
+        try:
+            result = await self.providers[option[0]].complete(option[1], messages, timeout, **kwargs)
+        except asyncio.CancelledError:
+            stats.breaker.record_cancel()
+            raise  # a cancelled hedge is not the provider's fault
+        except Exception as err:
+            self._settle(option, started, err)
+            raise
+        finally:
+            stats.in_flight -= 1
+        self._settle(option, started)
+        return result
+
+    async def complete(self, model: str, messages: List[dict], timeout: float, **kwargs):
+        """Complete on the best option, retrying transient failures; ``timeout`` bounds all attempts."""
+        deadline = self._clock() + timeout
+        self.budget.record_call()
+        resilience_stats["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(model, messages, deadline - self._clock(), **kwargs)
+            except Exception as err:
+                delay = self._retry_delay(err, attempt, deadline)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1  # re-ranked, so a failing option loses to a healthy one
+
+    async def _attempt(self, model: str, messages: List[dict], timeout: float, **kwargs):
+        ranked = self.rank(model)
+        primary = ranked[0]
+        delay = self._stats(primary).percentile(LLM_HEDGE_QUANTILE)
+        if not self.hedge or len(ranked) < 2 or delay is None:
+            return await self._call(primary, messages, timeout, **kwargs)
+
+        first = asyncio.ensure_future(self._call(primary, messages, timeout, **kwargs))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=max(self.hedge_min_delay, delay))
+            if done:
+                return first.result()
+            backup = ranked[1]
+            self._stats(primary).hedges += 1
+            logging.info("Hedging %s call on %s:%s", model, backup[0], backup[1])
+            second = asyncio.ensure_future(self._call(backup, messages, timeout, **kwargs))
+            pending.add(second)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        # Counted on the hedged option, like hedges, so wins never exceed hedges
+                        self._stats(primary).hedge_wins += task is second
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # The loser, or both calls when our caller went away.
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, model: str, messages: List[dict], timeout: float, **kwargs):
+        """Stream from the best option; failures before the first delta are retried like complete()."""
+        deadline = self._clock() + timeout
+        self.budget.record_call()
+        resilience_stats["calls"] += 1
+        attempt = 0
+        while True:
+            option = self.rank(model)[0]
+            stats = self._stats(option)
+            stats.in_flight += 1
+            stats.breaker.before_call()
+            started = self._clock()
+            streamed = False
+            try:
+                remaining = deadline - self._clock()
+                async for text in self.providers[option[0]].stream(option[1], messages, remaining, **kwargs):
+                    streamed = True
+                    yield text
+            except Exception as err:
+                self._settle(option, started, err)
+                # Text already sent to the client cannot be taken back.
+                delay = None if streamed else self._retry_delay(err, attempt, deadline)
+                if delay is None:
+                    raise
+            except BaseException:
+                stats.breaker.record_cancel()  # the client went away mid-stream
+                raise
+            else:
+                self._settle(option, started)
+                return
+            finally:
+                stats.in_flight -= 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {f"{provider}:{model}": stats.snapshot() for (provider, model), stats in self.stats.items()}
+
+    async def close(self):
+        for provider in self.providers.values():
+            await provider.close()
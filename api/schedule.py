@@ -0,0 +1,434 @@
+# schedule.py
+#
+# Deterministic scheduling of itinerary days. The /itinerary prompt asks for
+# lunch and dinner every day, gaps of at most an hour, a plan that fits the
+# start/end time and places that are open when visited; this module checks
+# a generated itinerary against those rules, repairs small violations
+# (re-timing, trimming, dropping closed stops, adding a missing meal from the
+# unused choices) and can build a whole schedule from ordered day lists such
+# as the ones api.geo produces. Everything here is pure: no I/O, no LLM.
+
+import datetime
+import math
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from api.geo import address_book, coordinates, distance_matrix
+from api.hours import DAY_NAMES, format_time, parse_hours, parse_time
+from api.prompting import FIELD_ALIASES, first_field, shorten
+from api.ranking import MEAL_WINDOWS, category_of
+
+# Config
+SCHEDULE_REPAIR = os.getenv("SCHEDULE_REPAIR", "true").lower() == "true"
+SCHEDULE_FALLBACK = os.getenv("SCHEDULE_FALLBACK", "false").lower() == "true"  # plan locally if the LLM fails
+SCHEDULE_MAX_GAP = int(os.getenv("SCHEDULE_MAX_GAP", "60"))  # minutes between stops
+SCHEDULE_MIN_SLOT = int(os.getenv("SCHEDULE_MIN_SLOT", "30"))  # shortest visit worth keeping
+SCHEDULE_COMMUTE_MINUTES = int(os.getenv("SCHEDULE_COMMUTE_MINUTES", "15"))  # without coordinates
+SCHEDULE_SPEED_KMH = float(os.getenv("SCHEDULE_SPEED_KMH", "20"))
+SCHEDULE_REPAIR_ROUNDS = int(os.getenv("SCHEDULE_REPAIR_ROUNDS", "4"))
+SCHEDULE_DESCRIPTION_CHARS = int(os.getenv("SCHEDULE_DESCRIPTION_CHARS", "320"))
+
+DURATIONS = {"activity": 90, "lunch": 60, "dinner": 90}
+DAY_START = 9 * 60
+DAY_END = 22 * 60
+STEP = 5
+
+schedule_stats = {"checked": 0, "violations": 0, "repaired": 0, "meals_added": 0, "dropped": 0, "built": 0}
+
+
+def violation(day: int, slot: Optional[int], rule: str, detail: str) -> dict:
+    return {"day": day, "slot": slot, "rule": rule, "detail": detail}
+
+
+def weekday_of(day: dict) -> Optional[str]:
+    """Weekday name from the day's "YYYY-MM-DD" date, if it has one."""
+    try:
+        return DAY_NAMES[datetime.date.fromisoformat(str(day.get("dates") or "")[:10]).weekday()]
+    except ValueError:
+        return None
+
+
+def open_ranges(choice: dict, weekday: Optional[str]):
+    """Open ranges for the weekday; None when the hours are unknown.
+
+    Without a date, a place counts as open at any time it is open on some day.
+    """
+    return day_ranges(parse_hours(first_field(choice, FIELD_ALIASES["hours"])), weekday)
+
+
+def day_ranges(hours, weekday: Optional[str]):
+    """open_ranges() for hours already parsed by parse_hours()."""
+    if hours is None:
+        return None
+    if weekday is not None:
+        return hours.get(weekday)
+    return sorted(r for ranges in hours.values() for r in ranges)
+
+
+def _round_up(minutes: float) -> int:
+    return int(math.ceil(minutes / STEP) * STEP)
+
+
+def _is_open(ranges, start: int, end: int) -> bool:
+    return ranges is None or any(o <= start and end <= c for o, c in ranges)
+
+
+class Scheduler:
+    """Checks, repairs and builds itinerary days for one trip request.
+
+    ``choices`` are the request's candidates; ``start_time`` / ``end_time``
+    bound every day when given. The scheduler remembers which choices are
+    already used so a repaired day never borrows a place from another day.
+    """
+
+    def __init__(
+        self,
+        choices: List[dict],
+        start_time: Optional[str] = None,
+        end_time: Optional[str] = None,
+        max_gap: int = SCHEDULE_MAX_GAP,
+    ):
+        self.choices = choices
+        self.start = parse_time(start_time)
+        self.end = parse_time(end_time)
+        if self.start is not None and self.end is not None and self.end <= self.start:
+            self.end += 24 * 60  # e.g. 06:00 PM to 01:00 AM
+        self.max_gap = max_gap
+        self.by_id: Dict[str, dict] = {}
+        self.by_title: Dict[str, dict] = {}
+        for choice in choices:
+            if choice.get("data_id") is not None:
+                self.by_id[str(choice["data_id"])] = choice
+            title = first_field(choice, FIELD_ALIASES["title"])
+            if isinstance(title, str):
+                self.by_title.setdefault(title.casefold(), choice)
+        self.used = set()
+        self.addresses = address_book(choices)
+        self._commute_cache: Dict[tuple, int] = {}
+        self._hours_cache: Dict[int, Optional[dict]] = {}
+        self._by_kind: Optional[Dict[str, List[dict]]] = None
+
+    # Lookups
+
+    def choice_for(self, slot: dict) -> Optional[dict]:
+        choice = self.by_id.get(str(slot.get("data_id")))
+        if choice is None and isinstance(slot.get("location"), str):
+            choice = self.by_title.get(slot["location"].casefold())
+        return choice
+
+    def commute(self, a: Optional[dict], b: Optional[dict]) -> int:
+        """Minutes to get from one choice to the next, rounded up to 5."""
+        if a is None or b is None:
+            return SCHEDULE_COMMUTE_MINUTES
+        key = (id(a), id(b))
+        if key not in self._commute_cache:
+            pa, pb = coordinates(a, self.addresses), coordinates(b, self.addresses)
+            if pa is None or pb is None:
+                minutes = SCHEDULE_COMMUTE_MINUTES
+            else:
+                km = float(distance_matrix(np.array([pa]), np.array([pb]))[0, 0])
+                minutes = _round_up(5 + km / SCHEDULE_SPEED_KMH * 60)
+            self._commute_cache[key] = minutes
+        return self._commute_cache[key]
+
+    def open_ranges(self, choice: dict, weekday: Optional[str]):
+        """open_ranges(), parsing each choice's hours once."""
+        if id(choice) not in self._hours_cache:
+            self._hours_cache[id(choice)] = parse_hours(first_field(choice, FIELD_ALIASES["hours"]))
+        return day_ranges(self._hours_cache[id(choice)], weekday)
+
+    def of_kind(self, kind: str) -> List[dict]:
+        """The choices of one category ("activity", "lunch", "dinner")."""
+        if self._by_kind is None:
+            self._by_kind = {}
+            for choice in self.choices:
+                self._by_kind.setdefault(category_of(choice), []).append(choice)
+        return self._by_kind.get(kind, [])
+
+    def _measure_commutes(self, a: dict, options: List[dict]):
+        """Fill the commute cache from ``a`` to each option with one distance matrix."""
+        pa = coordinates(a, self.addresses)
+        if pa is None:
+            return
+        todo = [
+            (c, coordinates(c, self.addresses)) for c in options if (id(a), id(c)) not in self._commute_cache
+        ]
+        todo = [(c, pc) for c, pc in todo if pc is not None]
+        if not todo:
+            return
+        km = distance_matrix(np.array([pa]), np.array([pc for _, pc in todo]))[0]
+        for (c, _), distance in zip(todo, km):
+            self._commute_cache[(id(a), id(c))] = _round_up(5 + float(distance) / SCHEDULE_SPEED_KMH * 60)
+
+    def window(self):
+        return (
+            DAY_START if self.start is None else self.start,
+            DAY_END if self.end is None else self.end,
+        )
+
+    # Validation
+
+    def check_day(self, day: dict, number: int) -> List[dict]:
+        """Rule violations for one day in the public itineraryItems shape."""
+        problems = []
+        weekday = weekday_of(day)
+        kinds = set()
+        previous_end = None
+        for index, slot in enumerate(day.get("slots") or []):
+            time = slot.get("time") if isinstance(slot.get("time"), dict) else {}
+            start, end = parse_time(time.get("startTime")), parse_time(time.get("endTime"))
+            choice = self.choice_for(slot)
+            if choice is None:
+                problems.append(violation(number, index, "unknown_place", str(slot.get("data_id"))))
+            else:
+                kinds.add(category_of(choice))
+            if start is None or end is None:
+                problems.append(violation(number, index, "bad_time", f"{time}"))
+                previous_end = None
+                continue
+            if end < start:
+                end += 24 * 60
+            if end == start:
+                problems.append(violation(number, index, "bad_time", f"{time}"))
+            if self.start is not None and start < self.start:
+                problems.append(violation(number, index, "before_start", format_time(start)))
+            if self.end is not None and end > self.end:
+                problems.append(violation(number, index, "after_end", format_time(end)))
+            if previous_end is not None:
+                if start < previous_end:
+                    problems.append(violation(number, index, "overlap", format_time(start)))
+                elif start - previous_end > self.max_gap:
+                    problems.append(violation(number, index, "gap", f"{start - previous_end} min"))
+            if choice is not None and not _is_open(self.open_ranges(choice, weekday), start, end):
+                problems.append(violation(number, index, "closed", format_time(start)))
+            previous_end = end
+        for meal in ("lunch", "dinner"):
+            if meal not in kinds:
+                problems.append(violation(number, None, f"missing_{meal}", ""))
+        return problems
+
+    def check(self, itinerary: dict) -> List[dict]:
+        schedule_stats["checked"] += 1
+        problems = []
+        for number, day in enumerate(itinerary.get("itineraryItems") or [], start=1):
+            problems.extend(self.check_day(day, day.get("day") or number))
+        schedule_stats["violations"] += len(problems)
+        return problems
+
+    # Scheduling
+
+    def _placement(self, entry: dict, previous: Optional[dict], weekday: Optional[str]):
+        """Earliest (start, end) for the entry after ``previous``; None if it no longer fits today."""
+        day_start, day_end = self.window()
+        choice = entry["choice"]
+        kind = category_of(choice)
+        clock = previous["end"] if previous else day_start
+        earliest = clock + (self.commute(previous["choice"], choice) if previous else 0)
+        start = earliest
+        proposed = entry.get("start")
+        if proposed is not None:
+            start = max(start, min(proposed, clock + self.max_gap) if previous else proposed)
+        if kind in MEAL_WINDOWS:
+            start = max(start, MEAL_WINDOWS[kind][0])
+        duration = entry["duration"]
+        ranges = self.open_ranges(choice, weekday)
+        if ranges is None:
+            ranges = [(start, start + duration)]
+        for opening, closing in sorted(ranges):
+            begin = max(start, opening)
+            end = min(closing, begin + duration, day_end)
+            if end - begin >= SCHEDULE_MIN_SLOT:
+                return begin, end, earliest
+        return None
+
+    def _timeline(self, entries: List[dict], weekday: Optional[str]) -> List[dict]:
+        """Assign times to ordered entries ({"choice", "duration", "start", "slot"}).
+
+        A stop starts after the previous one plus the commute, or at its own
+        proposed start when that leaves no gap over max_gap; meals wait for
+        their meal window and places for their opening time. The order is
+        kept unless the next stop would leave a long wait, in which case the
+        first later stop that can go now is moved up. A remaining gap is
+        closed by staying longer at the previous stop, up to twice its usual
+        length. Stops that no longer fit (closed for the rest of the day, or
+        past the end time) are dropped.
+        """
+        placed = []
+        remaining = list(entries)
+        while remaining:
+            previous = placed[-1] if placed else None
+            options = []
+            for entry in remaining:
+                placement = self._placement(entry, previous, weekday)
+                if placement is None:
+                    schedule_stats["dropped"] += 1
+                    self.used.discard(id(entry["choice"]))
+                else:
+                    options.append((entry, placement))
+            if not options:
+                break
+            clock = previous["end"] if previous else None
+            entry, (start, end, earliest) = next(
+                (option for option in options if clock is None or option[1][0] - clock <= self.max_gap),
+                min(options, key=lambda option: option[1][0]),
+            )
+            remaining = [e for e, _ in options if e is not entry]
+            if previous is not None and start - previous["end"] > self.max_gap:
+                # Stay longer at the previous stop instead of leaving a hole,
+                # as long as it is still open.
+                kind = category_of(previous["choice"])
+                longest = previous["start"] + 2 * DURATIONS[kind]
+                stretched = min(previous["end"] + (start - earliest), max(previous["end"], longest))
+                ranges = self.open_ranges(previous["choice"], weekday)
+                if _is_open(ranges, previous["start"], stretched):
+                    previous["end"] = stretched
+            placed.append({"choice": entry["choice"], "start": start, "end": end, "slot": entry.get("slot")})
+        return placed
+
+    def _spare_meal(self, meal: str, near: Optional[dict], weekday: Optional[str]) -> Optional[dict]:
+        window = MEAL_WINDOWS[meal]
+        options = [
+            c for c in self.of_kind(meal)
+            if id(c) not in self.used
+            and _is_open(self.open_ranges(c, weekday), window[0], window[0] + DURATIONS[meal])
+        ]
+        if not options:
+            return None
+        if near is None:
+            return options[0]
+        self._measure_commutes(near, options)
+        return min(options, key=lambda c: self.commute(near, c))
+
+    def _add_missing_meals(self, entries: List[dict], weekday: Optional[str]) -> int:
+        added = 0
+        for meal in ("lunch", "dinner"):
+            if any(category_of(e["choice"]) == meal for e in entries):
+                continue
+            # Lunch sits mid-day, dinner last; pick a spare place near its neighbour.
+            position = len(entries) // 2 if meal == "lunch" else len(entries)
+            if meal == "lunch":
+                dinners = [i for i, e in enumerate(entries) if category_of(e["choice"]) == "dinner"]
+                position = min([position] + dinners)
+            near = entries[position - 1]["choice"] if position > 0 else None
+            choice = self._spare_meal(meal, near, weekday)
+            if choice is None:
+                continue
+            self.used.add(id(choice))
+            entries.insert(position, {"choice": choice, "duration": DURATIONS[meal], "start": None, "slot": None})
+            added += 1
+        return added
+
+    def _slot(self, placed: dict, language: str) -> dict:
+        time = {"startTime": format_time(placed["start"]), "endTime": format_time(placed["end"])}
+        if placed["slot"]:
+            return {**placed["slot"], "time": time}
+        choice = placed["choice"]
+        return {
+            "data_id": choice.get("data_id"),
+            "location": first_field(choice, FIELD_ALIASES["title"]) or "",
+            "time": time,
+            "description": shorten(
+                first_field(choice, FIELD_ALIASES["description"]) or "", SCHEDULE_DESCRIPTION_CHARS
+            ),
+            "language": language,
+        }
+
+    def _retime(self, slots: List[dict], weekday: Optional[str]) -> List[dict]:
+        entries = []
+        unknown = []
+        for slot in slots:
+            choice = self.choice_for(slot)
+            if choice is None:
+                unknown.append(slot)  # nothing to check it against; keep as is
+                continue
+            time = slot.get("time") if isinstance(slot.get("time"), dict) else {}
+            start, end = parse_time(time.get("startTime")), parse_time(time.get("endTime"))
+            duration = DURATIONS[category_of(choice)]
+            if start is not None and end is not None and end > start:
+                duration = end - start
+            entries.append({"choice": choice, "duration": duration, "slot": slot, "start": start})
+        # Keep the model's order, but by time when it gave usable times.
+        entries.sort(key=lambda e: (e["start"] is None, e["start"] or 0))
+        schedule_stats["meals_added"] += self._add_missing_meals(entries, weekday)
+        language = next((s.get("language") for s in slots if s.get("language")), "")
+        return [self._slot(p, language) for p in self._timeline(entries, weekday)] + unknown
+
+    def repair_day(self, day: dict, number: int = 1) -> List[dict]:
+        """Fix the day in place; returns the violations that were found before repair.
+
+        Re-timing can drop a meal that then needs replacing, so this runs a
+        few rounds until the day stops changing or has nothing left to fix.
+        """
+        number = day.get("day") or number
+        problems = self.check_day(day, number)
+        for slot in day.get("slots") or []:
+            choice = self.choice_for(slot)
+            if choice is not None:
+                self.used.add(id(choice))
+        if not problems:
+            return problems
+        weekday = weekday_of(day)
+        for _ in range(SCHEDULE_REPAIR_ROUNDS):
+            slots = self._retime(day.get("slots") or [], weekday)
+            if slots == day.get("slots"):
+                break
+            day["slots"] = slots
+            if not self.check_day(day, number):
+                break
+        schedule_stats["repaired"] += 1
+        return problems
+
+    def repair(self, itinerary: dict) -> List[dict]:
+        """Repair every day of an itinerary in place; returns the violations found."""
+        schedule_stats["checked"] += 1
+        days = itinerary.get("itineraryItems") or []
+        # Register every used place first so meals are never borrowed from a later day.
+        for day in days:
+            for slot in day.get("slots") or []:
+                choice = self.choice_for(slot)
+                if choice is not None:
+                    self.used.add(id(choice))
+        problems = []
+        for number, day in enumerate(days, start=1):
+            problems.extend(self.repair_day(day, number))
+        # A place dropped from one day can fill a missing meal on another.
+        for _ in range(SCHEDULE_REPAIR_ROUNDS):
+            before = [day.get("slots") for day in days]
+            for number, day in enumerate(days, start=1):
+                self.repair_day(day, number)
+            if [day.get("slots") for day in days] == before:
+                break
+        schedule_stats["violations"] += len(problems)
+        return problems
+
+    def build(
+        self,
+        ordered_days: List[List[dict]],
+        city: str = "",
+        language: str = "",
+        dates: Optional[List[str]] = None,
+    ) -> dict:
+        """Schedule ordered per-day choice lists into a full itinerary without the LLM."""
+        schedule_stats["built"] += 1
+        for plan in ordered_days:
+            self.used.update(id(c) for c in plan)
+        items = []
+        for number, plan in enumerate(ordered_days, start=1):
+            day = {
+                "day": number,
+                "dates": dates[number - 1] if dates and number <= len(dates) else "",
+                "city": city,
+                "image": "",
+                "slots": [],
+            }
+            weekday = weekday_of(day)
+            entries = [
+                {"choice": c, "duration": DURATIONS[category_of(c)], "start": None, "slot": None}
+                for c in plan
+            ]
+            self._add_missing_meals(entries, weekday)
+            day["slots"] = [self._slot(p, language) for p in self._timeline(entries, weekday)]
+            items.append(day)
+        return {"itineraryItems": items}
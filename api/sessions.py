@@ -0,0 +1,426 @@
+# sessions.py
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import List, Optional
+
+# Config
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))  # seconds
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", "65536"))
+SESSION_MAX_TOKENS = int(os.getenv("SESSION_MAX_TOKENS", "8000"))
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory" or "sqlite"
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "/tmp/pocket-travel-sessions.db")
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1024"))
+SESSION_WRITE_BATCH = int(os.getenv("SESSION_WRITE_BATCH", "32"))
+SESSION_WRITE_DELAY = float(os.getenv("SESSION_WRITE_DELAY", "0.05"))  # seconds
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English; good enough for budgeting.
+    return max(1, len(text) // 4)
+
+
+def history_size(history: List[dict]):
+    size_bytes = 0
+    tokens = 0
+    for message in history:
+        content = message.get("content") or ""
+        size_bytes += len(content.encode("utf-8"))
+        tokens += estimate_tokens(content)
+    return size_bytes, tokens
+
+
+def trim_history(history: List[dict], max_bytes: int, max_tokens: int) -> List[dict]:
+    """Drop the oldest non-system turns until the history fits the per-session caps."""
+    size_bytes, tokens = history_size(history)
+    if size_bytes <= max_bytes and tokens <= max_tokens:
+        return history
+    system = [m for m in history if m.get("role") == "system"]
+    turns = [m for m in history if m.get("role") != "system"]
+    # Always keep the latest turn so the conversation can continue.
+    while len(turns) > 1 and (size_bytes > max_bytes or tokens > max_tokens):
+        dropped = turns.pop(0)
+        content = dropped.get("content") or ""
+        size_bytes -= len(content.encode("utf-8"))
+        tokens -= estimate_tokens(content)
+    return system + turns
+
+
+class SessionStore:
+    """Conversation histories keyed by session id, with LRU and idle-TTL eviction.
+
+    Supports the dict operations the endpoints use (``get``, item assignment,
+    ``in``, ``len``) so it can replace a plain module-level dict.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        max_bytes: int = SESSION_MAX_BYTES,
+        max_tokens: int = SESSION_MAX_TOKENS,
+        clock=time.time,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # id -> (last_seen, history)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.trims = 0
+
+    def get(self, session_id: str, default: Optional[List[dict]] = None):
+        now = self._clock()
+        with self._lock:
+            entry = self._data.get(session_id)
+            if entry is not None and now - entry[0] > self.idle_ttl:
+                del self._data[session_id]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data[session_id] = (now, entry[1])
+            self._data.move_to_end(session_id)
+            return entry[1]
+
+    async def get_async(self, session_id: str, default: Optional[List[dict]] = None):
+        """``get`` for the event loop; the in-memory lookup never blocks."""
+        return self.get(session_id, default)
+
+    def __getitem__(self, session_id: str) -> List[dict]:
+        history = self.get(session_id)
+        if history is None:
+            raise KeyError(session_id)
+        return history
+
+    def __setitem__(self, session_id: str, history: List[dict]):
+        trimmed = trim_history(history, self.max_bytes, self.max_tokens)
+        now = self._clock()
+        with self._lock:
+            if trimmed is not history:
+                self.trims += 1
+            self._data[session_id] = (now, trimmed)
+            self._data.move_to_end(session_id)
+            self._evict(now)
+
+    def __delitem__(self, session_id: str):
+        with self._lock:
+            del self._data[session_id]
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def pop(self, session_id: str, default=None):
+        with self._lock:
+            entry = self._data.pop(session_id, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _evict(self, now: float):
+        # Oldest entries sit at the front, so expired sessions are found first.
+        while self._data:
+            session_id, (last_seen, _) = next(iter(self._data.items()))
+            if now - last_seen > self.idle_ttl:
+                self._data.popitem(last=False)
+                self.expirations += 1
+            elif len(self._data) > self.max_sessions:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            else:
+                break
+
+    def close(self):
+        pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "trims": self.trims,
+        }
+
+
+def encode_history(history: List[dict]) -> bytes:
+    return zlib.compress(
+        json.dumps(history, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    )
+
+
+def decode_history(blob: bytes) -> List[dict]:
+    return json.loads(zlib.decompress(blob))
+
+
+class SqliteSessionStore:
+    """Session store shared by every worker on a host through one SQLite file.
+
+    The database runs in WAL mode so readers never block the writer. Writes are
+    buffered and flushed in batches by a background thread; reads go through a
+    small per-process cache that is validated against the row's version, so
+    an unchanged history is never decompressed twice.
+
+    Item assignment only touches memory. Reads may query SQLite, so handlers
+    use ``get_async``, which runs them in a worker thread. ``_lock`` guards
+    the in-memory state and is never held across a query; ``_db_lock``
+    serializes use of the connection and is taken before ``_lock``.
+    """
+
+    def __init__(
+        self,
+        path: str = SESSION_DB_PATH,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        max_bytes: int = SESSION_MAX_BYTES,
+        max_tokens: int = SESSION_MAX_TOKENS,
+        cache_size: int = SESSION_CACHE_SIZE,
+        write_batch: int = SESSION_WRITE_BATCH,
+        write_delay: float = SESSION_WRITE_DELAY,
+        clock=time.time,
+    ):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.cache_size = cache_size
+        self.write_batch = write_batch
+        self.write_delay = write_delay
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()  # id -> (version, history)
+        self._pending = {}  # id -> (last_seen, version, history)
+        self._size = 0  # rows as of the last flush, for stats()
+        self.hits = 0
+        self.misses = 0
+        self.cache_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.trims = 0
+        self.flushes = 0
+
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY,"
+            " last_seen REAL NOT NULL,"
+            " version TEXT NOT NULL,"
+            " data BLOB NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)"
+        )
+        self._conn.commit()
+        self._size = self._count()
+
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def get(self, session_id: str, default: Optional[List[dict]] = None):
+        now = self._clock()
+        with self._lock:
+            pending = self._pending.get(session_id)
+            if pending is not None:
+                self.hits += 1
+                return list(pending[2])
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT last_seen, version FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None or now - row[0] > self.idle_ttl:
+                with self._lock:
+                    self.misses += 1
+                    self._cache.pop(session_id, None)
+                return default
+            version = row[1]
+            with self._lock:
+                cached = self._cache.get(session_id)
+            if cached is not None and cached[0] == version:
+                history = cached[1]
+            else:
+                blob = self._conn.execute(
+                    "SELECT data FROM sessions WHERE id = ?", (session_id,)
+                ).fetchone()
+                if blob is None:
+                    with self._lock:
+                        self.misses += 1
+                    return default
+                history = decode_history(blob[0])
+        with self._lock:
+            if cached is not None and cached[0] == version:
+                self.cache_hits += 1
+            self._remember(session_id, version, history)
+            self.hits += 1
+        return list(history)
+
+    async def get_async(self, session_id: str, default: Optional[List[dict]] = None):
+        """``get`` in a worker thread, so a query waiting on a flush never stalls the event loop."""
+        return await asyncio.to_thread(self.get, session_id, default)
+
+    def __getitem__(self, session_id: str) -> List[dict]:
+        history = self.get(session_id)
+        if history is None:
+            raise KeyError(session_id)
+        return history
+
+    def __setitem__(self, session_id: str, history: List[dict]):
+        trimmed = trim_history(history, self.max_bytes, self.max_tokens)
+        version = uuid.uuid4().hex
+        with self._lock:
+            if trimmed is not history:
+                self.trims += 1
+            self._pending[session_id] = (self._clock(), version, list(trimmed))
+            self._remember(session_id, version, list(trimmed))
+            should_flush = len(self._pending) >= self.write_batch
+        if should_flush:
+            self._wake.set()  # the flusher writes; the caller never waits on the disk
+
+    def __delitem__(self, session_id: str):
+        self.pop(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        """Exact row count; flushes first. stats() reports the count from the last flush instead."""
+        self.flush()
+        with self._db_lock:
+            self._size = self._count()
+            return self._size
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def pop(self, session_id: str, default=None):
+        history = self.get(session_id)
+        with self._db_lock:
+            with self._lock:
+                self._pending.pop(session_id, None)
+                self._cache.pop(session_id, None)
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+        return default if history is None else history
+
+    def clear(self):
+        with self._db_lock:
+            with self._lock:
+                self._pending.clear()
+                self._cache.clear()
+            self._conn.execute("DELETE FROM sessions")
+            self._conn.commit()
+            self._size = 0
+
+    def _remember(self, session_id: str, version: str, history: List[dict]):
+        self._cache[session_id] = (version, history)
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def flush(self):
+        # Holding _db_lock from the swap to the commit means a reader that
+        # misses _pending always waits for the rows it would have found there.
+        with self._db_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                pending, self._pending = self._pending, {}
+            rows = [
+                (session_id, last_seen, version, encode_history(history))
+                for session_id, (last_seen, version, history) in pending.items()
+            ]
+            try:
+                self._conn.executemany(
+                    "INSERT INTO sessions (id, last_seen, version, data) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(id) DO UPDATE SET last_seen = excluded.last_seen,"
+                    " version = excluded.version, data = excluded.data",
+                    rows,
+                )
+                self._evict(self._clock())
+                self._conn.commit()
+                self._size = self._count()
+                self.flushes += 1
+            except sqlite3.Error as db_err:
+                self._conn.rollback()
+                logging.error("Session flush failed: %s", db_err)
+
+    def _evict(self, now: float):
+        cursor = self._conn.execute(
+            "DELETE FROM sessions WHERE last_seen < ?", (now - self.idle_ttl,)
+        )
+        self.expirations += max(cursor.rowcount, 0)
+        cursor = self._conn.execute(
+            "DELETE FROM sessions WHERE id IN ("
+            " SELECT id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,),
+        )
+        self.evictions += max(cursor.rowcount, 0)
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.write_delay)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "size": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "cache_hits": self.cache_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "trims": self.trims,
+            "flushes": self.flushes,
+        }
+
+
+def create_session_store(backend: str = SESSION_BACKEND):
+    if backend == "memory":
+        return SessionStore()
+    if backend == "sqlite":
+        return SqliteSessionStore()
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
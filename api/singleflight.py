@@ -0,0 +1,64 @@
+# singleflight.py
+#
+# In-process coalescing of identical in-flight work. When the frontend
+# double-submits, or several users ask for the same popular trip at once,
+# the first request runs the upstream call and every identical request that
+# arrives while it is running waits for and shares that result (or error).
+
+import asyncio
+import functools
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Run at most one ``factory()`` per key at a time and share its outcome.
+
+    The work runs in its own task, so a waiter that is cancelled (e.g. its
+    client went away) does not cancel it for the others; only when every
+    waiter is gone is the shared task cancelled too.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self.stats = {"calls": 0, "coalesced": 0, "errors": 0, "cancelled": 0}
+
+    def _forget(self, key: str, call: _Call, task: asyncio.Task):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if task.cancelled():
+            self.stats["cancelled"] += 1
+        elif task.exception() is not None:
+            self.stats["errors"] += 1
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return ``(result, shared)``; ``shared`` is True when another request did the work."""
+        call = self._calls.get(key)
+        shared = call is not None
+        if shared:
+            self.stats["coalesced"] += 1
+            logging.info("Coalesced %s request onto an in-flight call", self.name)
+        else:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(functools.partial(self._forget, key, call))
+            self.stats["calls"] += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def __len__(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,76 @@
+# streaming.py
+
+import json
+import logging
+from typing import List, Optional, Tuple
+
+from api.extract import JsonExtractor
+
+
+def sse(event: str, payload) -> str:
+    """Format one Server-Sent Event."""
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def validate_itinerary(info) -> bool:
+    if not isinstance(info, dict) or not isinstance(info.get("itineraryItems"), list):
+        return False
+    for day in info["itineraryItems"]:
+        if not isinstance(day, dict) or not isinstance(day.get("slots"), list):
+            return False
+        if not all(isinstance(slot, dict) for slot in day["slots"]):
+            return False
+    return True
+
+
+class ItineraryStreamParser:
+    """Incrementally scan a streamed itinerary reply and surface finished pieces.
+
+    ``feed`` takes the next chunk of model output and returns the events that
+    became complete with it: ``("day", {...})`` for every finished element of
+    ``itineraryItems`` and, when ``include_slots`` is set, ``("slot", {...})``
+    for every finished element of a day's ``slots``. ``day_key`` names the
+    top-level array holding the days ("days" for the minimal output schema).
+    """
+
+    def __init__(self, include_slots: bool = False, day_key: str = "itineraryItems"):
+        self.include_slots = include_slots
+        self.day_parents = (("{", None), ("[", day_key))
+        self.days = 0
+        self._extractor = JsonExtractor(watch=self._watch)
+
+    @property
+    def text(self) -> str:
+        return self._extractor.text
+
+    @property
+    def complete(self) -> bool:
+        return self._extractor.complete
+
+    @property
+    def truncated(self) -> bool:
+        """Whether the stream ended before the top-level object closed."""
+        return self._extractor.truncated
+
+    def _watch(self, parents) -> bool:
+        if parents == self.day_parents:
+            return True
+        return self.include_slots and parents[-1] == ("[", "slots")
+
+    def feed(self, chunk: str) -> List[Tuple[str, dict]]:
+        events = []
+        for parents, payload in self._extractor.feed(chunk):
+            if parents == self.day_parents:
+                self.days += 1
+                events.append(("day", payload))
+            else:
+                events.append(("slot", {"day_index": self.days + 1, "slot": payload}))
+        return events
+
+    def result(self) -> Optional[dict]:
+        """Parse the whole top-level object once the stream has finished."""
+        value = self._extractor.finish()
+        if self._extractor.error:
+            logging.error("JSON decode error: %s", self._extractor.error)
+        return value
@@ -0,0 +1,186 @@
+# tiers.py
+#
+# Detail levels for /itinerary. "full" is the regular plan: as many slots as
+# the day needs and ~50-word descriptions. "slim" and "mini" bring back the
+# short plans of the old /itinerary-slim and /itinerary-mini handlers (a few
+# slots a day, ~10-word descriptions) on a faster model, with fewer
+# candidates in the prompt and a cap on output tokens, for mobile clients
+# and previews where a quick answer beats a thorough one. All tiers share
+# one pipeline; a tier only changes the model, the prompt limits and how
+# much is sent and returned.
+
+import logging
+import os
+from typing import Dict, List, Optional
+
+from api.ranking import category_of
+
+# Config
+ITINERARY_DETAIL = os.getenv("ITINERARY_DETAIL", "full")  # tier used when a request names none
+ITINERARY_MODEL_FULL = os.getenv("ITINERARY_MODEL_FULL", "gpt-4o")
+ITINERARY_MODEL_SLIM = os.getenv("ITINERARY_MODEL_SLIM", "gpt-4o-mini")
+ITINERARY_MODEL_MINI = os.getenv("ITINERARY_MODEL_MINI", "gpt-4o-mini")
+ITINERARY_MAX_TOKENS_HEADROOM = float(os.getenv("ITINERARY_MAX_TOKENS_HEADROOM", "2"))  # times the expected output
+
+# Output size of one planned day, for sizing max_tokens. Deliberately generous:
+# a cut-off reply is a failed request, a few unused tokens cost nothing.
+TOKENS_PER_WORD = 3  # CJK and other non-Latin scripts take several tokens a word
+SLOT_TOKENS = 80  # id, title, times, language and the JSON around one slot
+DAY_TOKENS = 60  # day number, date, city, image and the JSON around one day
+
+FULL_DESCRIPTION_LINE = "- Limit each title's description to around 50 words."
+FULL_NOTE_LINE = "- The note is optional: at most 12 words, in the detected language."
+MEALS_LINE = "- Ensure that each day includes lunch and dinner activities."
+
+
+class Tier:
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        max_slots: Optional[int] = None,  # per day, None for no limit
+        description_words: int = 50,  # model-written descriptions (full output)
+        note_words: int = 12,  # model-written notes (minimal output), 0 for none
+        activities_per_day: Optional[int] = None,  # candidate quota, None for the ranking default
+        description_chars: Optional[int] = None,  # server-filled descriptions, None for the default
+        cap_output: bool = False,  # set max_tokens from the slot and length limits
+    ):
+        self.name = name
+        self.model = model
+        self.max_slots = max_slots
+        self.description_words = description_words
+        self.note_words = note_words
+        self.activities_per_day = activities_per_day
+        self.description_chars = description_chars
+        self.max_tokens_per_day = self.output_cap() if cap_output else None
+        self._messages: Dict[str, dict] = {}
+
+    def system_message(self, base: dict) -> dict:
+        """``base`` with this tier's slot and length limits in place of the full-detail ones."""
+        content = base["content"]
+        if content not in self._messages:
+            limited = content.replace(
+                FULL_DESCRIPTION_LINE,
+                f"- Limit each title's description to around {self.description_words} words.",
+            ).replace(
+                FULL_NOTE_LINE,
+                f"- The note is optional: at most {self.note_words} words, in the detected language."
+                if self.note_words else "- Leave out the note: each slot is just [id, start, end].",
+            )
+            if self.max_slots:
+                limited = limited.replace(
+                    MEALS_LINE,
+                    f"{MEALS_LINE}\n            - Limit the number of slots of each day to {self.max_slots}.",
+                )
+            self._messages[content] = {**base, "content": limited}
+        return self._messages[content]
+
+    def output_cap(self) -> Optional[int]:
+        """max_tokens for one day: the longest day the prompt allows, times the headroom.
+
+        None without a slot limit, as the day's length is then unbounded.
+        """
+        if not self.max_slots:
+            return None
+        words = max(self.description_words, self.note_words)
+        day = DAY_TOKENS + self.max_slots * (SLOT_TOKENS + words * TOKENS_PER_WORD)
+        return int(day * ITINERARY_MAX_TOKENS_HEADROOM)
+
+    def completion_options(self, days: int) -> dict:
+        """Extra chat-completion arguments for a plan of ``days`` days."""
+        if self.max_tokens_per_day is None:
+            return {}
+        return {"max_tokens": self.max_tokens_per_day * max(1, days)}
+
+    def limit_day(self, day: dict, choices: Dict[str, dict]) -> int:
+        """Drop slots past ``max_slots``, one lunch and one dinner first, then activities.
+
+        Returns the number of slots dropped.
+        """
+        slots = day.get("slots")
+        if not self.max_slots or not isinstance(slots, list) or len(slots) <= self.max_slots:
+            return 0
+        meals, activities, extra = [], [], []
+        for index, slot in enumerate(slots):
+            choice = choices.get(slot.get("data_id")) if isinstance(slot, dict) else None
+            category = category_of(choice) if choice else "activity"
+            if category == "activity":
+                activities.append(index)
+            elif any(category_of(choices.get(slots[i].get("data_id"), {})) == category for i in meals):
+                extra.append(index)
+            else:
+                meals.append(index)
+        keep = set((meals + activities + extra)[: self.max_slots])
+        day["slots"] = [slot for index, slot in enumerate(slots) if index in keep]
+        return len(slots) - len(keep)
+
+    def limit(self, info: dict, choices: List[dict]) -> int:
+        """Apply ``limit_day`` to every day of an itinerary; returns the slots dropped."""
+        if not self.max_slots:
+            return 0
+        by_id = {choice.get("data_id"): choice for choice in choices if isinstance(choice, dict)}
+        return sum(
+            self.limit_day(day, by_id) for day in info.get("itineraryItems") or [] if isinstance(day, dict)
+        )
+
+
+TIERS = {
+    tier.name: tier
+    for tier in (
+        Tier("full", ITINERARY_MODEL_FULL),
+        Tier(
+            "slim", ITINERARY_MODEL_SLIM, max_slots=4, description_words=20, note_words=8,
+            activities_per_day=2, description_chars=160, cap_output=True,
+        ),
+        Tier(
+            "mini", ITINERARY_MODEL_MINI, max_slots=3, description_words=10, note_words=0,
+            activities_per_day=1, description_chars=80, cap_output=True,
+        ),
+    )
+}
+
+tier_stats = {
+    name: {"requests": 0, "errors": 0, "total_ms": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+    for name in TIERS
+}
+
+
+def get_tier(name: Optional[str]) -> Tier:
+    return TIERS.get(name or ITINERARY_DETAIL) or TIERS["full"]
+
+
+def record_usage(tier: Tier, response):
+    """Add one completion's token usage to the tier's totals."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    stats = tier_stats[tier.name]
+    stats["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+    stats["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+
+def record_request(tier: Tier, elapsed_ms: float, ok: bool = True):
+    stats = tier_stats[tier.name]
+    stats["requests"] += 1
+    stats["errors"] += not ok
+    stats["total_ms"] += elapsed_ms
+    logging.info(
+        "Itinerary %s tier (%s): %.1f ms; totals %s prompt / %s completion tokens",
+        tier.name, tier.model, elapsed_ms, stats["prompt_tokens"], stats["completion_tokens"],
+    )
+
+
+def tier_report() -> Dict[str, dict]:
+    """Per tier: requests, errors, mean latency and mean tokens per request."""
+    report = {}
+    for name, stats in tier_stats.items():
+        requests = stats["requests"] or 1
+        report[name] = {
+            "model": TIERS[name].model,
+            "requests": stats["requests"],
+            "errors": stats["errors"],
+            "mean_ms": round(stats["total_ms"] / requests, 1),
+            "mean_prompt_tokens": round(stats["prompt_tokens"] / requests, 1),
+            "mean_completion_tokens": round(stats["completion_tokens"] / requests, 1),
+        }
+    return report
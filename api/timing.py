@@ -0,0 +1,220 @@
+# timing.py
+#
+# Per-request phase timing, request IDs and an opt-in sampling profiler.
+# Every HTTP request gets an ID (the caller's X-Request-ID if it sent a
+# sane one) that is echoed back and stamped on every log line written while
+# the request runs. Code on the request path wraps its phases in
+# ``with phase("upstream"):`` without being handed anything: the request's
+# timer lives in a context variable, so it also follows the per-day tasks
+# and shared single-flight calls the request starts. A phase's duration is
+# the wall time during which at least one call of it was open, so
+# overlapping per-day upstream calls count once. The phases go out in a
+# Server-Timing header and in one JSON log line per request.
+#
+# With PROFILE_EVERY=N, one request in N runs under cProfile and the stats
+# are written to PROFILE_DIR for ``python -m pstats`` or snakeviz. The
+# profiler sees everything the event loop runs meanwhile, which is what we
+# want for finding CPU hot spots that stall other requests.
+
+import asyncio
+import cProfile
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Dict, Optional
+
+# Config
+TIMING_ENABLED = os.getenv("TIMING_ENABLED", "true").lower() == "true"
+TIMING_LOG = os.getenv("TIMING_LOG", "true").lower() == "true"  # one JSON line per request
+PROFILE_EVERY = int(os.getenv("PROFILE_EVERY", "0"))  # profile 1 in N requests, 0 for never
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+_timer = contextvars.ContextVar("request_timer", default=None)
+_requests = itertools.count(1)
+_profiling = False
+
+
+class RequestTimer:
+    """Phase durations of one request, in milliseconds."""
+
+    __slots__ = ("request_id", "route", "started", "handler_done", "phases", "calls", "_open")
+
+    def __init__(self, request_id: str, route: str):
+        self.request_id = request_id
+        self.route = route
+        self.started = time.perf_counter()
+        self.handler_done: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self._open: Dict[str, list] = {}  # name -> [depth, opened at]
+
+    def enter(self, name: str):
+        state = self._open.get(name)
+        if state is None:
+            state = self._open[name] = [0, 0.0]
+        if state[0] == 0:
+            state[1] = time.perf_counter()
+        state[0] += 1
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def exit(self, name: str):
+        state = self._open[name]
+        state[0] -= 1
+        if state[0] == 0:
+            self.add(name, (time.perf_counter() - state[1]) * 1000)
+
+    def add(self, name: str, ms: float):
+        self.phases[name] = self.phases.get(name, 0.0) + ms
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """The Server-Timing header value: each phase, then the total so far."""
+        entries = [f"{name};dur={ms:.1f}" for name, ms in self.phases.items()]
+        entries.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(entries)
+
+    def report(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "route": self.route,
+            "total_ms": round(self.total_ms(), 1),
+            "phases": {name: round(ms, 1) for name, ms in self.phases.items()},
+            "calls": {name: count for name, count in self.calls.items() if count > 1},
+        }
+
+
+class phase:
+    """``with phase("prompt"):`` times a block against the current request, if any."""
+
+    __slots__ = ("name", "timer")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timer = _timer.get()
+
+    def __enter__(self):
+        if self.timer is not None:
+            self.timer.enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        if self.timer is not None:
+            self.timer.exit(self.name)
+        return False
+
+
+def record_phase(name: str, started: float):
+    """Add the time since ``started`` (a perf_counter value) to a phase, for code a ``with`` cannot wrap."""
+    timer = _timer.get()
+    if timer is not None:
+        timer.add(name, (time.perf_counter() - started) * 1000)
+
+
+def current_timer() -> Optional[RequestTimer]:
+    """The timer of the request being handled, if any."""
+    return _timer.get()
+
+
+def current_request_id() -> Optional[str]:
+    timer = _timer.get()
+    return timer.request_id if timer is not None else None
+
+
+def timed(endpoint):
+    """Decorate an endpoint to record "validate" (request start to handler entry) and "serialize".
+
+    Body parsing and Pydantic validation run before the handler and response
+    serialization after it, so the middleware closes "serialize" when the
+    response starts.
+    """
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        timer = _timer.get()
+        if timer is not None:
+            timer.add("validate", timer.total_ms())
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            if timer is not None:
+                timer.handler_done = time.perf_counter()
+
+    return wrapper
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp log records with the current request's ID ("-" outside requests)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id() or "-"
+        return True
+
+
+def install_log_filter():
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(RequestIdFilter())
+
+
+def _dump_profile(profiler: cProfile.Profile, timer: RequestTimer):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    route = re.sub(r"[^A-Za-z0-9]+", "_", timer.route).strip("_") or "root"
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{route}-{timer.request_id}.prof")
+    profiler.dump_stats(path)
+    logging.info("Profile written to %s", path)
+
+
+class TimingMiddleware:
+    """ASGI middleware: request IDs, Server-Timing, per-request log line and sampled profiling."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _profiling
+        if scope["type"] != "http" or not TIMING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        incoming = dict(scope.get("headers") or []).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex[:16]
+        timer = RequestTimer(request_id, scope.get("path", ""))
+        token = _timer.set(timer)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if timer.handler_done is not None:
+                    timer.add("serialize", (time.perf_counter() - timer.handler_done) * 1000)
+                headers = list(message.get("headers") or [])
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                headers.append((b"server-timing", timer.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = None
+        if PROFILE_EVERY and not _profiling and next(_requests) % PROFILE_EVERY == 0:
+            _profiling = True  # one profile at a time: cProfile cannot nest
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profiling = False
+                try:
+                    await asyncio.to_thread(_dump_profile, profiler, timer)
+                except OSError as err:
+                    logging.error("Could not write profile: %s", err)
+            if TIMING_LOG:
+                logging.info("Request timing: %s", json.dumps({**timer.report(), "status": status["code"]}))
+            _timer.reset(token)
@@ -0,0 +1,159 @@
+# admission.py
+#
+# Load test for upstream admission control. A fake upstream enforces a rate
+# limit (429 beyond it, like the real API) and an open-loop burst of
+# /keyword-search turns and /itinerary plans arrives at several times that
+# rate. Without admission control the overflow turns into upstream 429s,
+# client retries and 500s; with it, admitted requests finish within their
+# class's queueing deadline plus the upstream latency, keyword turns wait
+# less than itineraries, and the rest get a fast 429 with Retry-After.
+#
+#   python -m bench.admission --rate 40 --seconds 5 --upstream-rpm 600
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["ITINERARY_CACHE_ENABLED"] = "false"
+os.environ["ITINERARY_PARALLEL"] = "false"
+
+from api.admission import AdmissionController, AdmissionRejected  # noqa: E402
+from bench.fake_llm import KEYWORD_REPLY, FakeUpstream, create_app, plan_reply  # noqa: E402
+from bench.geo import synthetic_choices  # noqa: E402
+
+MAX_WAITS = {"keyword": 1.0, "itinerary": 3.0}
+
+
+def reply(body: dict) -> str:
+    return plan_reply(body) if "day trip" in body["messages"][-1]["content"] else KEYWORD_REPLY
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def burst(base_url: str, rate: float, seconds: float, sessions: int, admission):
+    import api.main
+    from api import llm
+
+    api.main.admission = admission
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    rng = random.Random(1)
+    results = []
+
+    async def one(client, index):
+        kind = "keyword" if rng.random() < 0.4 else "itinerary"
+        cookies = {"session_id": f"s{index % sessions}"}
+        if kind == "keyword":
+            path, body = "/keyword-search", {"input": f"somewhere with temples and good food, trip {index}"}
+        else:
+            choices = synthetic_choices(12, seed=index)
+            path, body = "/itinerary", {"city": "Kyoto", "country": "Japan", "days": 1, "choices": choices}
+        started = time.perf_counter()
+        response = await client.post(path, json=body, cookies=cookies)
+        results.append((kind, response.status_code, time.perf_counter() - started, response.headers.get("retry-after")))
+
+    try:
+        transport = httpx.ASGITransport(app=api.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+            tasks = []
+            for index in range(int(rate * seconds)):
+                tasks.append(asyncio.ensure_future(one(client, index)))
+                await asyncio.sleep(rng.expovariate(rate))
+            await asyncio.gather(*tasks)
+    finally:
+        await llm.shutdown()
+    return results
+
+
+async def check_fairness():
+    """One session cannot hold more than its share, and keyword turns overtake queued plans."""
+    admission = AdmissionController(rpm=60, tpm=10_000_000, burst_seconds=1, session_limit=2)
+    order = []
+
+    async def call(kind, session):
+        try:
+            async with admission.admit(kind, 100, session):
+                order.append(kind)
+                await asyncio.sleep(0.01)
+        except AdmissionRejected as rejected:
+            return rejected.reason
+
+    reasons = await asyncio.gather(*(call("itinerary", "greedy") for _ in range(5)))
+    assert reasons.count("session") == 3, reasons
+    # The bucket is empty now: a plan queued first still runs after a later keyword turn.
+    order.clear()
+    await asyncio.gather(call("itinerary", "a"), call("keyword", "b"))
+    assert order == ["keyword", "itinerary"], order
+    print(f"fairness ok: {admission.snapshot()['itinerary']}")
+
+
+def report(label, results):
+    print(label)
+    for kind in ("keyword", "itinerary"):
+        mine = [r for r in results if r[0] == kind]
+        ok = [r[2] for r in mine if r[1] == 200]
+        shed = [r[2] for r in mine if r[1] == 429]
+        failed = [r for r in mine if r[1] not in (200, 429)]
+        print(
+            f"  {kind:<9} sent={len(mine):4d} ok={len(ok):4d} 429={len(shed):4d} failed={len(failed):4d} "
+            f"ok p50={percentile(ok, 0.5):5.2f}s p99={percentile(ok, 0.99):5.2f}s max={max(ok, default=0):5.2f}s "
+            f"429 p99={percentile(shed, 0.99):5.2f}s"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=float, default=40, help="arrivals per second")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--upstream-rpm", type=float, default=600)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)  # the run without admission logs every upstream 429
+
+    asyncio.run(check_fairness())
+
+    app = create_app(latency=args.latency, reply=reply, rpm=args.upstream_rpm, burst=args.upstream_rpm / 60 * 2)
+    with FakeUpstream(app) as upstream:
+        off = report(
+            "admission off",
+            asyncio.run(burst(upstream.base_url, args.rate, args.seconds, args.sessions,
+                              AdmissionController(enabled=False))),
+        )
+        time.sleep(3)  # let the upstream's bucket refill
+        admission = AdmissionController(
+            rpm=args.upstream_rpm * 0.9, tpm=10_000_000, burst_seconds=2, max_waits=MAX_WAITS,
+        )
+        on = report(
+            "admission on",
+            asyncio.run(burst(upstream.base_url, args.rate, args.seconds, args.sessions, admission)),
+        )
+        print(f"  controller: {admission.snapshot()}")
+
+    failed_off = sum(1 for r in off if r[1] not in (200, 429))
+    assert not [r for r in on if r[1] not in (200, 429)], "admitted requests still failed upstream"
+    assert all(r[3] for r in on if r[1] == 429), "429 without Retry-After"
+    for kind, max_wait in MAX_WAITS.items():
+        ok = [r[2] for r in on if r[0] == kind and r[1] == 200]
+        # Queueing deadline, one upstream call and generous slack for the event loop.
+        assert max(ok) < max_wait + args.latency + 1.0, (kind, max(ok))
+    print(f"ok: {failed_off} failures without admission, none with it; latency bounded per class")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as err:
+        sys.exit(f"FAILED: {err}")
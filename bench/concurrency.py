@@ -0,0 +1,78 @@
+# concurrency.py
+#
+# Check that one worker multiplexes upstream calls: with a fake upstream that
+# takes LATENCY seconds per call, N concurrent /keyword-search requests should
+# finish in roughly LATENCY seconds, not N * LATENCY. Every request has its
+# own input, so single-flight cannot coalesce them, and each level checks
+# that the upstream really saw one call per request.
+#
+#   OPENAI_API_KEY=test python -m bench.concurrency
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ADMISSION_ENABLED", "false")  # measure the client pool, not the upstream budget
+
+from bench.fake_llm import FakeUpstream, create_app  # noqa: E402
+
+
+async def drive(concurrency: int, base_url: str) -> float:
+    from api import llm
+    from api.main import app
+
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+            started = time.perf_counter()
+            responses = await asyncio.gather(
+                *(
+                    # Not parseable by the keyword fast path, and distinct so nothing is coalesced
+                    client.post("/keyword-search", json={"input": f"I love ramen and museums, trip {index}"})
+                    for index in range(concurrency)
+                )
+            )
+            elapsed = time.perf_counter() - started
+    finally:
+        await llm.shutdown()
+    failed = [r for r in responses if r.status_code != 200]
+    if failed:
+        raise SystemExit(f"{len(failed)} requests failed: {failed[0].text}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--levels", default="1,10,100")
+    args = parser.parse_args()
+
+    app = create_app(latency=args.latency)
+    with FakeUpstream(app) as upstream:
+        ok = True
+        for concurrency in (int(level) for level in args.levels.split(",")):
+            calls_before = app.state.requests
+            elapsed = asyncio.run(drive(concurrency, upstream.base_url))
+            calls = app.state.requests - calls_before
+            throughput = concurrency / elapsed
+            # Serialized calls would take concurrency * latency; allow generous slack.
+            scaled = elapsed < args.latency * max(2, concurrency / 4)
+            # Fewer calls than requests means they were coalesced or answered locally, proving nothing.
+            upstream_bound = calls == concurrency
+            ok = ok and scaled and upstream_bound
+            print(
+                f"concurrency={concurrency:<4} elapsed={elapsed:.2f}s upstream calls={calls} "
+                f"throughput={throughput:.1f} req/s {'ok' if scaled else 'SERIALIZED'}"
+                f"{'' if upstream_bound else ' NOT ONE CALL PER REQUEST'}"
+            )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
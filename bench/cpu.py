@@ -0,0 +1,226 @@
+# cpu.py
+#
+# CPU microbenchmarks for the /itinerary request path on large payloads.
+# Synthetic candidate sets (10 to 5,000 places with long multilingual
+# descriptions, hours and photos) go through each stage on its own:
+# JSON decoding and TripRequest validation of the body, the legacy repr
+# encoding, ranking, the compact encoding, the full prompt build (logging
+# included), the cache key, post-processing of a plan and serializing the
+# response; model replies of growing size go through extraction. Each
+# stage reports its median time and peak allocations.
+#
+# The last check plans a trip with the largest set through the app against
+# the fake upstream while a ticker measures how late the event loop runs,
+# i.e. how long one big request stalls every other request on the worker.
+# The run fails when that stall is over --max-stall-ms (250 ms by default).
+#
+#   python -m bench.cpu --sizes 10 100 1000 5000 --output cpu.json
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["ITINERARY_CACHE_ENABLED"] = "false"
+os.environ.setdefault("TIMING_LOG", "false")
+
+from bench.extract_json import large_reply  # noqa: E402
+from bench.fake_llm import FakeUpstream, create_app, plan_reply  # noqa: E402
+
+TOKYO = (35.68, 139.76)
+WORDS = {
+    "en": "a quiet temple garden with seasonal flowers, stone lanterns and a small tea house by the pond".split(),
+    "ja": "静かな寺院の庭園には季節の花と石灯籠があり池のそばに小さな茶屋があります".split("の"),
+    "fr": "un jardin de temple paisible avec des fleurs de saison, des lanternes et un salon de thé".split(),
+    "ar": "حديقة معبد هادئة مع زهور موسمية وفوانيس حجرية ومقهى صغير بجانب البركة".split(),
+    "emoji": ["🌸", "⛩️", "🍵", "🏯", "🎋"],
+}
+HOURS = {day: "9 AM–5 PM" for day in ("monday", "tuesday", "wednesday", "thursday", "friday")}
+
+
+def choice_set(count: int, seed: int = 1) -> list:
+    """Places shaped like the client's: every field the prompt may read, plus ones it drops."""
+    rng = random.Random(seed)
+    choices = []
+    for index in range(count):
+        kind = rng.choices(["Activity", "Lunch", "Dinner"], weights=[6, 2, 2])[0]
+        language = rng.choice(list(WORDS))
+        description = " ".join(rng.choice(WORDS[language]) for _ in range(rng.randint(60, 200)))
+        choices.append({
+            "data_id": f"ChIJ{index:08d}{rng.getrandbits(48):012x}",
+            "category": kind,
+            "title": f"{kind} {index} {rng.choice(WORDS[language])}",
+            "rating": round(rng.uniform(3, 5), 1),
+            "reviews": rng.randint(0, 20000),
+            "address": f"{index} Example St, Chiyoda City, Tokyo 100-0001, Japan",
+            "operating_hours": dict(HOURS, saturday="10 AM–4 PM", sunday="Closed"),
+            "description": description,
+            "thumbnail": f"https://example.com/photos/{index}.jpg",
+            "gps_coordinates": {
+                "latitude": TOKYO[0] + rng.gauss(0, 0.05),
+                "longitude": TOKYO[1] + rng.gauss(0, 0.06),
+            },
+        })
+    return choices
+
+
+def measure(fn, min_seconds: float = 0.2, max_runs: int = 50) -> dict:
+    """Median and best wall time over repeated runs, and peak bytes allocated by one run."""
+    times = []
+    deadline = time.perf_counter() + min_seconds
+    while len(times) < 3 or (time.perf_counter() < deadline and len(times) < max_runs):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "runs": len(times),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def input_stages(size: int, days: int) -> dict:
+    import api.main as main
+    from api.prompting import encode_choices
+    from api.ranking import select_candidates
+
+    choices = choice_set(size)
+    raw = json.dumps({"city": "Tokyo", "country": "Japan", "days": days, "choices": choices}).encode()
+    data = main.TripRequest.model_validate(json.loads(raw))
+    messages, table = main.build_itinerary_messages(data)
+    reply = main.extract_json(plan_reply({"messages": messages}))
+
+    def postprocess():
+        main.finish_itinerary(json.loads(json.dumps(reply)), table, data)
+
+    finished = main.finish_itinerary(json.loads(json.dumps(reply)), table, data)
+    return {
+        "body_bytes": len(raw),
+        "json_decode": measure(lambda: json.loads(raw)),
+        "validate": measure(lambda: main.TripRequest.model_validate(json.loads(raw))),
+        "repr": measure(lambda: f"{data.choices}"),
+        "rank": measure(lambda: select_candidates(data.choices, data.days)),
+        "encode": measure(lambda: encode_choices(data.choices)),
+        "prompt": measure(lambda: main.build_itinerary_messages(data)),
+        "cache_key": measure(lambda: main.itinerary_cache_key(data)),
+        "postprocess": measure(postprocess),
+        "serialize": measure(lambda: json.dumps(finished, ensure_ascii=False)),
+    }
+
+
+def output_stages(days: int, slots: int) -> dict:
+    from api.extract import extract_json
+
+    text = large_reply(days, slots)
+    return {
+        "reply_bytes": len(text.encode()),
+        "extract": measure(lambda: extract_json(text)),
+        "json_loads": measure(lambda: json.loads(text[text.index("{"):text.rindex("}") + 1])),
+    }
+
+
+async def event_loop_lag(base_url: str, size: int, days: int, tick: float = 0.005) -> dict:
+    """Plan one trip with ``size`` candidates while a ticker records how late it wakes up."""
+    from api import llm
+    from api.main import app
+
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(tick)
+            lags.append((time.perf_counter() - started - tick) * 1000)
+
+    # Encoded up front so the client's own JSON work does not count as the app's stall
+    body = json.dumps({"city": "Tokyo", "country": "Japan", "days": days, "choices": choice_set(size)}).encode()
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+            watcher = asyncio.ensure_future(ticker())
+            started = time.perf_counter()
+            response = await client.post("/itinerary", content=body, headers={"content-type": "application/json"})
+            elapsed = time.perf_counter() - started
+            done.set()
+            await watcher
+    finally:
+        await llm.shutdown()
+    assert response.status_code == 200, response.text
+    return {
+        "size": size,
+        "request_ms": round(elapsed * 1000, 1),
+        "server_timing": response.headers.get("server-timing"),
+        "max_lag_ms": round(max(lags), 1),
+        "p99_lag_ms": round(sorted(lags)[int(0.99 * (len(lags) - 1))], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--reply-days", type=int, nargs="+", default=[1, 7, 14])
+    parser.add_argument("--max-stall-ms", type=float, default=250,
+                        help="fail when one request blocks the loop longer; 0 disables the check")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    # Log at INFO as in production, into a null stream so formatting is measured but not printed.
+    root = logging.getLogger()
+    root.addHandler(logging.StreamHandler(open(os.devnull, "w")))
+    root.setLevel(logging.INFO)
+
+    report = {"input": {}, "output": {}}
+    print(f"{'stage':<12}" + "".join(f"{size:>16}" for size in args.sizes))
+    for size in args.sizes:
+        report["input"][size] = input_stages(size, args.days)
+    stages = [name for name in report["input"][args.sizes[0]] if name != "body_bytes"]
+    print(f"{'body':<12}" + "".join(f"{report['input'][s]['body_bytes'] / 1024:>13.0f} KB" for s in args.sizes))
+    for stage in stages:
+        print(f"{stage:<12}" + "".join(
+            f"{report['input'][s][stage]['median_ms']:>8.1f}ms{report['input'][s][stage]['peak_kb'] / 1024:>5.1f}M"
+            for s in args.sizes
+        ))
+
+    for days in args.reply_days:
+        row = report["output"][days] = output_stages(days, 8)
+        print(
+            f"reply {days:>2} days ({row['reply_bytes'] / 1024:.0f} KB): extract {row['extract']['median_ms']:.2f} ms, "
+            f"json.loads {row['json_loads']['median_ms']:.2f} ms"
+        )
+
+    with FakeUpstream(create_app(latency=0.05, reply=plan_reply)) as upstream:
+        report["event_loop"] = asyncio.run(event_loop_lag(upstream.base_url, max(args.sizes), args.days))
+    lag = report["event_loop"]
+    print(
+        f"event loop with {lag['size']} candidates: request {lag['request_ms']} ms, "
+        f"max lag {lag['max_lag_ms']} ms, p99 lag {lag['p99_lag_ms']} ms\n  {lag['server_timing']}"
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.max_stall_ms and lag["max_lag_ms"] > args.max_stall_ms:
+        sys.exit(f"FAILED: one request stalled the event loop for {lag['max_lag_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# extract_json.py
+#
+# Compare the JSON extractor's speed with the regex it replaced on large
+# itinerary replies. Its behaviour on malformed replies is covered by
+# tests/test_extract.py.
+#
+#   python -m bench.extract_json
+
+import argparse
+import copy
+import json
+import re
+import timeit
+
+from api.extract import JsonExtractor, extract_json
+
+SLOT = {
+    "data_id": "ChIJ51cu8IcbXWARiRtXIothAS4",
+    "location": "Senso-ji",
+    "time": {"startTime": "09:00 AM", "endTime": "10:30 AM"},
+    "description": "Tokyo's oldest temple.",
+    "language": "English",
+}
+ITINERARY = {"itineraryItems": [{"day": 1, "dates": "2024-10-01", "city": "Tokyo", "image": "", "slots": [SLOT]}]}
+
+LEGACY_PATTERN = r"```json\n({.*?})\n```"
+
+
+def legacy_extract(text: str):
+    match = re.search(LEGACY_PATTERN, text, re.DOTALL)
+    return json.loads(match.group(1)) if match else None
+
+
+def large_reply(days: int, slots: int) -> str:
+    itinerary = copy.deepcopy(ITINERARY)
+    day = itinerary["itineraryItems"][0]
+    slot = dict(SLOT, description="A long description of the place. " * 20)
+    day["slots"] = [slot] * slots
+    itinerary["itineraryItems"] = [dict(day, day=n + 1) for n in range(days)]
+    return "Here is your plan:\n```json\n" + json.dumps(itinerary, indent=2) + "\n```\nEnjoy!"
+
+
+def streamed(text: str, chunk: int = 16):
+    extractor = JsonExtractor(watch=lambda parents: len(parents) == 2)
+    for i in range(0, len(text), chunk):
+        extractor.feed(text[i:i + chunk])
+    return extractor.finish()
+
+
+def benchmark(days: int, slots: int, number: int):
+    text = large_reply(days, slots)
+    assert legacy_extract(text) == extract_json(text) == streamed(text)
+    print(f"\nreply size: {len(text) / 1024:.0f} KiB ({days} days x {slots} slots)")
+    for label, fn in (
+        ("legacy regex + json.loads", lambda: legacy_extract(text)),
+        ("extract_json (one shot)", lambda: extract_json(text)),
+        ("JsonExtractor (16-char chunks)", lambda: streamed(text)),
+    ):
+        seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+        print(f"  {label:<32} {seconds * 1000:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+    benchmark(args.days, args.slots, args.number)
+
+
+if __name__ == "__main__":
+    main()
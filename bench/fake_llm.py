@@ -0,0 +1,196 @@
+# fake_llm.py
+#
+# A tiny OpenAI-compatible upstream for local benchmarks. It answers
+# /v1/chat/completions after a fixed delay so we can see whether the app
+# multiplexes in-flight calls or serializes them. Streaming requests get the
+# reply in small chunks, spaced by token_delay, after the initial delay.
+# ``reply``, ``latency`` and ``token_delay`` may also be functions of the
+# request body, so a benchmark can answer each prompt with a reply of
+# realistic length and give each model its own speed. Usage is estimated at
+# four characters per token. With ``rpm`` set, requests beyond that rate
+# (after a burst of ``burst`` requests) get a 429 like the real API. A
+# share ``fail_rate`` of requests fails with ``fail_status``; both live on
+# ``app.state`` so a benchmark can start and end an outage mid-run, and
+# ``app.state.requests`` counts what reached the upstream. ``plan_reply``
+# answers itinerary prompts with a plan over the prompt's own ids.
+#
+# Importing this module must not change the app's configuration (no
+# os.environ writes): benchmarks set that themselves before importing api.main.
+
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+KEYWORD_REPLY = """```json
+{
+  "city": "Tokyo",
+  "country": "Japan",
+  "countryCode": "jp",
+  "days": 2,
+  "language": "English"
+}
+```"""
+
+SLOTS_PER_DAY = 6
+NOTE = "A short note about why this place fits here, in a few words."
+DESCRIPTION = " ".join([NOTE] * 4)  # about the 50 words the full schema asks for
+
+
+def plan_reply(body: dict) -> str:
+    """A plan for the days the prompt asks for, using its ids, in the schema the system prompt asks for."""
+    system, prompt = body["messages"][0]["content"], body["messages"][-1]["content"]
+    rows = dict(re.findall(r"^(c\d+)\|[^|]*\|([^|]*)\|", prompt, re.MULTILINE))
+    ids = list(rows)
+    full = '"itineraryItems"' in system
+    single = re.search(r"This is day (\d+) of", prompt)
+    numbers = [int(single.group(1))] if single else range(1, int(re.search(r"(\d+) day trip", prompt).group(1)) + 1)
+    days = []
+    for offset, number in enumerate(numbers):
+        slots = []
+        for index in range(SLOTS_PER_DAY):
+            local_id = ids[(offset * SLOTS_PER_DAY + index) % len(ids)]
+            hour = 9 + 2 * index
+            start = f"{hour % 12 or 12:02d}:00 {'AM' if hour < 12 else 'PM'}"
+            end = f"{(hour + 1) % 12 or 12:02d}:30 {'AM' if hour + 1 < 12 else 'PM'}"
+            if full:
+                slots.append({"data_id": local_id, "location": rows[local_id], "time": {"startTime": start, "endTime": end},
+                              "description": DESCRIPTION, "language": "English"})
+            else:
+                slots.append([local_id, start, end, NOTE])
+        if full:
+            days.append({"day": number, "dates": f"2024-10-{number:02d}", "city": "Tokyo", "image": "", "slots": slots})
+        else:
+            days.append({"day": number, "date": f"2024-10-{number:02d}", "language": "English", "slots": slots})
+    return "```json\n" + json.dumps({"itineraryItems" if full else "days": days}) + "\n```"
+
+
+def _stream(model: str, reply: str, latency: float, token_delay: float, chunk_chars: int):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    def chunk(delta: dict, finish_reason=None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def events():
+        await asyncio.sleep(latency)
+        yield chunk({"role": "assistant", "content": ""})
+        for i in range(0, len(reply), chunk_chars):
+            if token_delay:
+                await asyncio.sleep(token_delay)
+            yield chunk({"content": reply[i:i + chunk_chars]})
+        yield chunk({}, "stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def create_app(
+    latency=0.5,
+    reply=KEYWORD_REPLY,
+    token_delay=0.0,
+    chunk_chars: int = 4,
+    rpm: Optional[float] = None,
+    burst: float = 10,
+    fail_rate: float = 0.0,
+    fail_status: int = 503,
+    seed: int = 0,
+) -> FastAPI:
+    app = FastAPI()
+    app.state.fail_rate = fail_rate
+    app.state.fail_status = fail_status
+    app.state.requests = 0
+    rng = random.Random(seed)
+    limit = {"level": burst, "updated": time.monotonic()}
+
+    def rate_limited() -> bool:
+        now = time.monotonic()
+        limit["level"] = min(burst, limit["level"] + (now - limit["updated"]) * rpm / 60)
+        limit["updated"] = now
+        if limit["level"] < 1:
+            return True
+        limit["level"] -= 1
+        return False
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        if app.state.fail_rate and rng.random() < app.state.fail_rate:
+            return JSONResponse(
+                {"error": {"message": "Upstream unavailable", "type": "server_error", "code": None}},
+                status_code=app.state.fail_status,
+            )
+        if rpm and rate_limited():
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": "1"},
+            )
+        body = await request.json()
+        text = reply(body) if callable(reply) else reply
+        first = latency(body) if callable(latency) else latency
+        delay = token_delay(body) if callable(token_delay) else token_delay
+        if body.get("stream"):
+            return _stream(body.get("model", "fake"), text, first, delay, chunk_chars)
+        await asyncio.sleep(first + delay * len(text) / chunk_chars)
+        prompt_tokens = len(json.dumps(body.get("messages", []), ensure_ascii=False)) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(text) // 4,
+                "total_tokens": prompt_tokens + len(text) // 4,
+            },
+        }
+
+    return app
+
+
+class FakeUpstream:
+    """Run the fake upstream on a background thread for the duration of a block."""
+
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1", port: int = 8765):
+        self.host = host
+        self.port = port
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host=host, port=port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
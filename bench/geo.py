@@ -0,0 +1,79 @@
+# geo.py
+#
+# Time the geo engine on synthetic candidates around a city and compare the
+# planned routes with the naive order the choices arrive in.
+#
+#   python -m bench.geo --sizes 25 100 1000 --days 3
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from api.geo import distance_matrix, plan_days
+
+TOKYO = (35.6812, 139.7671)
+
+
+def synthetic_choices(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    choices = []
+    for index in range(count):
+        kind = "Activity" if index == 0 else rng.choices(["Activity", "Lunch", "Dinner"], weights=[6, 2, 2])[0]
+        choices.append({
+            "data_id": f"place-{index}",
+            "category": kind,
+            "title": f"{kind} {index}",
+            "address": f"{index} Example St, Tokyo",
+            "gps_coordinates": {
+                "latitude": TOKYO[0] + rng.gauss(0, 0.05),
+                "longitude": TOKYO[1] + rng.gauss(0, 0.06),
+            },
+        })
+    return choices
+
+
+def route_km(day) -> float:
+    points = np.array([[c["gps_coordinates"]["latitude"], c["gps_coordinates"]["longitude"]] for c in day])
+    if len(points) < 2:
+        return 0.0
+    return float(np.diag(distance_matrix(points), 1).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[25, 100, 1000])
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        choices = synthetic_choices(size)
+        points = np.array([[c["gps_coordinates"]["latitude"], c["gps_coordinates"]["longitude"]] for c in choices])
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            distance_matrix(points)
+        matrix_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            plans = plan_days(choices, args.days, end_location=choices[0]["title"])
+        plan_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+        per_day = size // args.days
+        naive = sum(route_km(choices[d * per_day:(d + 1) * per_day]) for d in range(args.days))
+        planned = sum(route_km(day) for day in plans)
+        planned_ids = [c["data_id"] for day in plans for c in day]
+        assert len(planned_ids) == len(set(planned_ids))
+        assert {c["data_id"] for c in choices if c["category"] == "Activity"} <= set(planned_ids)
+        assert all(sum(c["category"] == "Lunch" for c in day) == 1 for day in plans)
+        assert plans[-1][-1] is choices[0]
+        print(
+            f"n={size:5d} matrix={matrix_ms:8.2f} ms plan={plan_ms:8.2f} ms"
+            f" route km naive={naive:9.1f} planned={planned:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
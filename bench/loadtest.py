@@ -0,0 +1,317 @@
+# loadtest.py
+#
+# Offline load test of the whole app against the fake upstream. Virtual
+# users hold multi-turn /keyword-search sessions (follow-up questions until
+# the last turn, then the JSON answer) and request /itinerary plans, closed
+# loop at each concurrency level, while the fake upstream adds a
+# configurable time to first token, per-token delay and error rate and
+# answers with canned plans built from the prompt's candidate ids.
+#
+# Each level reports throughput, per-endpoint p50/p95/p99 latency, error
+# rate and process memory growth. --output writes the report as JSON, with
+# the commit it ran on; --baseline compares against an earlier report and
+# --max-regression turns a slowdown beyond that share into a failing exit.
+#
+#   python -m bench.loadtest --concurrency 1 10 50 --seconds 10 --output report.json
+#   python -m bench.loadtest --baseline report.json --max-regression 0.2
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TIMING_LOG", "false")
+
+from bench.fake_llm import KEYWORD_REPLY, FakeUpstream, create_app, plan_reply  # noqa: E402
+from bench.geo import synthetic_choices  # noqa: E402
+
+FOLLOW_UP = "Which city would you like to visit, and for how many days?"
+TURNS = ["I want a trip with temples and good food", "Somewhere in Japan, maybe Kyoto", "Kyoto for 2 days please"]
+
+
+def make_reply(turns: int):
+    """Follow-up questions until a session's last turn, then the keyword JSON; plans for /itinerary."""
+    def reply(body: dict) -> str:
+        last = body["messages"][-1]["content"]
+        if "day trip" in last:
+            return plan_reply(body)
+        user_turns = sum(1 for message in body["messages"] if message["role"] == "user")
+        return KEYWORD_REPLY if user_turns >= turns else FOLLOW_UP
+
+    return reply
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def rss_mb() -> Optional[float]:
+    """Resident set size of this process (app, fake upstream and driver together)."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[int, int]] = {}
+
+    def add(self, endpoint: str, status: int, seconds: float):
+        statuses = self.statuses.setdefault(endpoint, {})
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == 200:
+            self.samples.setdefault(endpoint, []).append(seconds * 1000)
+
+    def summary(self) -> Dict[str, dict]:
+        report = {}
+        for endpoint, statuses in self.statuses.items():
+            count = sum(statuses.values())
+            ok = self.samples.get(endpoint, [])
+            report[endpoint] = {
+                "requests": count,
+                "ok": len(ok),
+                "error_rate": round(1 - len(ok) / count, 4),
+                "statuses": {str(status): n for status, n in sorted(statuses.items())},
+                "mean_ms": round(sum(ok) / len(ok), 1) if ok else None,
+                "p50_ms": _round(percentile(ok, 0.5)),
+                "p95_ms": _round(percentile(ok, 0.95)),
+                "p99_ms": _round(percentile(ok, 0.99)),
+            }
+        return report
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 1)
+
+
+async def keyword_session(client: httpx.AsyncClient, recorder: Recorder, user: int, turns: int):
+    session_id = f"load-{user}-{random.getrandbits(32):08x}"
+    for turn in range(turns):
+        started = time.perf_counter()
+        response = await client.post(
+            "/keyword-search", json={"input": TURNS[turn % len(TURNS)], "session_id": session_id},
+        )
+        recorder.add("keyword", response.status_code, time.perf_counter() - started)
+        if response.status_code != 200:
+            return
+
+
+async def itinerary(client: httpx.AsyncClient, recorder: Recorder, days: int, candidates: int, seed: int):
+    body = {
+        "city": "Kyoto", "country": "Japan", "days": days,
+        "choices": synthetic_choices(candidates * days, seed=seed),
+    }
+    started = time.perf_counter()
+    response = await client.post("/itinerary", json=body)
+    recorder.add("itinerary", response.status_code, time.perf_counter() - started)
+
+
+async def run_level(client: httpx.AsyncClient, args, concurrency: int) -> dict:
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.seconds
+    rng = random.Random(concurrency)
+
+    async def user(index: int):
+        seed = index * 100_000
+        while time.perf_counter() < deadline:
+            if rng.random() < args.keyword_share:
+                await keyword_session(client, recorder, index, args.turns)
+            else:
+                seed += 1
+                await itinerary(client, recorder, args.days, args.candidates, seed)
+
+    gc.collect()
+    rss_before = rss_mb()
+    heap_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    started = time.perf_counter()
+    await asyncio.gather(*(user(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    rss_after = rss_mb()
+
+    endpoints = recorder.summary()
+    total_ok = sum(row["ok"] for row in endpoints.values())
+    total = sum(row["requests"] for row in endpoints.values())
+    memory = {
+        "rss_before_mb": _round(rss_before),
+        "rss_after_mb": _round(rss_after),
+        "rss_growth_mb": _round(rss_after - rss_before) if rss_before and rss_after else None,
+    }
+    if heap_before is not None:
+        memory["heap_growth_mb"] = round((tracemalloc.get_traced_memory()[0] - heap_before) / 2**20, 2)
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "requests": total,
+        "throughput_rps": round(total_ok / elapsed, 1),
+        "error_rate": round(1 - total_ok / total, 4) if total else None,
+        "endpoints": endpoints,
+        "memory": memory,
+    }
+
+
+def check_flags(args, main):
+    """Fail early if --cache or --admission did not reach the app, e.g. api.main was imported too soon."""
+    cache_on = main.itinerary_cache is not None
+    if cache_on != args.cache or main.admission.enabled != args.admission:
+        raise SystemExit(
+            f"app config does not match the flags: cache={cache_on} (--cache {args.cache}), "
+            f"admission={main.admission.enabled} (--admission {args.admission})"
+        )
+
+
+async def drive(args, base_url: str) -> List[dict]:
+    from api import llm
+
+    if args.app_url:
+        client = httpx.AsyncClient(base_url=args.app_url, timeout=args.timeout)
+    else:
+        import api.main
+        from api.main import app
+
+        check_flags(args, api.main)
+        await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app", timeout=args.timeout)
+    runs = []
+    try:
+        async with client:
+            for concurrency in args.concurrency:
+                run = await run_level(client, args, concurrency)
+                if not args.app_url:
+                    from api.main import conversation_histories
+
+                    run["sessions"] = len(conversation_histories)
+                runs.append(run)
+                print_run(run)
+    finally:
+        if not args.app_url:
+            await llm.shutdown()
+    return runs
+
+
+def print_run(run: dict):
+    print(
+        f"concurrency={run['concurrency']:<4} requests={run['requests']:<6} "
+        f"throughput={run['throughput_rps']:7.1f} req/s errors={run['error_rate']:.2%} "
+        f"rss growth={run['memory']['rss_growth_mb']} MB"
+    )
+    for endpoint, row in run["endpoints"].items():
+        print(
+            f"  {endpoint:<9} ok={row['ok']:<6} p50={row['p50_ms']}ms p95={row['p95_ms']}ms "
+            f"p99={row['p99_ms']}ms statuses={row['statuses']}"
+        )
+
+
+def commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict, max_regression: Optional[float]) -> List[str]:
+    """Print the change per level and endpoint; return the regressions beyond ``max_regression``."""
+    print(f"compared with {baseline['meta'].get('commit')} ({baseline['meta'].get('created')}):")
+    before = {run["concurrency"]: run for run in baseline["runs"]}
+    regressions = []
+
+    def delta(name, old, new, higher_is_worse=True):
+        if not old or new is None:
+            return
+        change = (new - old) / old
+        print(f"  {name:<36} {old:9.1f} -> {new:9.1f} ({change:+.1%})")
+        worse = change if higher_is_worse else -change
+        if max_regression is not None and worse > max_regression:
+            regressions.append(f"{name} {change:+.1%}")
+
+    for run in report["runs"]:
+        old = before.get(run["concurrency"])
+        if old is None:
+            continue
+        level = f"c={run['concurrency']}"
+        delta(f"{level} throughput_rps", old["throughput_rps"], run["throughput_rps"], higher_is_worse=False)
+        for endpoint, row in run["endpoints"].items():
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                delta(f"{level} {endpoint} {key}", old["endpoints"].get(endpoint, {}).get(key), row[key])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--seconds", type=float, default=10, help="per concurrency level")
+    parser.add_argument("--keyword-share", type=float, default=0.5, help="share of users' loops that are keyword sessions")
+    parser.add_argument("--turns", type=int, default=3, help="keyword turns per session")
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--candidates", type=int, default=12, help="choices per day in /itinerary requests")
+    parser.add_argument("--ttft", type=float, default=0.3, help="upstream seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="upstream seconds per token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls failing with 503")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--cache", action="store_true", help="keep the itinerary cache on")
+    parser.add_argument("--admission", action="store_true", help="keep admission control on")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report Python heap growth (slower)")
+    parser.add_argument("--app-url", help="drive a running app instead of one in-process")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier JSON report to compare with")
+    parser.add_argument("--max-regression", type=float, help="fail when latency or throughput is worse by this share")
+    args = parser.parse_args()
+
+    # Read by api.main at import time, so set before drive() imports it
+    os.environ["ITINERARY_CACHE_ENABLED"] = "true" if args.cache else "false"
+    os.environ["ADMISSION_ENABLED"] = "true" if args.admission else "false"
+    logging.disable(logging.ERROR)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    app = create_app(latency=args.ttft, token_delay=args.token_delay, reply=make_reply(args.turns),
+                     fail_rate=args.error_rate)
+    with FakeUpstream(app) as upstream:
+        runs = asyncio.run(drive(args, upstream.base_url))
+
+    report = {
+        "meta": {
+            "commit": commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "upstream_requests": app.state.requests,
+        },
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            sys.exit("REGRESSED: " + ", ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
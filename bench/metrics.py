@@ -0,0 +1,110 @@
+# metrics.py
+#
+# Check /metrics end to end and measure what collection costs on the request
+# path. A few /keyword-search and /itinerary requests run against the fake
+# upstream, then the scrape must show per-route latency histograms,
+# upstream latency by model, token counters and the session gauge in valid
+# Prometheus text format. The overhead is timed per recorded request: the
+# middleware's bookkeeping plus one upstream observation and token count.
+#
+#   python -m bench.metrics --requests 20
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["ITINERARY_CACHE_ENABLED"] = "false"
+
+from api import metrics  # noqa: E402
+from bench.admission import reply  # noqa: E402
+from bench.fake_llm import FakeUpstream, create_app  # noqa: E402
+from bench.geo import synthetic_choices  # noqa: E402
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? -?[0-9.e+-]+$|^.* \+Inf$')
+
+
+async def drive(base_url: str, requests: int) -> str:
+    from api import llm
+    from api.main import app
+
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=60) as client:
+            for index in range(requests):
+                response = await client.post("/keyword-search", json={"input": f"temples and food {index}"})
+                assert response.status_code == 200, response.text
+                body = {"city": "Kyoto", "country": "Japan", "days": 1, "choices": synthetic_choices(12, seed=index)}
+                response = await client.post("/itinerary", json=body)
+                assert response.status_code == 200, response.text
+            await client.get("/nowhere")
+            response = await client.get("/metrics")
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/plain"), response.headers
+            return response.text
+    finally:
+        await llm.shutdown()
+
+
+def overhead(iterations: int) -> float:
+    """Microseconds of metric bookkeeping per request."""
+    usage = type("Usage", (), {"prompt_tokens": 900, "completion_tokens": 300})()
+    response = type("Response", (), {"usage": usage})()
+    token = metrics._route.set("/itinerary")
+    started = time.perf_counter()
+    for index in range(iterations):
+        metrics.http_in_flight.inc(route="/itinerary")
+        metrics.llm_duration.observe(0.8, provider="openai", model="gpt-4o", status="ok")
+        metrics.record_usage("gpt-4o", response)
+        metrics.http_in_flight.dec(route="/itinerary")
+        metrics.http_duration.observe(0.9, route="/itinerary", method="POST", status=200)
+    elapsed = time.perf_counter() - started
+    metrics._route.reset(token)
+    return elapsed / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    with FakeUpstream(create_app(latency=0.01, reply=reply)) as upstream:
+        text = asyncio.run(drive(upstream.base_url, args.requests))
+
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            assert SAMPLE.match(line), f"malformed sample: {line}"
+    for needle in (
+        'http_request_duration_seconds_count{route="/keyword-search",method="POST",status="200"} '
+        f"{args.requests}",
+        'http_request_duration_seconds_count{route="/itinerary",method="POST",status="200"}',
+        'http_request_duration_seconds_count{route="unmatched",method="GET",status="404"} 1',
+        'llm_call_duration_seconds_bucket{provider="openai",model="gpt-4o",status="ok",le="+Inf"}',
+        'llm_tokens_total{route="/keyword-search",model="gpt-4o",kind="completion"}',
+        'llm_tokens_total{route="/itinerary",model="gpt-4o",kind="prompt"}',
+        "sessions_size ",
+        'llm_option_breaker{option="openai:gpt-4o",breaker="closed"} 1',
+        'http_requests_in_flight{route="/metrics"} 1',
+    ):
+        assert needle in text, f"missing from /metrics: {needle}"
+    print(f"/metrics ok: {len(text.splitlines())} lines")
+
+    cost = overhead(args.iterations)
+    print(f"bookkeeping per request: {cost:.2f} us")
+    assert cost < 50, cost
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as err:
+        sys.exit(f"FAILED: {err}")
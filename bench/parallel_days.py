@@ -0,0 +1,67 @@
+# parallel_days.py
+#
+# Compare one completion for a whole multi-day trip with one concurrent
+# completion per day. The fake upstream answers with a plan (full or
+# minimal schema, whichever the prompt asks for) whose length grows with
+# the number of days it was asked for and charges token_delay per 4
+# characters, so a single call gets slower with every day while the
+# per-day calls overlap.
+#
+#   python -m bench.parallel_days --days 1 3 5 --token-delay 0.002
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["ITINERARY_CACHE_ENABLED"] = "false"
+
+from bench.fake_llm import FakeUpstream, create_app, plan_reply  # noqa: E402
+from bench.geo import synthetic_choices  # noqa: E402
+
+
+async def drive(base_url: str, days: int, parallel: bool) -> float:
+    import api.parallel
+    from api import llm
+    from api.main import app
+
+    api.parallel.ITINERARY_PARALLEL = parallel
+    body = {"city": "Tokyo", "country": "Japan", "days": days, "choices": synthetic_choices(12 * days)}
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+            started = time.perf_counter()
+            response = await client.post("/itinerary", json=body)
+            elapsed = time.perf_counter() - started
+    finally:
+        await llm.shutdown()
+    if response.status_code != 200:
+        raise SystemExit(f"/itinerary failed: {response.text}")
+    items = response.json()["itineraryItems"]
+    assert [day["day"] for day in items] == list(range(1, days + 1)), items
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="seconds per 4 characters")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # the app logs every prompt
+
+    app = create_app(latency=args.latency, reply=plan_reply, token_delay=args.token_delay)
+    with FakeUpstream(app) as upstream:
+        for days in args.days:
+            single = asyncio.run(drive(upstream.base_url, days, parallel=False))
+            fanned = asyncio.run(drive(upstream.base_url, days, parallel=True))
+            print(f"days={days} single call={single:6.2f}s per-day calls={fanned:6.2f}s speedup={single / fanned:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
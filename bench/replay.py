@@ -0,0 +1,211 @@
+# replay.py
+#
+# Replay traffic captured with CAPTURE_ENABLED=true (api/capture.py) against
+# the app. Records are sent at their original pace, sped up by --speed, or
+# as fast as --concurrency allows with --speed 0. A session's turns are
+# sent one after another under one session_id (the captured hash), so
+# multi-turn keyword conversations build up history as they did live.
+#
+# By default the app runs in-process against the fake upstream, which
+# answers keyword prompts with the model output captured for the same user
+# turn and /itinerary prompts with a canned plan over the prompt's ids;
+# --upstream-url sends the model calls to a real or other upstream instead,
+# and --app-url drives a running app. The report compares each route's
+# statuses and p50/p95/p99 latency with the captured ones.
+#
+#   CAPTURE_ENABLED=true uvicorn api.main:app    # ... some traffic later:
+#   python -m bench.replay captures/requests.*.jsonl --speed 10
+#   python -m bench.replay captures/requests.*.jsonl* --speed 0 --concurrency 50 --output replay.json
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, List
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TIMING_LOG", "false")
+os.environ.setdefault("CAPTURE_ENABLED", "false")  # do not capture the replay itself
+
+from bench.fake_llm import KEYWORD_REPLY, FakeUpstream, create_app, plan_reply  # noqa: E402
+from bench.loadtest import Recorder, _round, check_flags, percentile  # noqa: E402
+
+# Keyword prompts with no captured output, answered with KEYWORD_REPLY instead
+replay_stats = {"missing": 0}
+
+
+def load(paths: List[str]) -> List[dict]:
+    """Captured records from one or more files (all workers' and rotated ones), oldest first."""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+def sessions(records: List[dict]) -> List[List[dict]]:
+    """Group records into chains that must run in order: one per session, else one per record."""
+    chains: Dict[str, List[dict]] = {}
+    for index, record in enumerate(records):
+        body = record.get("request") if isinstance(record.get("request"), dict) else {}
+        key = body.get("session_id") or record.get("session") or f"single-{index}"
+        chains.setdefault(key, []).append(record)
+    return list(chains.values())
+
+
+def replay_body(record: dict) -> dict:
+    body = dict(record["request"]) if isinstance(record.get("request"), dict) else {}
+    if record["route"] == "/keyword-search" and not body.get("session_id") and record.get("session"):
+        body["session_id"] = f"replay-{record['session']}"
+    return body
+
+
+def captured_reply(records: List[dict]):
+    """Answer keyword prompts with what the model said to the same user turn, plans otherwise.
+
+    A turn the capture has no model output for (it was answered without the
+    model back then) gets the canned /keyword-search reply and is counted in
+    replay_stats["missing"].
+    """
+    outputs = {}
+    for record in records:
+        body = record.get("request")
+        if record["route"] == "/keyword-search" and isinstance(body, dict) and record.get("completions"):
+            outputs[body.get("input")] = record["completions"][-1].get("output") or ""
+
+    def reply(body: dict) -> str:
+        last = body["messages"][-1]["content"]
+        if "day trip" in last:
+            return plan_reply(body)
+        if last not in outputs:
+            replay_stats["missing"] += 1
+            return KEYWORD_REPLY
+        return outputs[last]
+
+    return reply
+
+
+async def replay(client: httpx.AsyncClient, records: List[dict], speed: float, concurrency: int) -> Recorder:
+    recorder = Recorder()
+    limit = asyncio.Semaphore(concurrency)
+    first = records[0]["ts"] if records else 0
+    started = time.perf_counter()
+
+    async def run(chain: List[dict]):
+        for record in chain:
+            if speed > 0:
+                await asyncio.sleep(max(0.0, started + (record["ts"] - first) / speed - time.perf_counter()))
+            async with limit:
+                sent = time.perf_counter()
+                try:
+                    response = await client.request(record.get("method") or "POST", record["route"], json=replay_body(record))
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 599
+                recorder.add(record["route"], status, time.perf_counter() - sent)
+
+    await asyncio.gather(*(run(chain) for chain in sessions(records)))
+    return recorder
+
+
+def captured_summary(records: List[dict]) -> Dict[str, dict]:
+    report = {}
+    for route in sorted({record["route"] for record in records}):
+        rows = [record for record in records if record["route"] == route]
+        ok = [record["timing"]["total_ms"] for record in rows if record["status"] == 200 and record.get("timing")]
+        statuses = {}
+        for record in rows:
+            statuses[str(record["status"])] = statuses.get(str(record["status"]), 0) + 1
+        report[route] = {
+            "requests": len(rows),
+            "statuses": dict(sorted(statuses.items())),
+            "p50_ms": _round(percentile(ok, 0.5)),
+            "p95_ms": _round(percentile(ok, 0.95)),
+            "p99_ms": _round(percentile(ok, 0.99)),
+        }
+    return report
+
+
+async def drive(args, records: List[dict], base_url: str) -> Recorder:
+    from api import llm
+
+    if args.app_url:
+        client = httpx.AsyncClient(base_url=args.app_url, timeout=args.timeout)
+    else:
+        import api.main
+        from api.main import app
+
+        check_flags(args, api.main)
+        await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app", timeout=args.timeout)
+    try:
+        async with client:
+            return await replay(client, records, args.speed, args.concurrency)
+    finally:
+        if not args.app_url:
+            await llm.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="capture files, e.g. captures/requests.*.jsonl*")
+    parser.add_argument("--speed", type=float, default=1.0, help="pace multiplier; 0 sends as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight at most")
+    parser.add_argument("--route", action="append", help="only replay these routes")
+    parser.add_argument("--limit", type=int, help="replay the first N records")
+    parser.add_argument("--ttft", type=float, default=0.3, help="fake upstream seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="fake upstream seconds per token")
+    parser.add_argument("--upstream-url", help="send model calls here instead of the fake upstream")
+    parser.add_argument("--cache", action="store_true", help="keep the itinerary cache on")
+    parser.add_argument("--admission", action="store_true", help="keep admission control on (one client sends everything)")
+    parser.add_argument("--app-url", help="drive a running app instead of one in-process")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    # Read by api.main at import time, so set before drive() imports it
+    os.environ["ITINERARY_CACHE_ENABLED"] = "true" if args.cache else "false"
+    os.environ["ADMISSION_ENABLED"] = "true" if args.admission else "false"
+
+    records = [record for record in load(args.paths) if not args.route or record["route"] in args.route]
+    records = records[:args.limit] if args.limit else records
+    if not records:
+        raise SystemExit("nothing to replay")
+    logging.disable(logging.ERROR)
+
+    started = time.perf_counter()
+    if args.upstream_url or args.app_url:
+        recorder = asyncio.run(drive(args, records, args.upstream_url))
+    else:
+        app = create_app(latency=args.ttft, token_delay=args.token_delay, reply=captured_reply(records))
+        with FakeUpstream(app) as upstream:
+            recorder = asyncio.run(drive(args, records, upstream.base_url))
+    elapsed = time.perf_counter() - started
+
+    report = {"records": len(records), "seconds": round(elapsed, 2), "replayed": recorder.summary(),
+              "captured": captured_summary(records), "missing_outputs": replay_stats["missing"]}
+    print(f"replayed {len(records)} requests in {elapsed:.1f}s at speed {args.speed or 'max'}")
+    if replay_stats["missing"]:
+        print(f"  {replay_stats['missing']} keyword model calls had no captured output and got a canned reply")
+    for route, row in report["replayed"].items():
+        before = report["captured"].get(route, {})
+        print(
+            f"  {route:<16} statuses={row['statuses']} (captured {before.get('statuses')})\n"
+            f"  {'':<16} p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms "
+            f"(captured p50={before.get('p50_ms')}ms p95={before.get('p95_ms')}ms p99={before.get('p99_ms')}ms)"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# resilience.py
+#
+# Failure handling of upstream calls against a fake upstream that can be
+# made flaky or taken down mid-run. Retries should hide most of a 20% 503
+# rate, an outage should open the breaker so calls fail fast instead of
+# waiting on (and adding load to) a dead upstream, retries should stay
+# within the budget, the breaker should close again once a probe succeeds,
+# and a call's timeout should bound all of its attempts together.
+#
+#   python -m bench.resilience --calls 200
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("LLM_BACKOFF_BASE", "0.02")
+os.environ.setdefault("LLM_BACKOFF_MAX", "0.2")
+os.environ.setdefault("LLM_BREAKER_RESET", "1")
+
+import openai  # noqa: E402
+
+from api import llm  # noqa: E402
+from api.resilience import (  # noqa: E402
+    LLM_BREAKER_RESET, LLM_RETRY_BUDGET_RATIO, LLM_RETRY_TIMEOUTS, CircuitOpenError, resilience_stats,
+)
+from bench.fake_llm import FakeUpstream, create_app  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+async def run_calls(base_url: str, calls: int, concurrency: int, timeout: float = 5.0):
+    """Send ``calls`` completions; returns (errors by type, seconds per call)."""
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    errors, durations = {}, []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await llm.chat_completion("gpt-4o", MESSAGES, timeout=timeout)
+            except openai.APIError as err:
+                errors[type(err).__name__] = errors.get(type(err).__name__, 0) + 1
+            durations.append(time.perf_counter() - started)
+
+    try:
+        await asyncio.gather(*(one() for _ in range(calls)))
+        return errors, durations
+    finally:
+        await llm.shutdown()
+
+
+def reset_stats():
+    for key in resilience_stats:
+        resilience_stats[key] = 0
+
+
+def flaky(app, base_url, calls, retries):
+    import api.router
+
+    reset_stats()
+    api.router.LLM_RETRIES = retries
+    app.state.fail_rate, app.state.requests = 0.2, 0
+    errors, _ = asyncio.run(run_calls(base_url, calls, concurrency=10))
+    app.state.fail_rate = 0.0
+    failed = sum(errors.values())
+    print(
+        f"flaky 20% 503, retries={retries}: failed={failed}/{calls} upstream={app.state.requests} "
+        f"retried={resilience_stats['retries']} denied={resilience_stats['retries_denied']}"
+    )
+    return failed
+
+
+async def outage_and_recovery(app, base_url, calls):
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    try:
+        app.state.fail_rate, app.state.requests = 1.0, 0
+        fast = []
+        for _ in range(calls):
+            started = time.perf_counter()
+            try:
+                await llm.chat_completion("gpt-4o", MESSAGES, timeout=5)
+            except CircuitOpenError as err:
+                fast.append(time.perf_counter() - started)
+                assert 0 < err.retry_after <= LLM_BREAKER_RESET, err.retry_after
+            except openai.APIError:
+                pass
+        breaker = llm.provider_stats()["openai:gpt-4o"]
+        print(
+            f"outage: {calls} calls, upstream={app.state.requests}, fast failures={len(fast)} "
+            f"(p50 {sorted(fast)[len(fast) // 2] * 1000:.2f} ms), breaker={breaker['breaker']}"
+        )
+        assert breaker["breaker"] == "open" and breaker["breaker_opens"] == 1, breaker
+        assert len(fast) >= calls - 10, "calls kept reaching a dead upstream"
+        # The call that opened the breaker fails fast only after its backoff sleep.
+        assert sorted(fast)[len(fast) // 2] < 0.005, "fast failures were not fast"
+
+        app.state.fail_rate = 0.0
+        await asyncio.sleep(LLM_BREAKER_RESET)
+        await llm.chat_completion("gpt-4o", MESSAGES, timeout=5)
+        breaker = llm.provider_stats()["openai:gpt-4o"]
+        print(f"recovery: probe succeeded, breaker={breaker['breaker']}")
+        assert breaker["breaker"] == "closed", breaker
+        return app.state.requests
+    finally:
+        await llm.shutdown()
+
+
+async def deadline(base_url):
+    """A slow upstream: the timeout covers every attempt, not each one."""
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    try:
+        started = time.perf_counter()
+        try:
+            await llm.chat_completion("gpt-4o", MESSAGES, timeout=0.3)
+        except openai.APITimeoutError:
+            pass
+        return time.perf_counter() - started
+    finally:
+        await llm.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    app = create_app(latency=0.01, seed=1)
+    with FakeUpstream(app) as upstream:
+        without = flaky(app, upstream.base_url, args.calls, retries=0)
+        with_retries = flaky(app, upstream.base_url, args.calls, retries=2)
+        assert with_retries < without / 4, (without, with_retries)
+        assert resilience_stats["retries"] <= 5 + LLM_RETRY_BUDGET_RATIO * args.calls + 1, resilience_stats
+
+        reset_stats()
+        upstream_calls = asyncio.run(outage_and_recovery(app, upstream.base_url, args.calls))
+        # Before the breaker opened: a few calls, each retried at most within the budget.
+        assert upstream_calls < 20, upstream_calls
+        print(f"  stats: {resilience_stats}")
+
+    slow = create_app(latency=2.0)
+    with FakeUpstream(slow, port=8766) as upstream:
+        elapsed = asyncio.run(deadline(upstream.base_url))
+        print(f"deadline: 0.3 s timeout on a 2 s upstream gave up after {elapsed:.2f} s, {slow.state.requests} call(s)")
+        assert elapsed < 0.6, elapsed
+        if not LLM_RETRY_TIMEOUTS:
+            # A timed-out completion may still be generated and billed upstream: not retried by default.
+            assert slow.state.requests == 1, slow.state.requests
+    print("ok: retries hide transient errors, outages fail fast, timeouts bound all attempts")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as err:
+        sys.exit(f"FAILED: {err}")
@@ -0,0 +1,149 @@
+# router.py
+#
+# Exercise the provider router with in-process fake providers: routing should
+# settle on the faster healthy provider, move away from one that starts
+# failing, and hedging should cut the tail latency of a provider with
+# occasional slow calls.
+#
+#   python -m bench.router --calls 400
+
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from api.providers import Provider, ProviderError
+from api.router import Router
+
+
+class FakeProvider(Provider):
+    """Answers after a log-normal delay; ``slow_rate`` calls take ``slow_factor`` times longer."""
+
+    def __init__(self, name, median, sigma=0.2, error_rate=0.0, slow_rate=0.0, slow_factor=10.0, seed=0):
+        self.name = name
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    async def complete(self, model, messages, timeout, **kwargs):
+        self.calls += 1
+        delay = self.rng.lognormvariate(0, self.sigma) * self.median
+        if self.rng.random() < self.slow_rate:
+            delay *= self.slow_factor
+        await asyncio.sleep(delay)
+        if self.rng.random() < self.error_rate:
+            raise ProviderError(self.name, "fake upstream error")
+        message = SimpleNamespace(content=f"{self.name}:{model}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    async def stream(self, model, messages, timeout, **kwargs):
+        await asyncio.sleep(self.median)
+        for word in ("hello", " from ", self.name):
+            yield word
+
+
+ROUTES = {"gpt-4o": ["openai:gpt-4o", "mistral:mistral-large-latest"]}
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def drive(router, calls, concurrency):
+    latencies, errors, served = [], 0, {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await router.complete("gpt-4o", MESSAGES, timeout=5)
+            except ProviderError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            name = response.choices[0].message.content.split(":")[0]
+            served[name] = served.get(name, 0) + 1
+
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return latencies, errors, served
+
+
+def report(label, latencies, errors, served):
+    print(
+        f"{label:<24} p50={percentile(latencies, 0.5) * 1000:6.1f}ms "
+        f"p95={percentile(latencies, 0.95) * 1000:6.1f}ms p99={percentile(latencies, 0.99) * 1000:6.1f}ms "
+        f"errors={errors} served={served}"
+    )
+
+
+async def run(calls, concurrency):
+    # Latency-aware selection: the faster provider should get most calls.
+    router = Router(
+        [FakeProvider("openai", 0.04, seed=1), FakeProvider("mistral", 0.02, seed=2)],
+        ROUTES,
+        hedge=False,
+        rng=random.Random(0),
+    )
+    latencies, errors, served = await drive(router, calls, concurrency)
+    report("fastest-first", latencies, errors, served)
+    assert served.get("mistral", 0) > 0.8 * calls, served
+
+    # A failing provider is demoted once its error rate passes the threshold.
+    router = Router(
+        [FakeProvider("openai", 0.04, seed=1), FakeProvider("mistral", 0.02, error_rate=0.9, seed=2)],
+        ROUTES,
+        hedge=False,
+        rng=random.Random(0),
+    )
+    latencies, errors, served = await drive(router, calls, concurrency)
+    report("failing provider", latencies, errors, served)
+    assert served.get("openai", 0) > 0.8 * calls, served
+
+    # Hedging: the primary has a 3% slow tail; the backup is slower but steady.
+    tails = {}
+    for hedge in (False, True):
+        router = Router(
+            [
+                FakeProvider("openai", 0.02, slow_rate=0.03, slow_factor=15, seed=3),
+                FakeProvider("mistral", 0.03, seed=4),
+            ],
+            ROUTES,
+            hedge=hedge,
+            hedge_min_delay=0.0,
+            rng=random.Random(0),
+        )
+        # Warm both options so the router knows the primary's p95.
+        await drive(router, 20, 1)
+        latencies, errors, served = await drive(router, calls, concurrency)
+        report(f"hedge={'on' if hedge else 'off'}", latencies, errors, served)
+        tails[hedge] = percentile(latencies, 0.99)
+        if hedge:
+            print(f"  stats: {router.snapshot()}")
+    assert tails[True] < tails[False], tails
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(run(args.calls, args.concurrency))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as err:
+        sys.exit(f"FAILED: {err}")
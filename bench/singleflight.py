@@ -0,0 +1,111 @@
+# singleflight.py
+#
+# Check request coalescing: N identical concurrent /itinerary or first-turn
+# /keyword-search requests should reach the fake upstream once, errors
+# should reach every waiter, and a cancelled waiter must not cancel the
+# call for the others.
+#
+#   python -m bench.singleflight --concurrency 50
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["ITINERARY_CACHE_ENABLED"] = "false"
+
+from api.singleflight import SingleFlight  # noqa: E402
+from bench.fake_llm import KEYWORD_REPLY, FakeUpstream, create_app, plan_reply  # noqa: E402
+
+upstream_calls = {"count": 0}
+
+
+def counting_reply(body: dict) -> str:
+    upstream_calls["count"] += 1
+    if "This is" in body["messages"][-1]["content"]:
+        return plan_reply(body)
+    return KEYWORD_REPLY
+
+
+async def check_endpoints(base_url: str, concurrency: int):
+    from api import llm
+    from api.main import app
+
+    choices = [
+        {"data_id": f"p{i}", "category": c, "title": f"Place {i}"}
+        for i, c in enumerate(["Activity", "Lunch", "Activity", "Dinner"] * 3)
+    ]
+    trip = {"city": "Tokyo", "country": "Japan", "days": 1, "choices": choices}
+    keyword = {"input": "2 days in Tokyo, I love ramen and museums"}
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+            for path, body in (("/itinerary", trip), ("/keyword-search", keyword)):
+                upstream_calls["count"] = 0
+                responses = await asyncio.gather(*(client.post(path, json=body) for _ in range(concurrency)))
+                assert all(r.status_code == 200 for r in responses), responses[0].text
+                assert len({r.text for r in responses}) == 1, "coalesced requests got different answers"
+                print(f"{path}: {concurrency} requests -> {upstream_calls['count']} upstream call(s)")
+                assert upstream_calls["count"] == 1
+    finally:
+        await llm.shutdown()
+
+
+async def check_semantics():
+    flights = SingleFlight("check")
+    started = asyncio.Event()
+
+    async def slow(value):
+        started.set()
+        await asyncio.sleep(0.05)
+        return value
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    # Errors reach every waiter.
+    results = await asyncio.gather(*(flights.run("err", failing) for _ in range(5)), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results), results
+
+    # A cancelled waiter leaves the shared call running for the others.
+    first = asyncio.ensure_future(flights.run("k", lambda: slow("ok")))
+    await started.wait()
+    second = asyncio.ensure_future(flights.run("k", lambda: slow("other")))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert (await second) == ("ok", True)
+
+    # When every waiter is gone the shared call is cancelled as well.
+    started.clear()
+    only = asyncio.ensure_future(flights.run("gone", lambda: slow("x")))
+    await started.wait()
+    only.cancel()
+    await asyncio.gather(only, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert len(flights) == 0 and flights.stats["cancelled"] == 1, flights.stats
+    print(f"error/cancel semantics ok: {flights.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.3)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    asyncio.run(check_semantics())
+    with FakeUpstream(create_app(latency=args.latency, reply=counting_reply)) as upstream:
+        asyncio.run(check_endpoints(upstream.base_url, args.concurrency))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as err:
+        sys.exit(f"FAILED: {err}")
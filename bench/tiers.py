@@ -0,0 +1,109 @@
+# tiers.py
+#
+# Latency and token usage of the /itinerary detail tiers. The fake upstream
+# follows the slot and note limits it finds in the prompt and gives each
+# model its own speed, so the numbers show what each tier saves in prompt
+# size, output size and time.
+#
+#   python -m bench.tiers --days 1 3 --requests 3
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["ITINERARY_CACHE_ENABLED"] = "false"
+os.environ.setdefault("ITINERARY_OUTPUT", "minimal")  # tier_reply answers in the minimal schema
+
+from bench.fake_llm import FakeUpstream, create_app  # noqa: E402
+from bench.geo import synthetic_choices  # noqa: E402
+
+# (seconds to first token, seconds per 4 characters) per model
+MODEL_SPEED = {"gpt-4o": (0.5, 0.004), "gpt-4o-mini": (0.25, 0.0015)}
+DEFAULT_SLOTS = 6
+WORDS = "this place is a good fit for the day and close to the next stop".split()
+
+
+def tier_reply(body: dict) -> str:
+    """A minimal-schema plan that honours the prompt's slot and note limits."""
+    system, prompt = body["messages"][0]["content"], body["messages"][-1]["content"]
+    ids = re.findall(r"^(c\d+)\|", prompt, re.MULTILINE)
+    limit = re.search(r"slots of each day to (\d+)", system)
+    per_day = int(limit.group(1)) if limit else DEFAULT_SLOTS
+    words = re.search(r"note is optional: at most (\d+) words", system)
+    note = " ".join(WORDS[: int(words.group(1))]) if words else None
+    single = re.search(r"This is day (\d+) of", prompt)
+    numbers = [int(single.group(1))] if single else range(1, int(re.search(r"(\d+) day trip", prompt).group(1)) + 1)
+    days = []
+    for offset, number in enumerate(numbers):
+        slots = []
+        for index in range(per_day):
+            hour = 9 + 2 * index
+            slot = [ids[(offset * per_day + index) % len(ids)],
+                    f"{hour % 12 or 12:02d}:00 {'AM' if hour < 12 else 'PM'}",
+                    f"{(hour + 1) % 12 or 12:02d}:30 {'AM' if hour + 1 < 12 else 'PM'}"]
+            slots.append(slot + [note] if note else slot)
+        days.append({"day": number, "date": f"2024-10-{number:02d}", "language": "English", "slots": slots})
+    return "```json\n" + json.dumps({"days": days}) + "\n```"
+
+
+async def drive(base_url: str, days: int, detail: str, requests: int) -> list:
+    from api import llm
+    from api.main import app
+
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    sizes = []
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+            for seed in range(requests):
+                body = {
+                    "city": "Tokyo", "country": "Japan", "days": days, "detail": detail,
+                    "choices": synthetic_choices(12 * days, seed=seed),
+                }
+                response = await client.post("/itinerary", json=body)
+                if response.status_code != 200:
+                    raise SystemExit(f"/itinerary ({detail}) failed: {response.text}")
+                sizes.append(len(response.content))
+    finally:
+        await llm.shutdown()
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--requests", type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    from api.tiers import TIERS, tier_report, tier_stats
+
+    app = create_app(
+        latency=lambda body: MODEL_SPEED.get(body["model"], MODEL_SPEED["gpt-4o"])[0],
+        token_delay=lambda body: MODEL_SPEED.get(body["model"], MODEL_SPEED["gpt-4o"])[1],
+        reply=tier_reply,
+    )
+    with FakeUpstream(app) as upstream:
+        for days in args.days:
+            for detail in TIERS:
+                for stats in tier_stats.values():
+                    stats.update(requests=0, errors=0, total_ms=0.0, prompt_tokens=0, completion_tokens=0)
+                started = time.perf_counter()
+                sizes = asyncio.run(drive(upstream.base_url, days, detail, args.requests))
+                row = tier_report()[detail]
+                print(
+                    f"days={days} detail={detail:<5} model={row['model']:<12} mean={row['mean_ms']:7.1f}ms "
+                    f"prompt={row['mean_prompt_tokens']:6.0f} completion={row['mean_completion_tokens']:5.0f} tokens "
+                    f"response={sum(sizes) // len(sizes):6d}B wall={time.perf_counter() - started:5.2f}s"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# timing.py
+#
+# Check per-request phase timing end to end: /keyword-search and /itinerary
+# (one call and one call per day) against the fake upstream must return a
+# Server-Timing header with the pipeline's phases, echo the request ID and
+# stamp it on the log lines written while the request ran; overlapping
+# per-day upstream calls must count once, not once per day; and with
+# PROFILE_EVERY=1 each request must leave a readable cProfile dump.
+#
+#   python -m bench.timing
+
+import asyncio
+import logging
+import os
+import pstats
+import re
+import sys
+import tempfile
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["ITINERARY_CACHE_ENABLED"] = "false"
+os.environ["ITINERARY_PARALLEL"] = "true"
+os.environ["PROFILE_EVERY"] = "1"
+os.environ["PROFILE_DIR"] = tempfile.mkdtemp(prefix="profiles-")
+
+from bench.fake_llm import KEYWORD_REPLY, FakeUpstream, create_app, plan_reply  # noqa: E402
+from bench.geo import synthetic_choices  # noqa: E402
+
+LATENCY = 0.2
+
+
+def reply(body: dict) -> str:
+    return plan_reply(body) if "day trip" in body["messages"][-1]["content"] else KEYWORD_REPLY
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((getattr(record, "request_id", None), record.getMessage()))
+
+
+def phases(header: str) -> dict:
+    return {name: float(ms) for name, ms in re.findall(r"(\w+);dur=([0-9.]+)", header)}
+
+
+async def drive(base_url: str) -> dict:
+    from api import llm
+    from api.main import app
+
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    responses = {}
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=60) as client:
+            responses["keyword"] = await client.post(
+                "/keyword-search", json={"input": "temples and food"}, headers={"X-Request-ID": "kw-1"}
+            )
+            for days in (1, 3):
+                body = {"city": "Kyoto", "country": "Japan", "days": days, "choices": synthetic_choices(12 * days)}
+                responses[f"itinerary-{days}"] = await client.post("/itinerary", json=body)
+    finally:
+        await llm.shutdown()
+    return responses
+
+
+def main():
+    from api import timing
+
+    capture = Capture()
+    capture.addFilter(timing.RequestIdFilter())
+    logging.getLogger().addHandler(capture)
+    logging.getLogger().setLevel(logging.INFO)  # basicConfig in api.main is a no-op once a handler exists
+
+    with FakeUpstream(create_app(latency=LATENCY, reply=reply)) as upstream:
+        responses = asyncio.run(drive(upstream.base_url))
+
+    for name, response in responses.items():
+        assert response.status_code == 200, (name, response.text)
+        header = response.headers.get("server-timing")
+        print(f"{name:<12} id={response.headers.get('x-request-id')} server-timing: {header}")
+        found = phases(header)
+        for expected in ("validate", "upstream", "prompt", "extract", "total"):
+            assert expected in found, (name, expected, header)
+        assert found["upstream"] <= found["total"], header
+
+    keyword = responses["keyword"]
+    assert keyword.headers["x-request-id"] == "kw-1"
+    assert "history" in phases(keyword.headers["server-timing"])
+    assert any(rid == "kw-1" and "Calling OpenAI API" in message for rid, message in capture.records)
+    assert any(rid == "kw-1" and message.startswith("Request timing:") for rid, message in capture.records)
+
+    # Three overlapping day calls: upstream counts the wall time once, not three latencies.
+    multi = phases(responses["itinerary-3"].headers["server-timing"])
+    assert multi["upstream"] < 2 * LATENCY * 1000, multi
+
+    dumps = sorted(os.listdir(os.environ["PROFILE_DIR"]))
+    assert len(dumps) == len(responses), dumps
+    stats = pstats.Stats(os.path.join(os.environ["PROFILE_DIR"], dumps[-1]))
+    assert stats.total_calls > 0
+    print(f"ok: {len(dumps)} profiles in {os.environ['PROFILE_DIR']}, e.g. {dumps[-1]}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as err:
+        sys.exit(f"FAILED: {err}")
@@ -0,0 +1,9 @@
+# conftest.py
+#
+# Tests that import api.main need an API key, and must not share the
+# on-disk itinerary cache of a local dev server.
+
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ITINERARY_CACHE_ENABLED", "false")
@@ -0,0 +1,118 @@
+# test_admission.py
+#
+# Upstream admission control: token buckets refill at their per-minute rate
+# up to the burst, calls that would wait too long are refused with a retry
+# hint, queued calls are admitted by priority, a session cannot hold more
+# than its share, and the endpoints turn a refusal into 429 + Retry-After.
+
+import asyncio
+
+import httpx
+import pytest
+
+from api.admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_bucket_refills_up_to_its_burst():
+    clock = Clock()
+    bucket = TokenBucket(per_minute=60, burst_seconds=10, clock=clock)  # 1 per second, 10 at once
+    assert bucket.capacity == 10
+    bucket.take(10)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.now += 4
+    assert bucket.wait_time(4) == 0
+    assert bucket.wait_time(5) == pytest.approx(1.0)
+    clock.now += 60
+    assert bucket.level <= bucket.capacity
+    assert bucket.wait_time(10) == 0
+
+
+def test_bucket_counts_oversized_amounts_as_full():
+    bucket = TokenBucket(per_minute=60, burst_seconds=10, clock=Clock())
+    assert bucket.wait_time(50) == 0  # one huge prompt is not refused forever
+    assert bucket.backlog_time(50) == pytest.approx(40.0)
+
+
+def test_call_over_the_budget_is_refused_with_a_retry_hint():
+    async def scenario():
+        admission = AdmissionController(rpm=60, tpm=600, burst_seconds=1, max_waits={"keyword": 5})
+        async with admission.admit("keyword", 10):
+            pass
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("keyword", 600)  # a minute of tokens, 5 s allowed
+        assert rejected.value.reason == "budget"
+        assert rejected.value.retry_after > 5
+        assert int(rejected.value.retry_after_header) >= 6
+        assert admission.snapshot()["keyword"]["rejected"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_queued_calls_are_admitted_by_priority():
+    async def scenario():
+        admission = AdmissionController(rpm=600, burst_seconds=0.1)  # one call now, then one per 0.1 s
+        order = []
+
+        async def call(kind):
+            async with admission.admit(kind, 1):
+                order.append(kind)
+
+        await call("batch")  # spends the burst
+        waiting = [asyncio.ensure_future(call(kind)) for kind in ("batch", "itinerary", "keyword")]
+        await asyncio.gather(*waiting)
+        assert order == ["batch", "keyword", "itinerary", "batch"]
+        assert admission.snapshot()["keyword"]["queued"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_session_share_is_limited_and_released():
+    async def scenario():
+        admission = AdmissionController(session_limit=2)
+        first = await admission.acquire("itinerary", 1, "alice")
+        second = await admission.acquire("itinerary", 1, "alice")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("itinerary", 1, "alice")
+        assert rejected.value.reason == "session"
+        assert await admission.acquire("itinerary", 1, "bob") is not None
+        admission.release(first)
+        admission.release(first)  # releasing twice is harmless
+        assert await admission.acquire("itinerary", 1, "alice") is not None
+        admission.release(second)
+
+    asyncio.run(scenario())
+
+
+def test_disabled_controller_admits_everything():
+    async def scenario():
+        admission = AdmissionController(rpm=1, tpm=1, enabled=False)
+        for _ in range(10):
+            assert await admission.acquire("batch", 10_000) is None
+
+    asyncio.run(scenario())
+
+
+def test_endpoint_answers_429_with_retry_after(monkeypatch):
+    import api.main as main
+
+    monkeypatch.setattr(main, "admission", AdmissionController(session_limit=0, enabled=True))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://app", cookies={"session_id": "s1"}
+        ) as client:
+            # Not answerable by the fast path, so it needs an upstream call
+            return await client.post("/keyword-search", json={"input": "somewhere warm with good food"})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,126 @@
+# test_capture.py
+#
+# Traffic capture for replay: records are written as JSON lines by the
+# background writer with contact details masked and session IDs hashed, a
+# full queue drops records instead of blocking, files rotate by size, and
+# the middleware records the request body, status, session and the model
+# calls made while handling it.
+
+import asyncio
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI, Response
+
+from api import capture
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(capture, "capture_stats", dict.fromkeys(capture.capture_stats, 0))
+    monkeypatch.setattr(capture, "_redactors", [capture.redact_free_text])
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def item(body: dict, session="s1") -> dict:
+    return {"route": "/keyword-search", "session": session, "completions": [], "body": json.dumps(body).encode()}
+
+
+def test_records_are_written_redacted(tmp_path):
+    writer = capture.CaptureWriter(str(tmp_path / "requests.jsonl"), flush_seconds=0.01)
+    assert writer.path == str(tmp_path / f"requests.{os.getpid()}.jsonl")
+    writer.submit(item({"input": "Mail me at ann@example.com or +1 (555) 123-4567, 3 days in Tokyo"}))
+    writer.submit({"route": "/itinerary", "session": None, "completions": [], "body": b"not json"})
+    writer.close()
+    first, second = read_records(writer.path)
+    assert first["request"]["input"] == "Mail me at <email> or <phone>, 3 days in Tokyo"
+    assert first["session"] == capture.hash_session("s1") != "s1"
+    assert second["request"] == "not json" and second["session"] is None
+    assert capture.capture_stats["written"] == 2
+    assert not writer.submit(item({}))  # closed
+
+
+def test_redactor_can_drop_records(tmp_path):
+    capture.add_redactor(lambda record: None if record["route"] == "/itinerary" else record)
+    writer = capture.CaptureWriter(str(tmp_path / "requests.jsonl"), flush_seconds=0.01)
+    writer.submit(item({"input": "kept"}))
+    writer.submit({"route": "/itinerary", "session": None, "completions": [], "body": b"{}"})
+    writer.close()
+    assert [record["route"] for record in read_records(writer.path)] == ["/keyword-search"]
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    entered, release = threading.Event(), threading.Event()
+
+    def stall(record):
+        entered.set()
+        release.wait()
+        return record
+
+    capture.add_redactor(stall)
+    writer = capture.CaptureWriter(str(tmp_path / "requests.jsonl"), queue_size=1, batch=1, flush_seconds=0.01)
+    assert writer.submit(item({"input": "1"}))
+    entered.wait(5)  # the writer thread holds record 1
+    assert writer.submit(item({"input": "2"}))  # fills the queue
+    assert not writer.submit(item({"input": "3"}))
+    release.set()
+    writer.close()
+    assert capture.capture_stats["dropped"] == 1
+    assert len(read_records(writer.path)) == 2
+
+
+def test_files_rotate_by_size(tmp_path):
+    writer = capture.CaptureWriter(str(tmp_path / "requests.jsonl"), max_bytes=200, backups=2, batch=1, flush_seconds=0.01)
+    for index in range(10):
+        writer.submit(item({"input": "x" * 100 + str(index)}))
+    writer.close()
+    assert os.path.exists(f"{writer.path}.1") and os.path.exists(f"{writer.path}.2")
+    assert not os.path.exists(f"{writer.path}.3")
+    assert capture.capture_stats["rotations"] >= 2
+    assert read_records(writer.path)[-1]["request"]["input"].endswith("9")
+
+
+def test_middleware_records_the_request_and_its_model_calls(tmp_path):
+    writer = capture.CaptureWriter(str(tmp_path / "requests.jsonl"), flush_seconds=0.01)
+    app = FastAPI()
+
+    @app.post("/keyword-search")
+    async def keyword(data: dict, response: Response):
+        reply = SimpleNamespace(
+            usage=SimpleNamespace(prompt_tokens=12, completion_tokens=5),
+            choices=[SimpleNamespace(message=SimpleNamespace(content='{"city": "Tokyo"}'))],
+        )
+        capture.record_completion("gpt-4o", [{"role": "user", "content": "3 days in Tokyo"}], reply, 250.0)
+        response.set_cookie(key="session_id", value="new-session")
+        return {"city": "Tokyo"}
+
+    @app.post("/other")
+    async def other():
+        return {}
+
+    app.add_middleware(capture.CaptureMiddleware, writer=writer, routes=["/keyword-search"])
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+            await client.post("/keyword-search", json={"input": "3 days in Tokyo"})
+            await client.post("/other", json={})
+
+    asyncio.run(scenario())
+    writer.close()
+    (record,) = read_records(writer.path)
+    assert record["route"] == "/keyword-search" and record["status"] == 200
+    assert record["request"] == {"input": "3 days in Tokyo"}
+    assert record["session"] == capture.hash_session("new-session")
+    assert record["completions"] == [{
+        "model": "gpt-4o", "prompt_chars": 15, "prompt_tokens": 12, "completion_tokens": 5,
+        "output": '{"city": "Tokyo"}', "ms": 250.0,
+    }]
+    assert record["response_bytes"] > 0
@@ -0,0 +1,71 @@
+# test_compaction.py
+#
+# Keyword-search history compaction: turns older than the last keep_turns
+# are folded into one facts message (travel fields from the assistant's JSON
+# replies, snippets of the user's messages), the system prompt always
+# survives, facts carry over from earlier compactions, and a history over the
+# token budget sheds snippets and then raw turns.
+
+from api.compaction import FACTS_PREFIX, compact_history, count_tokens, facts_from_reply
+
+SYSTEM = {"role": "system", "content": "You extract travel plans as JSON."}
+
+
+def user(text: str) -> dict:
+    return {"role": "user", "content": text}
+
+
+def reply(fields: str) -> dict:
+    return {"role": "assistant", "content": "```json\n{" + fields + "}\n```"}
+
+
+def facts_of(messages):
+    facts = [m for m in messages if m["content"].startswith(FACTS_PREFIX)]
+    assert len(facts) <= 1
+    return facts[0]["content"] if facts else ""
+
+
+def test_short_history_is_unchanged():
+    history = [SYSTEM, user("Kyoto for two days"), reply('"city": "Kyoto", "days": 2')]
+    messages, before, after = compact_history(history, keep_turns=6)
+    assert messages == history
+    assert before == after == count_tokens(history)
+
+
+def test_old_turns_become_facts():
+    history = [
+        SYSTEM,
+        user("Kyoto for two days"), reply('"city": "Kyoto", "days": 2'),
+        user("Make it three"), reply('"city": "Kyoto", "days": 3'),
+        user("I like temples"),
+    ]
+    messages, _, _ = compact_history(history, keep_turns=1)
+    assert messages[0] == SYSTEM
+    assert messages[-1] == user("I like temples")
+    facts = facts_of(messages)
+    assert '"city":"Kyoto"' in facts and '"days":3' in facts  # the later reply wins
+    assert "Make it three" in facts
+
+
+def test_facts_carry_over_between_compactions():
+    first, _, _ = compact_history(
+        [SYSTEM, user("Osaka please"), reply('"city": "Osaka"'), user("and food")], keep_turns=1
+    )
+    second, _, _ = compact_history(first + [reply('"days": 4'), user("thanks")], keep_turns=1)
+    facts = facts_of(second)
+    assert '"city":"Osaka"' in facts and '"days":4' in facts
+
+
+def test_over_budget_history_sheds_snippets_then_turns():
+    history = [SYSTEM] + [user(f"message {index} " + "x" * 400) for index in range(10)]
+    messages, before, after = compact_history(history, keep_turns=4, token_budget=150)
+    assert after < before
+    assert messages[0] == SYSTEM
+    assert messages[-1] == history[-1]  # the latest turn is never dropped
+    assert "earlier_user_messages" not in facts_of(messages)
+
+
+def test_facts_from_reply_keeps_only_travel_fields():
+    facts = facts_from_reply('```json\n{"city": "Nara", "mood": "happy", "language": ""}\n```')
+    assert facts == {"city": "Nara"}
+    assert facts_from_reply("No JSON here") == {}
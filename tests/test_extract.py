@@ -0,0 +1,147 @@
+# test_extract.py
+#
+# Model replies that the old ```json\n({.*?})\n``` regex mishandled, with the
+# object the extractor is expected to recover, one shot and streamed.
+
+import json
+
+import pytest
+
+from api.extract import JsonExtractor, extract_json
+
+SLOT = {
+    "data_id": "ChIJ51cu8IcbXWARiRtXIothAS4",
+    "location": "Senso-ji",
+    "time": {"startTime": "09:00 AM", "endTime": "10:30 AM"},
+    "description": "Tokyo's oldest temple.",
+    "language": "English",
+}
+ITINERARY = {"itineraryItems": [{"day": 1, "dates": "2024-10-01", "city": "Tokyo", "image": "", "slots": [SLOT]}]}
+KEYWORDS = {"city": "Kyoto", "country": "Japan", "countryCode": "jp", "days": 2, "language": "English"}
+
+CORPUS = [
+    (
+        "fenced",
+        '```json\n{"city": "Kyoto", "country": "Japan", "countryCode": "jp", "days": 2, "language": "English"}\n```',
+        KEYWORDS,
+    ),
+    (
+        "no newline after fence",
+        '```json{"city": "Kyoto", "country": "Japan", "countryCode": "jp", "days": 2, "language": "English"}```',
+        KEYWORDS,
+    ),
+    (
+        "no fence with prose",
+        'Great, here is what I found: {"city": "Kyoto", "country": "Japan", "countryCode": "jp", '
+        '"days": 2, "language": "English"} Let me know if anything is off!',
+        KEYWORDS,
+    ),
+    (
+        "unclosed fence",
+        '```json\n{"city": "Kyoto", "country": "Japan", "countryCode": "jp", "days": 2, "language": "English"}',
+        KEYWORDS,
+    ),
+    (
+        "doubled braces from the prompt template",
+        '```json\n{{\n  "city": "Kyoto",\n  "country": "Japan",\n  "countryCode": "jp",\n  "days": 2,\n'
+        '  "language": "English"\n}}\n```',
+        KEYWORDS,
+    ),
+    (
+        "trailing commas",
+        '```json\n{\n  "city": "Kyoto",\n  "country": "Japan",\n  "countryCode": "jp",\n  "days": 2,\n'
+        '  "language": "English",\n}\n```',
+        KEYWORDS,
+    ),
+    (
+        "python literals",
+        '```json\n{"city": "Kyoto", "country": "Japan", "countryCode": "jp", "days": 2, "language": "English", '
+        '"end_location": None}\n```',
+        dict(KEYWORDS, end_location=None),
+    ),
+    (
+        "comment lines",
+        '```json\n{\n  "city": "Kyoto", // inferred from the message\n  "country": "Japan",\n'
+        '  "countryCode": "jp",\n  "days": 2,\n  "language": "English"\n}\n```',
+        KEYWORDS,
+    ),
+    (
+        "raw newline inside a string",
+        '```json\n{"itineraryItems": [{"day": 1, "dates": "2024-10-01", "city": "Tokyo", "image": "", '
+        '"slots": [{"data_id": "ChIJ51cu8IcbXWARiRtXIothAS4", "location": "Senso-ji", '
+        '"time": {"startTime": "09:00 AM", "endTime": "10:30 AM"}, '
+        '"description": "Tokyo\'s oldest\ntemple.", "language": "English"}]}]}\n```',
+        {"itineraryItems": [dict(ITINERARY["itineraryItems"][0], slots=[dict(SLOT, description="Tokyo's oldest\ntemple.")])]},
+    ),
+    (
+        "doubled braces in a nested itinerary with trailing commas",
+        '```json\n{{\n "itineraryItems": [\n  {{\n   "day": 1,\n   "dates": "2024-10-01",\n   "city": "Tokyo",\n'
+        '   "image": "",\n   "slots": [\n    {{\n     "data_id": "ChIJ51cu8IcbXWARiRtXIothAS4",\n'
+        '     "location": "Senso-ji",\n     "time": {{\n      "startTime": "09:00 AM",\n'
+        '      "endTime": "10:30 AM"\n     }},\n     "description": "Tokyo\'s oldest temple.",\n'
+        '     "language": "English",\n    }},\n   ]\n  }}\n ]\n}}\n```',
+        ITINERARY,
+    ),
+    (
+        "cut off by max_tokens",
+        '```json\n{"itineraryItems": [{"day": 1, "dates": "2024-10-01", "city": "Tokyo", "image": "", '
+        '"slots": [{"data_id": "ChIJ51cu8IcbXWARiRtXIothAS4", "location": "Senso-ji", '
+        '"time": {"startTime": "09:00 AM", "endTime": "10:30 AM"}, "description": "Tokyo\'s oldest temple.", '
+        '"language": "English"',
+        ITINERARY,
+    ),
+    (
+        "braces inside strings",
+        '```json\n{"city": "Kyoto", "country": "Japan", "countryCode": "jp", "days": 2, "language": "English", '
+        '"preferences": "avoid {crowded} places"}\n```',
+        dict(KEYWORDS, preferences="avoid {crowded} places"),
+    ),
+    (
+        "question without JSON",
+        "Which country is Springfield in? There are several cities with that name.",
+        None,
+    ),
+]
+
+
+@pytest.mark.parametrize("name, text, expected", CORPUS, ids=[case[0] for case in CORPUS])
+def test_extract_json(name, text, expected):
+    assert extract_json(text) == expected
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 64])
+@pytest.mark.parametrize("name, text, expected", CORPUS, ids=[case[0] for case in CORPUS])
+def test_streamed_in_chunks(name, text, expected, chunk):
+    extractor = JsonExtractor()
+    for i in range(0, len(text), chunk):
+        extractor.feed(text[i:i + chunk])
+    assert extractor.finish() == expected
+
+
+def test_truncated_reply_is_flagged():
+    text = next(text for name, text, _ in CORPUS if name == "cut off by max_tokens")
+    extractor = JsonExtractor()
+    extractor.feed(text)
+    assert extractor.finish() == ITINERARY
+    assert extractor.truncated
+    with pytest.raises(json.JSONDecodeError):
+        extract_json(text, allow_truncated=False)
+
+
+def test_whole_reply_is_not_truncated():
+    text = "```json\n" + json.dumps(ITINERARY) + "\n```"
+    assert extract_json(text, allow_truncated=False) == ITINERARY
+    extractor = JsonExtractor()
+    extractor.feed(text)
+    extractor.finish()
+    assert not extractor.truncated
+
+
+def test_watched_objects_close_as_they_arrive():
+    days = {"itineraryItems": [dict(ITINERARY["itineraryItems"][0], day=n) for n in (1, 2)]}
+    extractor = JsonExtractor(watch=lambda parents: parents == (("{", None), ("[", "itineraryItems")))
+    text = json.dumps(days)
+    closed = []
+    for i in range(0, len(text), 16):
+        closed.extend(payload for _, payload in extractor.feed(text[i:i + 16]))
+    assert [day["day"] for day in closed] == [1, 2]
@@ -0,0 +1,71 @@
+# test_fastpath.py
+#
+# The /keyword-search fast path answers only inputs it fully understands and
+# returns None for everything else, so the model still sees preferences,
+# ambiguous places and bare numbers.
+
+import pytest
+
+from api import fastpath
+from api.fastpath import detect_language, fast_extract
+
+ANSWERED = [
+    ("3 days in Tokyo", {"city": "Tokyo", "country": "Japan", "countryCode": "jp", "days": 3, "language": "English"}),
+    ("weekend in Osaka", {"city": "Osaka", "country": "Japan", "countryCode": "jp", "days": 2, "language": "English"}),
+    (
+        "a week in Paris from 9am to 6pm",
+        {
+            "city": "Paris", "country": "France", "countryCode": "fr", "days": 7,
+            "start_time": "09:00 AM", "end_time": "06:00 PM", "language": "English",
+        },
+    ),
+    (
+        "10 days in Seoul until 8 pm",
+        {
+            "city": "Seoul", "country": "South Korea", "countryCode": "kr", "days": 10,
+            "end_time": "08:00 PM", "language": "English",
+        },
+    ),
+    (
+        "京都 2日間 9時から",
+        {
+            "city": "Kyoto", "country": "Japan", "countryCode": "jp", "days": 2,
+            "start_time": "09:00 AM", "language": "Japanese",
+        },
+    ),
+]
+
+LEFT_TO_THE_MODEL = [
+    "Tokyo",  # no language to answer in
+    "2 days in Tokyo, I love ramen",  # preferences
+    "5 days in Kyoto ending at the station",  # end location
+    "3 days in Tokyo and Kyoto",  # two cities
+    "3 days in Springfield",  # not in the gazetteer
+    "Two days in Kyoto from 9 to 5",  # bare hours are ambiguous
+    "50 days in Tokyo",  # implausible length
+]
+
+
+@pytest.mark.parametrize("text,expected", ANSWERED, ids=[text for text, _ in ANSWERED])
+def test_simple_inputs_are_answered(text, expected):
+    assert fast_extract(text) == expected
+
+
+@pytest.mark.parametrize("text", LEFT_TO_THE_MODEL)
+def test_anything_unclear_goes_to_the_model(text):
+    assert fast_extract(text) is None
+
+
+def test_language_from_script():
+    assert detect_language("서울 3일") == "Korean"
+    assert detect_language("東京") is None  # kanji alone: Japanese or Chinese
+    assert detect_language("Lisboa") is None
+
+
+def test_hit_rate(monkeypatch):
+    monkeypatch.setitem(fastpath.fastpath_stats, "attempts", 0)
+    monkeypatch.setitem(fastpath.fastpath_stats, "hits", 0)
+    assert fastpath.hit_rate() == 0.0
+    fast_extract("3 days in Tokyo")
+    fast_extract("2 days in Tokyo, I love ramen")
+    assert fastpath.hit_rate() == 0.5
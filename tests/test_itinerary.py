@@ -0,0 +1,47 @@
+# test_itinerary.py
+#
+# /itinerary and /itinerary/batch against a fake upstream: a reply that
+# holds no plan is a parse failure, never a plan, and batch reports it as an
+# error item.
+
+import asyncio
+import json
+
+import httpx
+
+from api import llm
+from bench.cpu import choice_set
+from bench.fake_llm import KEYWORD_REPLY, FakeUpstream, create_app, plan_reply
+
+TRIP = {"city": "Tokyo", "country": "Japan", "days": 1, "choices": choice_set(20)}
+
+
+def post_all(reply, requests):
+    import api.main as main
+
+    async def scenario(base_url):
+        await llm.startup("test", base_url)
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=30) as client:
+                return [await client.post(path, json=body) for path, body in requests]
+        finally:
+            await llm.shutdown()
+
+    with FakeUpstream(create_app(latency=0.01, reply=reply), port=8792) as upstream:
+        return asyncio.run(scenario(upstream.base_url))
+
+
+def test_reply_without_a_plan_fails():
+    single, batch = post_all(KEYWORD_REPLY, [("/itinerary", TRIP), ("/itinerary/batch", {"items": [TRIP]})])
+    assert single.status_code == 500
+    assert single.json() == {"detail": "Failed to parse JSON response from assistant"}
+    item, summary = (json.loads(line) for line in batch.text.splitlines())
+    assert item["status"] == "error" and item["code"] == 500
+    assert summary["summary"]["errors"] == 1
+
+
+def test_plan_reply_succeeds():
+    (response,) = post_all(plan_reply, [("/itinerary", TRIP)])
+    assert response.status_code == 200
+    assert response.json()["itineraryItems"]
@@ -0,0 +1,49 @@
+# test_llm.py
+#
+# The shared upstream client multiplexes calls: against a fake upstream that
+# takes LATENCY seconds per call, CALLS concurrent completions finish in
+# about LATENCY seconds instead of CALLS * LATENCY, and each one reaches the
+# upstream. bench/concurrency.py measures the same through the endpoints.
+
+import asyncio
+import os
+import time
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from api import llm  # noqa: E402
+from bench.fake_llm import FakeUpstream, create_app  # noqa: E402
+
+LATENCY = 0.3
+CALLS = 20
+
+
+async def complete_all(base_url: str, calls: int) -> float:
+    await llm.startup(os.environ["OPENAI_API_KEY"], base_url)
+    try:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            llm.chat_completion("gpt-4o", [{"role": "user", "content": f"trip {index}"}])
+            for index in range(calls)
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        await llm.shutdown()
+    assert all(response.choices[0].message.content for response in responses)
+    return elapsed
+
+
+def test_concurrent_calls_share_the_wait():
+    app = create_app(latency=LATENCY)
+    with FakeUpstream(app, port=8791) as upstream:
+        elapsed = asyncio.run(complete_all(upstream.base_url, CALLS))
+    assert app.state.requests == CALLS
+    # Serialized calls would take CALLS * LATENCY = 6 s
+    assert elapsed < LATENCY * 4
+
+
+def test_client_must_be_started():
+    with pytest.raises(RuntimeError, match="startup"):
+        llm.get_router()
@@ -0,0 +1,88 @@
+# test_metrics.py
+#
+# The Prometheus text rendering: histograms are cumulative with +Inf, sum
+# and count, label values are escaped, module stats are exported as gauges
+# (per label value when registered with one), and the middleware times each
+# request by its route and status, unknown paths as "unmatched".
+
+import asyncio
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+from api import metrics
+
+
+def test_histogram_is_cumulative():
+    histogram = metrics.Histogram("wait_seconds", "Wait.", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.observe(value, route="/x")
+    lines = histogram.render()
+    assert 'wait_seconds_bucket{route="/x",le="0.1"} 1' in lines
+    assert 'wait_seconds_bucket{route="/x",le="1"} 3' in lines
+    assert 'wait_seconds_bucket{route="/x",le="+Inf"} 4' in lines
+    assert 'wait_seconds_sum{route="/x"} 4.05' in lines
+    assert 'wait_seconds_count{route="/x"} 4' in lines
+    assert lines[:2] == ["# HELP wait_seconds Wait.", "# TYPE wait_seconds histogram"]
+
+
+def test_counter_escapes_label_values():
+    counter = metrics.Counter("errors_total", "Errors.", ("detail",))
+    counter.inc(detail='say "hi"\nnow')
+    counter.inc(2, detail='say "hi"\nnow')
+    assert counter.render()[-1] == 'errors_total{detail="say \\"hi\\"\\nnow"} 3'
+
+
+def test_registered_stats_become_gauges(monkeypatch):
+    monkeypatch.setattr(metrics, "_collectors", {})
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    metrics.register_stats("cache", lambda: {"hits": 3, "hit_rate": 0.75, "enabled": True, "backend": "disk", "raw": [1]})
+    metrics.register_stats("queue", lambda: {"queued": 2, "batch": {"admitted": 5}, "keyword": {"admitted": 1}}, label="kind")
+    lines = metrics.render().splitlines()
+    assert "cache_hits 3" in lines
+    assert "cache_hit_rate 0.75" in lines
+    assert "cache_enabled 1" in lines
+    assert 'cache_backend{backend="disk"} 1' in lines
+    assert not any(line.startswith("cache_raw") for line in lines)
+    assert "queue_queued 2" in lines  # a total next to the labelled groups
+    assert 'queue_admitted{kind="batch"} 5' in lines
+    assert 'queue_admitted{kind="keyword"} 1' in lines
+    assert lines.count("# TYPE queue_admitted gauge") == 1
+
+
+def test_middleware_times_requests_by_route_and_status(monkeypatch):
+    monkeypatch.setattr(metrics, "http_duration", metrics.Histogram("d", "d", ("route", "method", "status")))
+    monkeypatch.setattr(metrics, "parse_failures", metrics.Counter("p", "p", ("route",)))
+    app = FastAPI()
+
+    @app.post("/fail")
+    async def fail():
+        metrics.record_parse_failure()
+        raise HTTPException(status_code=500, detail="no")
+
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+            await client.post("/fail")
+            await client.get("/nowhere")
+
+    asyncio.run(scenario())
+    assert set(metrics.http_duration.series) == {("/fail", "POST", 500), ("unmatched", "GET", 404)}
+    assert metrics.parse_failures.values == {("/fail",): 1}
+
+
+def test_metrics_endpoint_serves_the_app_stats():
+    import api.main as main
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://app") as client:
+            return await client.get("/metrics")
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 200
+    body = response.text
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'admission_admitted{kind="keyword"}' in body
+    assert "fastpath_hit_rate" in body
+    assert 'sessions_backend{backend="memory"} 1' in body
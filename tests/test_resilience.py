@@ -0,0 +1,161 @@
+# test_resilience.py
+#
+# Upstream failure handling: only rate limits and 5xx are retried, backoff
+# is jittered but honours Retry-After, retries stay within their budget, and
+# the circuit breaker opens after consecutive failures, lets one probe
+# through once half-open, and closes again on success.
+
+import asyncio
+import random
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from api.providers import Provider, ProviderError
+from api.resilience import CircuitBreaker, CircuitOpenError, RetryBudget, backoff, classify, retry_after
+from api.router import Router
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def status_error(status: int, headers=None) -> openai.APIStatusError:
+    request = httpx.Request("POST", "https://upstream/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return openai.APIStatusError("upstream", response=response, body=None)
+
+
+def test_classify():
+    request = httpx.Request("POST", "https://upstream/v1/chat/completions")
+    assert classify(status_error(429)) == "rate_limit"
+    assert classify(status_error(503)) == "server"
+    assert classify(status_error(400)) is None
+    assert classify(openai.APITimeoutError(request)) == "timeout"
+    assert classify(openai.APIConnectionError(request=request)) == "connection"
+    assert classify(ProviderError("mistral", "broken")) == "server"
+    assert classify(CircuitOpenError("gpt-4o", 5)) is None
+    assert classify(ValueError("bug")) is None
+
+
+def test_backoff_is_jittered_capped_and_honours_the_hint():
+    rng = random.Random(1)
+    delays = [backoff(attempt, rng=rng) for attempt in range(10) for _ in range(20)]
+    assert min(delays) >= 0 and max(delays) <= 8
+    assert backoff(0, hint=3.0, rng=rng) >= 3.0
+    assert backoff(0, hint=600, rng=rng) <= 8  # a huge hint is capped
+    assert retry_after(status_error(429, {"retry-after": "2"})) == 2.0
+    assert retry_after(status_error(429)) is None
+
+
+def test_retry_budget():
+    clock = Clock()
+    budget = RetryBudget(ratio=0.5, minimum=1, window=10, clock=clock)
+    for _ in range(4):
+        budget.record_call()
+    assert [budget.try_retry() for _ in range(4)] == [True, True, True, False]  # 1 + 0.5 * 4
+    clock.now += 11
+    assert budget.try_retry()  # the window moved on
+
+
+def test_breaker_opens_then_probes_then_closes():
+    clock = Clock()
+    breaker = CircuitBreaker(failures=3, reset=30, clock=clock)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.available()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.available()
+    assert breaker.retry_in() == 30
+    clock.now += 30
+    assert breaker.available() and breaker.state == "half_open"
+    breaker.before_call()
+    assert not breaker.available()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.consecutive == 0
+    assert breaker.opens == 1
+
+
+def test_failed_probe_reopens_the_breaker():
+    clock = Clock()
+    breaker = CircuitBreaker(failures=1, reset=30, clock=clock)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.available()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.retry_in() == 30
+    assert breaker.opens == 2
+
+
+def test_cancelled_probe_frees_the_slot():
+    clock = Clock()
+    breaker = CircuitBreaker(failures=1, reset=30, clock=clock)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.available()
+    breaker.before_call()
+    breaker.record_cancel()
+    assert breaker.available() and breaker.state == "half_open"
+
+
+class FailingProvider(Provider):
+    """Fails its first ``failures`` calls with ``error``, then answers."""
+
+    def __init__(self, error, failures=1_000):
+        self.name = "openai"
+        self.error = error
+        self.failures = failures
+        self.calls = 0
+
+    async def complete(self, model, messages, timeout, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+
+def single_route_router(provider) -> Router:
+    return Router([provider], {"gpt-4o": ["openai:gpt-4o"]}, rng=random.Random(0))
+
+
+def test_transient_failures_are_retried(monkeypatch):
+    monkeypatch.setattr("api.router.backoff", lambda attempt, hint=None, rng=None: 0.0)
+    provider = FailingProvider(status_error(503), failures=2)
+    router = single_route_router(provider)
+    response = asyncio.run(router.complete("gpt-4o", [], timeout=5))
+    assert response.choices[0].message.content == "ok"
+    assert provider.calls == 3
+
+
+def test_client_errors_are_not_retried():
+    provider = FailingProvider(status_error(400))
+    router = single_route_router(provider)
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(router.complete("gpt-4o", [], timeout=5))
+    assert provider.calls == 1
+
+
+def test_open_breaker_fails_fast(monkeypatch):
+    monkeypatch.setattr("api.router.backoff", lambda attempt, hint=None, rng=None: 0.0)
+    provider = FailingProvider(status_error(500))
+    router = single_route_router(provider)
+
+    async def scenario():
+        for _ in range(5):  # retried 5xx count too, so this opens within a few calls
+            with pytest.raises(openai.APIError):
+                await router.complete("gpt-4o", [], timeout=5)
+        assert router.snapshot()["openai:gpt-4o"]["breaker"] == "open"
+        calls = provider.calls
+        with pytest.raises(CircuitOpenError) as opened:
+            await router.complete("gpt-4o", [], timeout=5)
+        assert provider.calls == calls  # upstream never called
+        assert opened.value.retry_after > 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,146 @@
+# test_router.py
+#
+# The provider router with scripted in-process providers: calls go to the
+# fastest healthy option, a call running past the primary's hedge delay
+# starts a backup and the loser is cancelled, and both hedge counters land on
+# the hedged primary.
+
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from api.providers import Provider, ProviderError
+from api.router import Router
+
+ROUTES = {"gpt-4o": ["openai:gpt-4o", "mistral:mistral-large-latest"]}
+PRIMARY, BACKUP = ("openai", "gpt-4o"), ("mistral", "mistral-large-latest")
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+class NoExplore(random.Random):
+    """Never sends a call to the runner-up just to measure it."""
+
+    def random(self):
+        return 1.0
+
+
+class ScriptedProvider(Provider):
+    """Answers after ``delay`` seconds, or raises ``error``; records cancelled calls."""
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def complete(self, model, messages, timeout, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.name))])
+
+
+def make_router(primary, backup, **kwargs):
+    return Router([primary, backup], ROUTES, rng=NoExplore(), **kwargs)
+
+
+def served_by(response) -> str:
+    return response.choices[0].message.content
+
+
+def test_fastest_healthy_option_wins():
+    router = make_router(ScriptedProvider("openai"), ScriptedProvider("mistral"))
+    for _ in range(5):
+        router._stats(PRIMARY).record(0.8, True)
+        router._stats(BACKUP).record(0.2, True)
+    assert router.rank("gpt-4o") == [BACKUP, PRIMARY]
+    for _ in range(6):
+        router._stats(BACKUP).record(1.0, False)
+    assert router.rank("gpt-4o") == [PRIMARY, BACKUP]  # unhealthy goes last, however fast
+
+
+def test_unknown_provider_is_skipped():
+    router = Router([ScriptedProvider("openai")], ROUTES, rng=NoExplore())
+    assert router.options("gpt-4o") == [PRIMARY]
+    with pytest.raises(ValueError):
+        router.options("mistral:small")
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    async def scenario():
+        primary, backup = ScriptedProvider("openai", delay=5), ScriptedProvider("mistral", delay=0.01)
+        router = make_router(primary, backup, hedge=True, hedge_min_delay=0.05)
+        router._stats(PRIMARY).record(0.01, True)  # a latency to hedge after
+        response = await router.complete("gpt-4o", MESSAGES, timeout=10)
+        await asyncio.sleep(0)
+        assert served_by(response) == "mistral"
+        assert primary.cancelled == 1
+        stats = router.snapshot()
+        assert stats["openai:gpt-4o"]["hedges"] == 1
+        assert stats["openai:gpt-4o"]["hedge_wins"] == 1
+        assert stats["mistral:mistral-large-latest"]["hedges"] == 0
+        assert stats["mistral:mistral-large-latest"]["hedge_wins"] == 0
+        assert stats["openai:gpt-4o"]["breaker"] == "closed"  # a cancelled hedge is no failure
+        assert stats["openai:gpt-4o"]["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_primary_that_answers_first_cancels_the_backup():
+    async def scenario():
+        primary, backup = ScriptedProvider("openai", delay=0.1), ScriptedProvider("mistral", delay=5)
+        router = make_router(primary, backup, hedge=True, hedge_min_delay=0.02)
+        router._stats(PRIMARY).record(0.01, True)
+        response = await router.complete("gpt-4o", MESSAGES, timeout=10)
+        await asyncio.sleep(0)
+        assert served_by(response) == "openai"
+        assert backup.calls == 1 and backup.cancelled == 1
+        stats = router.snapshot()["openai:gpt-4o"]
+        assert stats["hedges"] == 1 and stats["hedge_wins"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_caller_going_away_cancels_both_calls():
+    async def scenario():
+        primary, backup = ScriptedProvider("openai", delay=5), ScriptedProvider("mistral", delay=5)
+        router = make_router(primary, backup, hedge=True, hedge_min_delay=0.01)
+        router._stats(PRIMARY).record(0.01, True)
+        call = asyncio.ensure_future(router.complete("gpt-4o", MESSAGES, timeout=10))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+        assert primary.cancelled == 1 and backup.cancelled == 1
+
+    asyncio.run(scenario())
+
+
+def test_no_hedge_without_a_latency_sample():
+    async def scenario():
+        primary, backup = ScriptedProvider("openai", delay=0.05), ScriptedProvider("mistral")
+        router = make_router(primary, backup, hedge=True, hedge_min_delay=0.0)
+        assert served_by(await router.complete("gpt-4o", MESSAGES, timeout=10)) == "openai"
+        assert backup.calls == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_backup_does_not_hide_the_primary_answer():
+    async def scenario():
+        primary = ScriptedProvider("openai", delay=0.1)
+        backup = ScriptedProvider("mistral", error=ProviderError("mistral", "bad request", 400))
+        router = make_router(primary, backup, hedge=True, hedge_min_delay=0.02)
+        router._stats(PRIMARY).record(0.01, True)
+        assert served_by(await router.complete("gpt-4o", MESSAGES, timeout=10)) == "openai"
+
+    asyncio.run(scenario())
@@ -0,0 +1,116 @@
+# test_schedule.py
+#
+# Property tests for the deterministic scheduler on randomly generated
+# trips: built and repaired itineraries never overlap, stay inside the trip
+# window, only visit open places, use each place once, and repairing twice
+# changes nothing. Each seed is one reproducible trip.
+
+import copy
+import os
+import random
+
+import pytest
+
+from api.hours import format_time
+from api.schedule import Scheduler
+
+TRIALS = int(os.getenv("SCHEDULE_TRIALS", "300"))
+HARD_RULES = {"overlap", "before_start", "after_end", "closed", "bad_time", "unknown_place"}
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+def random_hours(rng: random.Random):
+    roll = rng.random()
+    if roll < 0.3:
+        return None
+    if roll < 0.4:
+        return "Open 24 hours"
+    opening = rng.choice([7, 8, 9, 10, 11, 17])
+    closing = opening + rng.choice([3, 6, 8, 10, 13])
+    text = f"{format_time(opening * 60)}–{format_time(closing * 60)}"
+    if roll < 0.7:
+        return text
+    return {day: ("Closed" if rng.random() < 0.15 else text) for day in WEEKDAYS}
+
+
+def random_choices(rng: random.Random, count: int):
+    choices = []
+    for index in range(count):
+        kind = rng.choices(["Activity", "Lunch", "Dinner"], weights=[6, 2, 2])[0]
+        choice = {"data_id": f"p{index}", "category": kind, "title": f"{kind} {index}"}
+        hours = random_hours(rng)
+        if hours is not None:
+            choice["operating_hours"] = hours
+        if rng.random() < 0.8:
+            choice["gps_coordinates"] = {
+                "latitude": 35.68 + rng.gauss(0, 0.04),
+                "longitude": 139.76 + rng.gauss(0, 0.05),
+            }
+        choices.append(choice)
+    return choices
+
+
+def random_window(rng: random.Random):
+    start = rng.choice([None, "08:00 AM", "09:30 AM", "11:00 AM"])
+    end = rng.choice([None, "06:00 PM", "08:00 PM", "10:30 PM"])
+    return start, end
+
+
+def random_itinerary(rng: random.Random, choices, days: int):
+    """A plausible but sloppy model answer: shuffled, overlapping, gappy."""
+    picked = rng.sample(choices, min(len(choices), days * rng.randint(2, 6)))
+    items = []
+    for number in range(1, days + 1):
+        slots = []
+        clock = rng.choice([7, 8, 9, 10]) * 60
+        for choice in picked[number - 1::days]:
+            clock += rng.choice([-30, 0, 15, 30, 90, 150])
+            length = rng.choice([0, 30, 60, 90, 120])
+            slots.append({
+                "data_id": choice["data_id"],
+                "location": choice["title"],
+                "time": {"startTime": format_time(clock), "endTime": format_time(clock + length)},
+                "description": "",
+                "language": "English",
+            })
+            clock += length
+        date = f"2024-10-{number:02d}" if rng.random() < 0.5 else ""
+        items.append({"day": number, "dates": date, "city": "Tokyo", "image": "", "slots": slots})
+    return {"itineraryItems": items}
+
+
+def used_ids(itinerary):
+    return [slot["data_id"] for day in itinerary["itineraryItems"] for slot in day["slots"]]
+
+
+@pytest.mark.parametrize("seed", range(TRIALS))
+def test_scheduler_invariants(seed):
+    rng = random.Random(seed)
+    choices = random_choices(rng, rng.randint(3, 40))
+    days = rng.randint(1, 3)
+    start, end = random_window(rng)
+    valid_ids = {c["data_id"] for c in choices}
+
+    # Building from ordered lists.
+    plans = [choices[d::days] for d in range(days)]
+    built = Scheduler(choices, start, end).build(plans, city="Tokyo", language="English")
+    hard = [p for p in Scheduler(choices, start, end).check(built) if p["rule"] in HARD_RULES]
+    assert not hard, ("build", hard)
+    ids = used_ids(built)
+    assert len(ids) == len(set(ids)) and set(ids) <= valid_ids, ("build ids", ids)
+
+    # Repairing a sloppy model answer.
+    itinerary = random_itinerary(rng, choices, days)
+    repaired = copy.deepcopy(itinerary)
+    Scheduler(choices, start, end).repair(repaired)
+    after = Scheduler(choices, start, end).check(repaired)
+    hard = [p for p in after if p["rule"] in HARD_RULES]
+    assert not hard, ("repair", hard)
+    ids = used_ids(repaired)
+    assert len(ids) == len(set(ids)) and set(ids) <= valid_ids, ("repair ids", ids)
+    assert set(used_ids(itinerary)) >= set(ids) - {c["data_id"] for c in choices if c["category"] != "Activity"}
+
+    # Repair is idempotent.
+    again = copy.deepcopy(repaired)
+    Scheduler(choices, start, end).repair(again)
+    assert again == repaired, "repair is not idempotent"
@@ -0,0 +1,205 @@
+# test_sessions.py
+#
+# The in-memory session store: least recently used sessions are evicted past
+# max_sessions, idle ones expire after idle_ttl, and histories over the
+# per-session caps lose their oldest turns but keep the system prompt and the
+# latest turn. The SQLite store shared by workers: histories survive a
+# reopen, writes are buffered until a flush, and the same TTL and size limits
+# apply to the rows.
+
+import asyncio
+import threading
+
+import pytest
+
+from api.sessions import SessionStore, SqliteSessionStore, create_session_store, trim_history
+
+SYSTEM = {"role": "system", "content": "You parse trips."}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def turn(text: str, role: str = "user") -> dict:
+    return {"role": role, "content": text}
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(max_sessions=2, clock=Clock())
+    store["a"] = [turn("a")]
+    store["b"] = [turn("b")]
+    assert store.get("a") == [turn("a")]  # "b" is now the oldest
+    store["c"] = [turn("c")]
+    assert "b" not in store
+    assert store.get("a") == [turn("a")] and store.get("c") == [turn("c")]
+    assert store.stats()["evictions"] == 1
+    assert len(store) == 2
+
+
+def test_idle_session_expires():
+    clock = Clock()
+    store = SessionStore(idle_ttl=60, clock=clock)
+    store["a"] = [turn("a")]
+    clock.now += 59
+    assert store.get("a") == [turn("a")]  # reading refreshes last_seen
+    clock.now += 59
+    assert store.get("a") == [turn("a")]
+    clock.now += 61
+    assert store.get("a") is None
+    assert store.stats()["expirations"] == 1
+
+
+def test_expired_sessions_are_dropped_on_write():
+    clock = Clock()
+    store = SessionStore(idle_ttl=60, clock=clock)
+    store["a"] = [turn("a")]
+    clock.now += 61
+    store["b"] = [turn("b")]
+    assert len(store) == 1
+
+
+def test_missing_session():
+    store = SessionStore()
+    assert store.get("nope", []) == []
+    with pytest.raises(KeyError):
+        store["nope"]
+    assert store.pop("nope", "gone") == "gone"
+    assert store.stats()["misses"] == 2
+
+
+def test_oversized_history_is_trimmed_on_write():
+    store = SessionStore(max_bytes=100, max_tokens=10_000)
+    history = [SYSTEM] + [turn(f"{index} " + "x" * 40) for index in range(5)]
+    store["a"] = history
+    kept = store.get("a")
+    assert kept[0] == SYSTEM and kept[-1] == history[-1]
+    assert len(kept) < len(history)
+    assert store.stats()["trims"] == 1
+
+
+def test_trim_keeps_the_latest_turn_even_over_the_cap():
+    history = [SYSTEM, turn("x" * 500)]
+    assert trim_history(history, max_bytes=10, max_tokens=10) == history
+
+
+def test_trim_leaves_small_histories_alone():
+    history = [SYSTEM, turn("hello")]
+    assert trim_history(history, max_bytes=1000, max_tokens=1000) is history
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_session_store("redis")
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    stores = []
+
+    def open_store(**kwargs):
+        # A long write delay and batch so only the test decides when to flush
+        options = {"write_delay": 60, "write_batch": 1000, **kwargs}
+        store = SqliteSessionStore(str(tmp_path / "sessions.db"), **options)
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+
+def test_sqlite_round_trip(sqlite_store):
+    history = [SYSTEM, turn("Two days in Kyoto"), turn('{"city": "Kyoto"}', "assistant")]
+    store = sqlite_store()
+    store["a"] = history
+    store.close()
+    reopened = sqlite_store()
+    assert reopened.get("a") == history
+    assert "b" not in reopened
+    assert len(reopened) == 1
+
+
+def test_sqlite_reads_pending_writes_before_a_flush(sqlite_store):
+    store = sqlite_store()
+    store["a"] = [turn("a")]
+    assert store.stats()["flushes"] == 0
+    assert asyncio.run(store.get_async("a")) == [turn("a")]
+    assert store.stats()["size"] == 0  # stats() never flushes
+    assert len(store) == 1
+    assert store.stats()["size"] == 1
+
+
+def test_sqlite_reads_are_copies(sqlite_store):
+    store = sqlite_store()
+    store["a"] = [turn("a")]
+    store.flush()
+    store.get("a").append(turn("b"))
+    assert store.get("a") == [turn("a")]
+    assert store.stats()["cache_hits"] >= 1
+
+
+def test_sqlite_idle_session_expires(sqlite_store):
+    clock = Clock()
+    store = sqlite_store(idle_ttl=60, clock=clock)
+    store["a"] = [turn("a")]
+    store.flush()
+    clock.now += 61
+    assert store.get("a") is None
+    store["b"] = [turn("b")]
+    store.flush()  # deletes the expired row
+    assert len(store) == 1
+    assert store.stats()["expirations"] == 1
+
+
+def test_sqlite_oldest_sessions_are_evicted(sqlite_store):
+    clock = Clock()
+    store = sqlite_store(max_sessions=2, clock=clock)
+    for session_id in "abc":
+        clock.now += 1
+        store[session_id] = [turn(session_id)]
+    store.flush()
+    assert store.get("a") is None
+    assert store.get("c") == [turn("c")]
+    assert store.stats()["evictions"] == 1
+
+
+def test_sqlite_pop_and_clear(sqlite_store):
+    store = sqlite_store()
+    store["a"] = [turn("a")]
+    store["b"] = [turn("b")]
+    store.flush()
+    assert store.pop("a") == [turn("a")]
+    assert store.get("a") is None
+    del store["b"]
+    assert len(store) == 0
+    store["c"] = [turn("c")]
+    store.clear()
+    assert store.get("c") is None
+
+
+def test_sqlite_concurrent_readers_and_writers(sqlite_store):
+    store = sqlite_store(write_delay=0.01, write_batch=4)
+    errors = []
+
+    def worker(index: int):
+        try:
+            for step in range(25):
+                session_id = f"s{index}-{step % 5}"
+                store[session_id] = [turn(f"{index} {step}")]
+                if store.get(session_id) is None:
+                    errors.append(session_id)
+        except Exception as err:  # any sqlite error fails the test
+            errors.append(err)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(store) == 40
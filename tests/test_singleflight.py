@@ -0,0 +1,114 @@
+# test_singleflight.py
+#
+# Identical in-flight work runs once: concurrent callers with the same key
+# share one result or one error, a new call starts once the first finished,
+# a cancelled waiter leaves the work running for the others, and the work is
+# cancelled only when every waiter has gone.
+
+import asyncio
+
+import pytest
+
+from api.singleflight import SingleFlight
+
+
+class Work:
+    """An upstream stand-in that counts its calls and finishes when released."""
+
+    def __init__(self, result="plan", error=None):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.cancelled = False
+        self.result = result
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_calls_collapse():
+    async def scenario():
+        flights, work = SingleFlight("test"), Work()
+        waiters = [asyncio.ensure_future(flights.run("key", work)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert len(flights) == 1
+        work.release.set()
+        results = await asyncio.gather(*waiters)
+        assert work.calls == 1
+        assert [result for result, _ in results] == ["plan"] * 5
+        assert sorted(shared for _, shared in results) == [False] + [True] * 4
+        assert flights.stats["calls"] == 1 and flights.stats["coalesced"] == 4
+        assert len(flights) == 0
+
+    asyncio.run(scenario())
+
+
+def test_errors_fan_out_to_every_waiter():
+    async def scenario():
+        flights, work = SingleFlight("test"), Work(error=ValueError("upstream broke"))
+        waiters = [asyncio.ensure_future(flights.run("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        work.release.set()
+        outcomes = await asyncio.gather(*waiters, return_exceptions=True)
+        assert work.calls == 1
+        assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+        assert flights.stats["errors"] == 1
+        # The failure is not remembered: the next call tries again
+        retry = Work()
+        retry.release.set()
+        assert await flights.run("key", retry) == ("plan", False)
+
+    asyncio.run(scenario())
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flights, first, second = SingleFlight("test"), Work("a"), Work("b")
+        first.release.set()
+        second.release.set()
+        results = await asyncio.gather(flights.run("a", first), flights.run("b", second))
+        assert results == [("a", False), ("b", False)]
+        assert first.calls == second.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_work_to_the_others():
+    async def scenario():
+        flights, work = SingleFlight("test"), Work()
+        gone = asyncio.ensure_future(flights.run("key", work))
+        staying = asyncio.ensure_future(flights.run("key", work))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.sleep(0)
+        assert not work.cancelled
+        work.release.set()
+        assert await staying == ("plan", True)
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+
+    asyncio.run(scenario())
+
+
+def test_work_is_cancelled_when_every_waiter_is_gone():
+    async def scenario():
+        flights, work = SingleFlight("test"), Work()
+        waiters = [asyncio.ensure_future(flights.run("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert work.cancelled
+        assert flights.stats["cancelled"] == 1
+        assert len(flights) == 0
+
+    asyncio.run(scenario())